@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+批量请求流式解析 - 从请求流中逐项读出图像，读完一项立即分发处理
+JSON请求逐项解析images数组；multipart请求逐个接收image文件部分（不需要base64），
+不再一次性读入整个请求体：缓冲区只保存当前正在读取的一项，
+并发处理的项数有上限，读取在处理槽位占满时暂停，峰值内存由并发数决定而不是请求体大小
+"""
+
+import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+WHITESPACE = b' \t\r\n'
+# 顶层标量值（数字、true/false/null）的结束字符
+SCALAR_END = b',]} \t\r\n'
+
+
+def check_item_count(count: int, max_items: int):
+    """批量项数超过上限（0为不限制）时抛出ValueError"""
+    if max_items and count > max_items:
+        raise ValueError(f"批量项数超过上限{max_items}")
+
+
+class JsonArrayStream:
+    """顶层JSON对象的增量解析器：array_key对应的数组逐项产出，其余成员解析后放入fields
+
+    fields只包含已读到的成员，位于数组之后的成员在items()迭代结束后才可用；
+    数组项数超过max_items（0为不限制）时在读取多出的一项之前抛出ValueError
+    """
+
+    def __init__(self, stream, array_key: str = 'images', chunk_size: int = 64 * 1024,
+                 max_item_bytes: int = 0, max_items: int = 0):
+        self.stream = stream
+        self.array_key = array_key
+        self.chunk_size = chunk_size
+        self.max_item_bytes = max_item_bytes
+        self.max_items = max_items
+        self.fields: Dict = {}
+        self.found_array = False
+        self.item_count = 0
+        self.bytes_read = 0
+
+        self._buf = bytearray()
+        self._pos = 0
+        self._eof = False
+
+    def items(self) -> Iterator:
+        """依次产出数组中的每一项（已解析的JSON值）"""
+        if self._next_token() != ord('{'):
+            raise ValueError("请求数据格式错误，需要JSON对象")
+        self._pos += 1
+
+        if self._next_token() == ord('}'):
+            self._pos += 1
+            self._expect_end()
+            return
+
+        while True:
+            key = self._read_key()
+            if key == self.array_key:
+                if self._next_token() != ord('['):
+                    raise ValueError(f"{self.array_key}必须是数组格式")
+                self._pos += 1
+                self.found_array = True
+                yield from self._array_items()
+            else:
+                self.fields[key] = self._read_value()
+
+            token = self._next_token()
+            self._pos += 1
+            if token == ord('}'):
+                break
+            if token is None:
+                raise ValueError(self._error("请求数据不完整"))
+            if token != ord(','):
+                raise ValueError(self._error("对象成员之间缺少逗号"))
+        self._expect_end()
+
+    def _array_items(self) -> Iterator:
+        if self._next_token() == ord(']'):
+            self._pos += 1
+            return
+        while True:
+            self.item_count += 1
+            check_item_count(self.item_count, self.max_items)
+            yield self._read_value()
+            token = self._next_token()
+            self._pos += 1
+            if token == ord(']'):
+                return
+            if token is None:
+                raise ValueError(self._error("请求数据不完整"))
+            if token != ord(','):
+                raise ValueError(self._error("数组元素之间缺少逗号"))
+
+    def _read_key(self) -> str:
+        if self._next_token() != ord('"'):
+            raise ValueError(self._error("对象成员名必须是字符串"))
+        key = self._read_value()
+        if self._next_token() != ord(':'):
+            raise ValueError(self._error("对象成员名后缺少冒号"))
+        self._pos += 1
+        return key
+
+    def _read_value(self):
+        """找到当前值的结束位置并解析；只在完整读入一个值后调用json.loads"""
+        self._next_token()
+        # 值从缓冲区开头开始，读取过程中_fill不再移动已缓冲的数据
+        del self._buf[:self._pos]
+        self._pos = 0
+        start = 0
+        i = start
+        depth = 0
+        while True:
+            if i >= len(self._buf):
+                self._check_item_size(i - start)
+                if not self._fill():
+                    if depth == 0 and i > start:
+                        break
+                    raise ValueError(self._error("请求数据不完整"))
+                continue
+
+            c = self._buf[i]
+            if c == 0x22:  # '"'
+                i = self._string_end(i + 1)
+                if depth == 0:
+                    break
+            elif c in b'{[':
+                depth += 1
+                i += 1
+            elif c in b'}]':
+                if depth == 0:
+                    break
+                depth -= 1
+                i += 1
+                if depth == 0:
+                    break
+            elif depth == 0 and c in SCALAR_END:
+                break
+            else:
+                i += 1
+
+        self._check_item_size(i - start)
+        try:
+            value = json.loads(bytes(self._buf[start:i]))
+        except ValueError as e:
+            raise ValueError(self._error(f"JSON解析失败: {e}"))
+        self._pos = i
+        return value
+
+    def _string_end(self, i: int) -> int:
+        """从字符串内容起点i找到结束引号，返回引号之后的位置；字符串内部用bytes.find跳过，不逐字节循环"""
+        while True:
+            quote = self._buf.find(b'"', i)
+            if quote < 0:
+                i = len(self._buf)
+                if not self._fill():
+                    raise ValueError(self._error("字符串未结束"))
+                continue
+            backslashes = 0
+            k = quote - 1
+            while self._buf[k] == 0x5c:  # '\\'
+                backslashes += 1
+                k -= 1
+            if backslashes % 2 == 0:
+                return quote + 1
+            i = quote + 1
+
+    def _next_token(self) -> Optional[int]:
+        """跳过空白，返回下一个字节（不消费）；数据结束时返回None"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return None
+
+    def _fill(self) -> bool:
+        """读入下一块数据；先丢弃已消费的部分，缓冲区只保留当前值"""
+        if self._eof:
+            return False
+        if self._pos:
+            del self._buf[:self._pos]
+            self._pos = 0
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self.bytes_read += len(chunk)
+        self._buf += chunk
+        return True
+
+    def _check_item_size(self, size: int):
+        if self.max_item_bytes and size > self.max_item_bytes:
+            raise ValueError(f"单项数据超过上限{self.max_item_bytes}字节")
+
+    def _expect_end(self):
+        if self._next_token() is not None:
+            raise ValueError(self._error("JSON对象之后有多余数据"))
+
+    def _error(self, message: str) -> str:
+        return f"{message}（位置约{self.bytes_read - len(self._buf) + self._pos}字节）"
+
+
+class SpooledPart:
+    """multipart请求中的一个图像部分：内容暂存在内存，超过spool_memory后转存临时文件"""
+
+    def __init__(self, filename: Optional[str], spool_memory: int, user_id: Optional[str] = None,
+                 timeout_ms: Optional[str] = None):
+        self.filename = filename
+        self.user_id = user_id
+        self.timeout_ms = timeout_ms
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_memory)
+
+    def read(self) -> bytes:
+        """读出全部内容并释放暂存空间"""
+        try:
+            self.file.seek(0)
+            return self.file.read()
+        finally:
+            self.file.close()
+
+    def close(self):
+        self.file.close()
+
+
+class MultipartBatchStream:
+    """multipart/form-data批量请求的增量解析器：每接收完一个file_field文件部分就产出一个SpooledPart
+
+    user_id、timeout_ms字段作用于其后的下一个图像部分；其余普通字段放入fields；
+    图像部分数超过max_items（0为不限制）时在接收多出的一个部分之前抛出ValueError
+    """
+
+    ITEM_FIELDS = ('user_id', 'timeout_ms')
+
+    def __init__(self, stream, boundary: str, file_field: str = 'image', chunk_size: int = 64 * 1024,
+                 max_item_bytes: int = 0, spool_memory: int = 1024 * 1024, max_field_bytes: int = 64 * 1024,
+                 max_items: int = 0):
+        self.stream = stream
+        self.file_field = file_field
+        self.chunk_size = chunk_size
+        self.max_item_bytes = max_item_bytes
+        self.max_items = max_items
+        self.spool_memory = spool_memory
+        self.fields: Dict = {}
+        self.part_count = 0
+        self.bytes_read = 0
+
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=max_field_bytes)
+
+    @property
+    def found_array(self) -> bool:
+        return self.part_count > 0
+
+    def items(self) -> Iterator[SpooledPart]:
+        """依次产出图像部分；同名字段重复出现时后者覆盖前者"""
+        pending: Dict = {}
+        part = None
+        field_name = None
+        field_data: List[bytes] = []
+
+        try:
+            while True:
+                chunk = self.stream.read(self.chunk_size)
+                self.bytes_read += len(chunk)
+                # 传入None表示请求体结束
+                self._decoder.receive_data(chunk or None)
+                event = self._decoder.next_event()
+                while not isinstance(event, (Epilogue, NeedData)):
+                    if isinstance(event, File) and event.name == self.file_field:
+                        # 图像部分依次接收，此时之前的部分都已完整产出
+                        check_item_count(self.part_count + 1, self.max_items)
+                        part = SpooledPart(event.filename, self.spool_memory, pending.get('user_id'),
+                                           pending.get('timeout_ms'))
+                        pending = {}
+                    elif isinstance(event, (Field, File)):
+                        # 其他文件部分按普通字段处理（同样受字段大小限制）
+                        field_name = event.name
+                        field_data = []
+                    elif isinstance(event, Data):
+                        if part is not None:
+                            part.size += len(event.data)
+                            if self.max_item_bytes and part.size > self.max_item_bytes:
+                                raise ValueError(f"单项数据超过上限{self.max_item_bytes}字节")
+                            part.file.write(event.data)
+                            if not event.more_data:
+                                self.part_count += 1
+                                ready, part = part, None
+                                yield ready
+                        else:
+                            field_data.append(event.data)
+                            if not event.more_data:
+                                value = b''.join(field_data).decode('utf-8', 'replace')
+                                if field_name in self.ITEM_FIELDS:
+                                    pending[field_name] = value
+                                else:
+                                    self.fields[field_name] = value
+                                field_name = None
+                    event = self._decoder.next_event()
+
+                if isinstance(event, Epilogue):
+                    return
+                if not chunk:
+                    raise ValueError("请求数据不完整")
+        except ValueError:
+            raise
+        except Exception as e:
+            # werkzeug的格式错误和字段超限（RequestEntityTooLarge）按请求错误处理
+            raise ValueError(f"multipart数据解析失败: {e}")
+        finally:
+            if part is not None:
+                part.close()
+
+
+def run_bounded(items: Iterable, worker: Callable[[int, object], Dict], concurrency: int) -> List[Dict]:
+    """以最多concurrency个并发处理items，按输入顺序返回worker(序号, 项)的结果
+
+    处理槽位占满时不再从items取下一项（流式解析随之暂停读取请求体）；
+    worker需要自行把异常转换为失败结果
+    """
+    concurrency = max(1, concurrency)
+    slots = threading.BoundedSemaphore(concurrency)
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as executor:
+        iterator = iter(items)
+        while True:
+            slots.acquire()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                slots.release()
+                break
+            except BaseException:
+                slots.release()
+                raise
+            future = executor.submit(worker, len(futures), item)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+            del item
+
+    return [future.result() for future in futures]
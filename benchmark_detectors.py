@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+人脸检测后端基准测试 - 各后端的延迟和召回率
+在一组图片上分别运行每个检测后端，统计中位数/p95延迟，
+并与标注的人脸数比较得到召回率（未提供标注时按每张图1个人脸计）
+
+标注文件为JSON：{"admin.jpg": 1, "group.jpg": 6}
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from config_loader import get_section
+from face_detectors import DETECTOR_BACKENDS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def load_images(image_dir: str) -> dict:
+    """读取目录下的图片为RGB数组"""
+    images = {}
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(image_dir, name), cv2.IMREAD_COLOR)
+        if image is not None:
+            images[name] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return images
+
+
+def benchmark_backend(detector, images: dict, expected: dict, repeat: int) -> dict:
+    """单个后端：每张图先预热一次，再计时repeat次"""
+    latencies = []
+    detected_faces = 0
+    expected_faces = 0
+    for name, image in images.items():
+        face_locations = detector.detect(image)
+        expected_count = int(expected.get(name, 1))
+        detected_faces += min(len(face_locations), expected_count)
+        expected_faces += expected_count
+
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            detector.detect(image)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+
+    return {
+        "backend": detector.name,
+        "images": len(images),
+        "median_ms": float(np.median(latencies)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "recall": detected_faces / expected_faces if expected_faces else 0.0,
+        "detected_faces": detected_faces,
+        "expected_faces": expected_faces
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="人脸检测后端基准测试",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  {sys.argv[0]} --images test-pictures
+  {sys.argv[0]} --images dataset/ --annotations faces.json --backends hog yunet --repeat 10 --output bench.json
+        """
+    )
+    parser.add_argument('--images', default='test-pictures', help='图片目录（默认test-pictures）')
+    parser.add_argument('--annotations', help='每张图片的人脸数标注(JSON)')
+    parser.add_argument('--backends', nargs='+', default=list(DETECTOR_BACKENDS),
+                        help='要测试的后端（默认全部）')
+    parser.add_argument('--repeat', type=int, default=5, help='每张图片计时次数（默认5）')
+    parser.add_argument('--output', help='结果输出路径(JSON)')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s', stream=sys.stderr)
+
+    images = load_images(args.images)
+    if not images:
+        print(f"ERROR: 目录中没有图片: {args.images}")
+        sys.exit(1)
+
+    expected = {}
+    if args.annotations:
+        with open(args.annotations, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+
+    detector_config = get_section('face_extraction').get('detector', {})
+    results = []
+    for name in args.backends:
+        try:
+            detector = DETECTOR_BACKENDS[name](detector_config)
+        except Exception as e:
+            print(f"{name:<8} 不可用: {e}")
+            results.append({"backend": name, "available": False, "message": str(e)})
+            continue
+
+        result = benchmark_backend(detector, images, expected, args.repeat)
+        result["available"] = True
+        results.append(result)
+        print(f"{name:<8} 中位数 {result['median_ms']:8.1f}ms  p95 {result['p95_ms']:8.1f}ms  "
+              f"召回率 {result['recall']:.1%} ({result['detected_faces']}/{result['expected_faces']})")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"images": args.images, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+分块距离计算 - 大规模特征集合的两两欧氏距离
+按块做矩阵乘法，任意时刻只有一个 block_size x block_size 的距离块在内存中，
+特征数到百万级时也能在固定内存内遍历全部距离
+"""
+
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 4096
+
+
+def squared_norms(features: np.ndarray) -> np.ndarray:
+    return np.einsum('ij,ij->i', features, features)
+
+
+def iter_block_origins(count: int, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[Tuple[int, int]]:
+    """上三角（含对角）各距离块的(行起点, 列起点)"""
+    for row_start in range(0, count, block_size):
+        for col_start in range(row_start, count, block_size):
+            yield row_start, col_start
+
+
+def distance_block(features: np.ndarray, sq_norms: np.ndarray, row_start: int, col_start: int,
+                   block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """计算一个距离平方块：|a|^2 + |b|^2 - 2a·b，只需一次矩阵乘"""
+    rows = features[row_start:row_start + block_size]
+    cols = features[col_start:col_start + block_size]
+    block = rows @ cols.T
+    block *= -2.0
+    block += sq_norms[row_start:row_start + block_size][:, None]
+    block += sq_norms[col_start:col_start + block_size][None, :]
+    np.maximum(block, 0.0, out=block)
+    return block
+
+
+def iter_distance_blocks(features: np.ndarray, sq_norms: Optional[np.ndarray] = None,
+                         block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """遍历上三角（含对角）的距离平方块，产出(行起点, 列起点, 距离平方块)
+
+    对角块包含自身和下三角，调用方按需用行列号过滤
+    """
+    features = np.ascontiguousarray(features, dtype=np.float32)
+    if sq_norms is None:
+        sq_norms = squared_norms(features)
+
+    for row_start, col_start in iter_block_origins(len(features), block_size):
+        yield row_start, col_start, distance_block(features, sq_norms, row_start, col_start, block_size)
+
+
+def threshold_pairs(features: np.ndarray, threshold: float,
+                    block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """找出距离不超过threshold的全部特征对(i < j)，返回(行号, 列号, 距离)"""
+    threshold_sq = np.float32(threshold) ** 2
+    rows_out, cols_out, dists_out = [], [], []
+
+    for row_start, col_start, block in iter_distance_blocks(features, block_size=block_size):
+        local_rows, local_cols = np.nonzero(block <= threshold_sq)
+        rows = local_rows + row_start
+        cols = local_cols + col_start
+        # 对角块只保留上三角，去掉自身和重复的对
+        if row_start == col_start:
+            upper = rows < cols
+            local_rows, local_cols, rows, cols = local_rows[upper], local_cols[upper], rows[upper], cols[upper]
+        rows_out.append(rows)
+        cols_out.append(cols)
+        dists_out.append(np.sqrt(block[local_rows, local_cols]))
+
+    if not rows_out:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+    return np.concatenate(rows_out), np.concatenate(cols_out), np.concatenate(dists_out)
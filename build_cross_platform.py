@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 """
-跨平台编译脚本 - 人脸特征提取器
+跨平台编译脚本 - 人脸特征提取器 / HTTP服务
 支持自动检测操作系统并执行相应的编译流程
+
+打包方式（--mode）：
+    onedir  （默认）输出目录：可执行文件 + _internal/（解释器、依赖库、dlib模型），
+            启动时直接从磁盘加载，不解压，冷启动接近Python导入耗时
+    onefile 单个可执行文件：每次启动都把解释器、依赖库和约100MB模型解压到临时目录
+发布目录中可执行文件旁还会放config.json、models/（构建时下载的YuNet等可选模型）和自检图像
 """
 
+import argparse
 import os
 import sys
 import platform
@@ -11,6 +18,29 @@ import subprocess
 import shutil
 from pathlib import Path
 
+# 打包目标：入口脚本、可执行文件名、PyInstaller未能自动发现的模块
+TARGETS = {
+    "extractor": {
+        "script": "face_extractor.py",
+        "name": "face-extractor",
+        "hidden_imports": ["face_recognition", "face_recognition_models", "dlib", "cv2", "PIL", "numpy"]
+    },
+    "service": {
+        "script": "face_service.py",
+        "name": "face_http_service",
+        "hidden_imports": ["face_recognition", "face_recognition_models", "dlib", "cv2", "PIL", "numpy",
+                           "flask", "flask_cors", "inference_worker"]
+    }
+}
+
+# 复制到可执行文件旁的运行时文件（config_loader.resolve_path按可执行文件目录解析相对路径）
+RUNTIME_FILES = [
+    "config.json",
+    "models",
+    os.path.join("test-pictures", "admin.jpg"),
+    os.path.join("test-pictures", "admin_dlib_features.npy")
+]
+
 def run_command(command, shell=True):
     """执行命令并返回结果"""
     try:
@@ -90,10 +120,45 @@ def install_dependencies(pip_exe):
     
     return True
 
-def compile_binary(venv_info):
+def find_model_dir(python_exe):
+    """face_recognition_models包目录（dlib模型所在位置）"""
+    success, stdout, error = run_command([
+        python_exe, "-c",
+        "import face_recognition_models, os; print(os.path.dirname(face_recognition_models.__file__))"
+    ], shell=False)
+    if not success:
+        print(f"⚠️  无法找到face_recognition_models: {error}")
+        return None
+    return stdout.strip()
+
+def pyinstaller_args(target, mode, model_dir):
+    """生成PyInstaller命令参数"""
+    spec = TARGETS[target]
+    args = [f"--{mode}", "--name", spec["name"], "--clean", "--noconfirm"]
+    if model_dir:
+        # onedir下模型位于_internal/face_recognition_models/models，每次启动原地读取
+        args += ["--add-data", f"{model_dir}{os.pathsep}face_recognition_models"]
+    for module in spec["hidden_imports"]:
+        args += ["--hidden-import", module]
+    return args + [spec["script"]]
+
+def copy_runtime_files(release_dir):
+    """复制配置、可选模型和自检图像到可执行文件旁"""
+    for relative in RUNTIME_FILES:
+        if not os.path.exists(relative):
+            continue
+        target = os.path.join(release_dir, relative)
+        os.makedirs(os.path.dirname(target) or release_dir, exist_ok=True)
+        if os.path.isdir(relative):
+            shutil.copytree(relative, target, dirs_exist_ok=True)
+        else:
+            shutil.copy2(relative, target)
+
+def compile_binary(venv_info, target="extractor", mode="onedir"):
     """编译二进制文件"""
     system = platform.system().lower()
-    print(f"🔨 开始编译 ({system} 平台)...")
+    name = TARGETS[target]["name"]
+    print(f"🔨 开始编译 {name} ({system} 平台, {mode})...")
     
     # 清理旧文件
     for dir_name in ["build", "dist", "__pycache__"]:
@@ -107,33 +172,37 @@ def compile_binary(venv_info):
         pyinstaller_exe += ".exe"
     
     print("   执行PyInstaller编译...")
-    success, stdout, error = run_command([
-        pyinstaller_exe, 
-        "face_extractor.spec"
-    ], shell=False)
+    success, stdout, error = run_command(
+        [pyinstaller_exe] + pyinstaller_args(target, mode, find_model_dir(venv_info["python"])), shell=False)
     
     if not success:
         print(f"❌ 编译失败: {error}")
-        return False
+        return False, None, None
     
     # 检查输出文件
-    if system == "windows":
-        output_file = "dist/face-extractor.exe"
-    else:
-        output_file = "dist/face-extractor"
+    executable = name + (".exe" if system == "windows" else "")
+    output_file = os.path.join("dist", name, executable) if mode == "onedir" else os.path.join("dist", executable)
     
     if not os.path.exists(output_file):
         print(f"❌ 编译输出文件不存在: {output_file}")
-        return False
+        return False, None, None
     
     print(f"✅ 编译成功: {output_file}")
     
     # 创建发布目录
-    release_dir = f"release/{system}"\n    os.makedirs(release_dir, exist_ok=True)
+    release_dir = os.path.join("release", system)
+    if mode == "onedir":
+        # 整个目录一起发布，_internal/必须与可执行文件保持相对位置
+        release_dir = os.path.join(release_dir, name)
+        if os.path.exists(release_dir):
+            shutil.rmtree(release_dir)
+        shutil.copytree(os.path.dirname(output_file), release_dir)
+    else:
+        os.makedirs(release_dir, exist_ok=True)
+        shutil.copy2(output_file, os.path.join(release_dir, executable))
+    copy_runtime_files(release_dir)
     
-    # 复制文件
-    target_file = os.path.join(release_dir, os.path.basename(output_file))
-    shutil.copy2(output_file, target_file)
+    target_file = os.path.join(release_dir, executable)
     
     # 设置执行权限 (Unix系统)
     if system != "windows":
@@ -143,31 +212,44 @@ def compile_binary(venv_info):
     
     return True, output_file, target_file
 
-def test_binary(binary_path):
-    """测试二进制文件"""
+def test_binary(binary_path, target="extractor"):
+    """测试二进制文件（HTTP服务会直接启动监听，只统计大小）"""
     print("🧪 测试可执行文件...")
     
-    # 测试版本信息
-    success, stdout, error = run_command([binary_path, "--version"], shell=False)
-    if success:
-        print(f"   版本信息: {stdout.strip()}")
-    else:
-        print(f"⚠️  版本测试失败: {error}")
-    
-    # 测试系统信息
-    success, stdout, error = run_command([binary_path, "--info"], shell=False)
-    if success:
-        print("   系统信息测试通过")
+    if target == "extractor":
+        # 测试版本信息
+        success, stdout, error = run_command([binary_path, "--version"], shell=False)
+        if success:
+            print(f"   版本信息: {stdout.strip()}")
+        else:
+            print(f"⚠️  版本测试失败: {error}")
+        
+        # 测试系统信息
+        success, stdout, error = run_command([binary_path, "--info"], shell=False)
+        if success:
+            print("   系统信息测试通过")
+        else:
+            print(f"⚠️  系统信息测试失败: {error}")
+    
+    # 显示文件大小（onedir统计整个目录）
+    if os.path.basename(os.path.dirname(binary_path)) == "dist":
+        file_size = os.path.getsize(binary_path)
     else:
-        print(f"⚠️  系统信息测试失败: {error}")
-    
-    # 显示文件大小
-    file_size = os.path.getsize(binary_path)
+        file_size = sum(f.stat().st_size for f in Path(binary_path).parent.rglob("*") if f.is_file())
     size_mb = file_size / (1024 * 1024)
     print(f"   文件大小: {size_mb:.2f} MB")
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="人脸特征提取器 - 跨平台编译工具")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="extractor",
+                        help="打包目标：extractor（命令行提取器）或service（HTTP服务），默认extractor")
+    parser.add_argument("--mode", choices=["onedir", "onefile"], default="onedir",
+                        help="onedir（默认，启动不解压）或onefile（单文件，每次启动解压到临时目录）")
+    parser.add_argument("--current-env", action="store_true",
+                        help="使用当前Python环境打包，不重新创建虚拟环境")
+    args = parser.parse_args()
+    
     print("🚀 人脸特征提取器 - 跨平台编译工具")
     print("=" * 50)
     
@@ -181,22 +263,31 @@ def main():
     if not check_python():
         return 1
     
-    # 设置虚拟环境
-    success, venv_info = setup_virtual_env()
-    if not success:
-        return 1
+    if args.current_env:
+        bin_dir = os.path.dirname(sys.executable)
+        venv_info = {"python": sys.executable, "pip": os.path.join(bin_dir, "pip")}
+    else:
+        # 设置虚拟环境
+        success, venv_info = setup_virtual_env()
+        if not success:
+            return 1
+        
+        # 安装依赖
+        if not install_dependencies(venv_info["pip"]):
+            return 1
     
-    # 安装依赖
-    if not install_dependencies(venv_info["pip"]):
-        return 1
+    # 下载可选模型（失败时yunet后端在运行时跳过，不中断编译）
+    print("📥 下载可选模型...")
+    success, stdout, error = run_command([venv_info["python"], "download_models.py", "--optional"], shell=False)
+    print(f"   {(stdout or error).strip()}")
     
     # 编译二进制文件
-    success, output_file, release_file = compile_binary(venv_info)
+    success, output_file, release_file = compile_binary(venv_info, args.target, args.mode)
     if not success:
         return 1
     
     # 测试二进制文件
-    test_binary(output_file)
+    test_binary(output_file, args.target)
     
     # 清理编译临时文件
     print("🧹 清理临时文件...")
@@ -207,8 +298,16 @@ def main():
     print(f"📦 可执行文件: {output_file}")
     print(f"📋 发布版本: {release_file}")
     print("\n使用方法:")
-    print(f"  {os.path.basename(output_file)} --version")
-    print(f"  {os.path.basename(output_file)} extract --base64 <data> --output result.json")
+    if args.target == "extractor":
+        print(f"  {os.path.basename(output_file)} --version")
+        print(f"  {os.path.basename(output_file)} extract --base64 <data> --output result.json")
+    else:
+        print(f"  {os.path.basename(output_file)}")
+    print("\n测量冷启动耗时:")
+    if args.target == "extractor":
+        print(f"  python measure_startup.py --runs 5 -- {release_file} --version")
+    else:
+        print(f"  python measure_startup.py --runs 3 --url http://127.0.0.1:8081/ready -- {release_file}")
     
     return 0
 
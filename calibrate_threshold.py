@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+匹配阈值标定工具 - 在带标注的大规模人脸集合上统计FAR/FRR
+分块流式计算全部两两距离，只累加同人（genuine）和异人（impostor）两组距离直方图，
+内存占用与样本数无关；距离块分发到多个进程，使用全部CPU核心
+
+输入为带标签的特征文件(.npz: labels + features)，或按人分目录的图片集合（先提取特征）
+"""
+
+import argparse
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from blocked_distance import distance_block, iter_block_origins, squared_norms
+from config_loader import get_section
+
+logger = logging.getLogger('calibrate_threshold')
+
+DEFAULT_BLOCK_SIZE = 2048
+DEFAULT_BIN_WIDTH = 0.001
+MAX_DISTANCE = 2.0
+TARGET_FARS = (1e-3, 1e-4, 1e-5, 1e-6)
+
+# 每个进程只用单线程BLAS，避免 进程数 x BLAS线程数 超额占用CPU
+_BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# 工作进程的全局数据（由initializer设置，每个进程只传一次）
+_features = None
+_sq_norms = None
+_labels = None
+_block_size = DEFAULT_BLOCK_SIZE
+_bin_count = 0
+_inv_bin_width = 0.0
+
+
+def _init_worker(features: np.ndarray, labels: np.ndarray, block_size: int, bin_width: float):
+    global _features, _sq_norms, _labels, _block_size, _bin_count, _inv_bin_width
+    _features = np.ascontiguousarray(features, dtype=np.float32)
+    _sq_norms = squared_norms(_features)
+    _labels = labels
+    _block_size = block_size
+    _bin_count = int(np.ceil(MAX_DISTANCE / bin_width))
+    _inv_bin_width = 1.0 / bin_width
+
+
+def _block_histograms(origin: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """一个距离块的同人/异人直方图"""
+    row_start, col_start = origin
+    block = distance_block(_features, _sq_norms, row_start, col_start, _block_size)
+    np.sqrt(block, out=block)
+    block *= _inv_bin_width
+    bins = block.astype(np.int32)
+    np.minimum(bins, _bin_count - 1, out=bins)
+
+    same = _labels[row_start:row_start + _block_size][:, None] == _labels[col_start:col_start + _block_size][None, :]
+    if row_start == col_start:
+        # 对角块只统计 i < j 的对
+        upper = np.triu(np.ones(bins.shape, dtype=bool), k=1)
+        bins, same = bins[upper], same[upper]
+
+    total = np.bincount(bins.ravel(), minlength=_bin_count)
+    genuine = np.bincount(bins[same], minlength=_bin_count)
+    return genuine, total - genuine
+
+
+def accumulate_histograms(features: np.ndarray, labels: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE,
+                          bin_width: float = DEFAULT_BIN_WIDTH, workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """遍历全部距离块，返回(同人直方图, 异人直方图)"""
+    workers = workers or os.cpu_count() or 1
+    origins = list(iter_block_origins(len(features), block_size))
+    bin_count = int(np.ceil(MAX_DISTANCE / bin_width))
+    genuine = np.zeros(bin_count, dtype=np.int64)
+    impostor = np.zeros(bin_count, dtype=np.int64)
+
+    start_time = time.time()
+    if workers <= 1:
+        _init_worker(features, labels, block_size, bin_width)
+        results = map(_block_histograms, origins)
+        _accumulate(results, genuine, impostor, len(origins), start_time)
+        return genuine, impostor
+
+    saved_env = {name: os.environ.get(name) for name in _BLAS_ENV_VARS}
+    try:
+        # spawn方式启动的子进程重新导入numpy，环境变量才能生效
+        for name in _BLAS_ENV_VARS:
+            os.environ[name] = '1'
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(features, labels, block_size, bin_width)) as executor:
+            results = executor.map(_block_histograms, origins, chunksize=max(1, len(origins) // (workers * 8)))
+            _accumulate(results, genuine, impostor, len(origins), start_time)
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return genuine, impostor
+
+
+def _accumulate(results, genuine: np.ndarray, impostor: np.ndarray, total_blocks: int, start_time: float):
+    for done, (block_genuine, block_impostor) in enumerate(results, 1):
+        genuine += block_genuine
+        impostor += block_impostor
+        if done % 100 == 0 or done == total_blocks:
+            logger.info("距离块 %s/%s, 耗时 %.1fs", done, total_blocks, time.time() - start_time)
+
+
+def compute_curves(genuine: np.ndarray, impostor: np.ndarray, bin_width: float = DEFAULT_BIN_WIDTH) -> Dict:
+    """由直方图计算各阈值下的FAR/FRR（距离小于阈值判为同一人）"""
+    thresholds = (np.arange(len(genuine)) + 1) * bin_width
+    genuine_total = max(int(genuine.sum()), 1)
+    impostor_total = max(int(impostor.sum()), 1)
+    far = np.cumsum(impostor) / impostor_total
+    frr = 1.0 - np.cumsum(genuine) / genuine_total
+    return {"thresholds": thresholds, "far": far, "frr": frr}
+
+
+def _point(curves: Dict, index: int) -> Dict:
+    return {
+        "threshold": round(float(curves["thresholds"][index]), 6),
+        "far": float(curves["far"][index]),
+        "frr": float(curves["frr"][index])
+    }
+
+
+def recommend_thresholds(curves: Dict, current: Dict) -> Dict:
+    """等错误率点、各目标FAR下的最大阈值，以及当前使用中阈值的实际表现"""
+    far, frr, thresholds = curves["far"], curves["frr"], curves["thresholds"]
+
+    result = {"eer": _point(curves, int(np.argmin(np.abs(far - frr))))}
+    for target in TARGET_FARS:
+        # FAR随阈值单调不减，取满足目标的最大阈值（FRR最低）
+        index = int(np.searchsorted(far, target, side='right')) - 1
+        result[f"far_{target:g}"] = _point(curves, index) if index >= 0 else None
+
+    result["current"] = {
+        name: _point(curves, min(int(np.searchsorted(thresholds, value - 1e-9)), len(thresholds) - 1))
+        for name, value in current.items()
+    }
+    return result
+
+
+def load_labeled_features(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """读取带标签的特征文件，返回(特征, 标签编号, 标签名)"""
+    with np.load(path, allow_pickle=False) as data:
+        features = np.ascontiguousarray(data['features'], dtype=np.float32)
+        names = data['labels'] if 'labels' in data.files else data['ids']
+    label_names, label_codes = np.unique(np.asarray(names).astype(str), return_inverse=True)
+    return features, label_codes.astype(np.int64), label_names
+
+
+def extract_labeled_features(image_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    """按人分目录（image_dir/<person>/*.jpg）提取特征，返回(特征, 标签名)"""
+    from face_extractor import SimpleFaceExtractor
+
+    extractor = SimpleFaceExtractor()
+    features, names = [], []
+    failed = 0
+    for person in sorted(os.listdir(image_dir)):
+        person_dir = os.path.join(image_dir, person)
+        if not os.path.isdir(person_dir):
+            continue
+        for name in sorted(os.listdir(person_dir)):
+            with open(os.path.join(person_dir, name), 'rb') as f:
+                result = extractor.extract_feature_from_bytes(f.read())
+            if not result['success']:
+                failed += 1
+                continue
+            features.append(np.frombuffer(base64.b64decode(result['feature_code']), dtype=np.float32))
+            names.append(person)
+        logger.info("已提取 %s 张（失败 %s 张）", len(features), failed)
+
+    return np.array(features, dtype=np.float32).reshape(-1, 128), np.array(names, dtype=str)
+
+
+def calibrate(features: np.ndarray, label_codes: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE,
+              bin_width: float = DEFAULT_BIN_WIDTH, workers: Optional[int] = None,
+              curve_step: float = 0.01) -> Dict:
+    """完整的标定流程，返回可直接写出的结果"""
+    start_time = time.time()
+    genuine, impostor = accumulate_histograms(features, label_codes, block_size, bin_width, workers)
+    curves = compute_curves(genuine, impostor, bin_width)
+
+    current = {
+        "match_tolerance": float(get_section('gallery').get('match_tolerance', 0.6)),
+        "strict_0.4": 0.4,
+        "loose_0.6": 0.6
+    }
+    stride = max(1, int(round(curve_step / bin_width)))
+    curve = [_point(curves, i) for i in range(stride - 1, len(curves["thresholds"]), stride)]
+
+    return {
+        "success": True,
+        "sample_count": int(len(features)),
+        "identity_count": int(len(np.unique(label_codes))),
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "bin_width": bin_width,
+        "recommended": recommend_thresholds(curves, current),
+        "curve": [point for point in curve if point["threshold"] <= MAX_DISTANCE],
+        "process_time": (time.time() - start_time) * 1000,
+        "message": "阈值标定完成"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="匹配阈值标定（FAR/FRR曲线）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  {sys.argv[0]} --features labeled.npz --output calibration.json
+  {sys.argv[0]} --images dataset/ --save-features labeled.npz --output calibration.json --workers 8
+        """
+    )
+
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--features', help='带标签的特征文件(.npz，包含labels和features)')
+    source_group.add_argument('--images', help='按人分目录的图片集合（<目录>/<人员>/<图片>）')
+
+    parser.add_argument('--output', required=True, help='标定结果输出路径(JSON)')
+    parser.add_argument('--save-features', help='从图片提取的特征另存为.npz，便于重复标定')
+    parser.add_argument('--workers', type=int, help='进程数（默认CPU核心数）')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f'分块大小，每个进程同时只持有一个距离块（默认{DEFAULT_BLOCK_SIZE}）')
+    parser.add_argument('--bin-width', type=float, default=DEFAULT_BIN_WIDTH,
+                        help=f'直方图分辨率（默认{DEFAULT_BIN_WIDTH}）')
+    parser.add_argument('--curve-step', type=float, default=0.01, help='输出曲线的阈值步长（默认0.01）')
+    parser.add_argument('--debug', action='store_true', help='在stderr输出调试日志')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format='%(levelname)s: %(message)s',
+        stream=sys.stderr
+    )
+
+    if args.features:
+        features, label_codes, _ = load_labeled_features(args.features)
+    else:
+        features, names = extract_labeled_features(args.images)
+        if args.save_features:
+            np.savez(args.save_features, labels=names, features=features)
+        _, label_codes = np.unique(names, return_inverse=True)
+
+    if len(features) < 2:
+        print("ERROR: 样本数不足")
+        sys.exit(1)
+
+    result = calibrate(features, label_codes, args.block_size, args.bin_width, args.workers, args.curve_step)
+
+    try:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"ERROR: 写入输出文件失败: {e}")
+        sys.exit(1)
+
+    eer = result["recommended"]["eer"]
+    print(f"SUCCESS: {result['genuine_pairs']} 对同人 / {result['impostor_pairs']} 对异人，"
+          f"EER {eer['far']:.4%} @ 阈值 {eer['threshold']}")
+
+
+if __name__ == '__main__':
+    main()
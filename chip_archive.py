@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+对齐人脸图存档 - 保存编码器实际使用的150x150对齐人脸图（dlib.get_face_chip）
+更换编码模型或参数后只需对存档重新编码，不必重新解码原图和检测人脸
+
+存档按块组织，每个进程写自己的块，不需要跨进程加锁：
+    chips-<主机>-<pid>-<时间戳>-<序号>.bin    编码后的人脸图依次拼接
+    chips-<主机>-<pid>-<时间戳>-<序号>.idx    每行一条JSON记录（chip_id、偏移、长度、引擎、原特征码）
+块记录数达到chunk_size后换新块；写入由后台线程完成，请求线程只做入队
+"""
+
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config_loader import resolve_path
+
+logger = logging.getLogger(__name__)
+
+# 与dlib ResNet编码器内部对齐方式一致
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+CHUNK_PREFIX = 'chips-'
+DATA_SUFFIX = '.bin'
+INDEX_SUFFIX = '.idx'
+
+
+def l2_normalize(feature: np.ndarray) -> np.ndarray:
+    """转换为float32并L2归一化（Base64接口返回的特征），重新编码时按同样的步骤归一化新特征"""
+    feature = np.asarray(feature).astype(np.float32)
+    norm = np.linalg.norm(feature)
+    return feature / norm if norm > 0 else feature
+
+
+def encode_chip(chip: np.ndarray, image_format: str = 'png', jpeg_quality: int = 95) -> bytes:
+    """RGB人脸图 -> 图像字节（png无损，重新编码结果与原特征完全一致；jpg体积约为其1/4）"""
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality] if image_format == 'jpg' else []
+    ok, encoded = cv2.imencode('.' + image_format, cv2.cvtColor(chip, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"人脸图编码失败: {image_format}")
+    return encoded.tobytes()
+
+
+def decode_chip(data: bytes) -> np.ndarray:
+    """图像字节 -> RGB人脸图"""
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("人脸图解码失败")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def list_chunks(directory: str) -> List[str]:
+    """存档目录下的全部块（不含扩展名的路径，按名称排序）"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name[:-len(INDEX_SUFFIX)])
+                  for name in os.listdir(directory)
+                  if name.startswith(CHUNK_PREFIX) and name.endswith(INDEX_SUFFIX))
+
+
+def read_chunk(chunk: str) -> Iterator[Tuple[Dict, bytes]]:
+    """依次读出块中的(记录, 人脸图字节)；进程异常退出留下的不完整记录直接跳过"""
+    with open(chunk + DATA_SUFFIX, 'rb') as data_file:
+        data_size = os.fstat(data_file.fileno()).st_size
+        with open(chunk + INDEX_SUFFIX, 'r', encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['offset'] + record['length'] > data_size:
+                    continue
+                data_file.seek(record['offset'])
+                yield record, data_file.read(record['length'])
+
+
+class ChipArchive:
+    """对齐人脸图存档写入器（异步，队列满时丢弃并计数）"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.enabled = bool(config.get('enabled', False))
+        self.directory = resolve_path(config.get('directory', 'chip_archive'))
+        self.chunk_size = max(1, int(config.get('chunk_size', 4096)))
+        self.image_format = config.get('format', 'png')
+        self.jpeg_quality = int(config.get('jpeg_quality', 95))
+        if self.image_format not in ('png', 'jpg'):
+            raise ValueError(f"不支持的人脸图存档格式: {self.image_format}")
+
+        self._queue = queue.Queue(maxsize=max(1, int(config.get('queue_size', 256))))
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # 当前块（仅后台线程访问）
+        self._chunk_name = None
+        self._chunk_count = 0
+        self._chunk_seq = 0
+        self._data_file = None
+        self._index_file = None
+
+        self.stats = {
+            "submitted": 0,
+            "dropped": 0,
+            "written": 0,
+            "chunks": 0,
+            "errors": 0
+        }
+
+    def submit(self, chip: np.ndarray, feature: np.ndarray, engine: str,
+               normalized: bool = False) -> Optional[str]:
+        """提交一个人脸图及其特征，返回chip_id；未启用或队列已满时返回None
+
+        feature必须是返回给调用方的特征（normalized表示已做L2归一化）
+        """
+        if not self.enabled:
+            return None
+
+        self.stats["submitted"] += 1
+        self._ensure_started()
+        chip_id = uuid.uuid4().hex
+        try:
+            self._queue.put_nowait((chip_id, chip, np.asarray(feature, dtype=np.float32), engine, normalized))
+            return chip_id
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return None
+
+    def flush(self, timeout: float = 5.0):
+        """等待队列写完并刷新当前块（进程退出时调用）"""
+        deadline = time.time() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            for f in (self._data_file, self._index_file):
+                if f is not None:
+                    f.flush()
+
+    def get_status(self) -> Dict:
+        """返回存档状态，用于健康检查"""
+        return dict(self.stats,
+                    enabled=self.enabled,
+                    directory=self.directory,
+                    format=self.image_format,
+                    queue_depth=self._queue.qsize())
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='chip-archive-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                with self._lock:
+                    self._write(*item)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("写入人脸图存档失败: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, chip_id: str, chip: np.ndarray, feature: np.ndarray, engine: str, normalized: bool):
+        data = encode_chip(chip, self.image_format, self.jpeg_quality)
+        if self._data_file is None or self._chunk_count >= self.chunk_size:
+            self._open_chunk()
+
+        offset = self._data_file.tell()
+        self._data_file.write(data)
+        self._data_file.flush()
+        record = {
+            "chip_id": chip_id,
+            "offset": offset,
+            "length": len(data),
+            "format": self.image_format,
+            "engine": engine,
+            "feature_code": base64.b64encode(feature.tobytes()).decode('ascii'),
+            "normalized": bool(normalized),
+            "created": datetime.now().isoformat()
+        }
+        # 先写数据再写索引：索引中出现的记录数据一定完整
+        self._index_file.write(json.dumps(record) + '\n')
+        self._index_file.flush()
+        self._chunk_count += 1
+        self.stats["written"] += 1
+
+    def _open_chunk(self):
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                f.close()
+
+        self._chunk_seq += 1
+        self._chunk_name = os.path.join(
+            self.directory,
+            f"{CHUNK_PREFIX}{socket.gethostname()}-{os.getpid()}-{int(time.time())}-{self._chunk_seq:05d}")
+        self._data_file = open(self._chunk_name + DATA_SUFFIX, 'ab')
+        self._index_file = open(self._chunk_name + INDEX_SUFFIX, 'a', encoding='utf-8')
+        self._chunk_count = 0
+        self.stats["chunks"] += 1
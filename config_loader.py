@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+配置加载 - 读取config.json并与默认值合并
+服务和命令行提取器共用同一份配置
+"""
+
+import copy
+import json
+import os
+import sys
+from typing import Dict, Optional
+
+# 默认配置（config.json缺失或缺少某项时使用）
+DEFAULT_CONFIG = {
+    "service": {
+        "name": "face-recognition-service",
+        "version": "1.0.0",
+        "port": 8081,
+        "host": "0.0.0.0",
+        "debug": False
+    },
+    "face_extraction": {
+        "feature_dim": 128,
+        "quality_threshold": 0.6,
+        "max_faces": 5,
+        "similarity_threshold": 0.8,
+        "detector": {
+            "backends": ["hog", "haar"],
+            "upsample": 1,
+            "yunet_model": "models/face_detection_yunet_2023mar.onnx",
+            "yunet_input_size": 640,
+            "yunet_score_threshold": 0.8,
+            "yunet_nms_threshold": 0.3,
+            "fallback_min_ms": 1000,
+            "base64_fallback": False
+        },
+        "crop": {
+            "max_bytes": "512KB",
+            "min_side": 48,
+            "max_side": 640,
+            "max_aspect_ratio": 2.0
+        },
+        "image_limits": {
+            "max_pixels": 16000000,
+            "over_budget": "reduce",
+            "allowed_modes": ["1", "L", "LA", "P", "PA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr"]
+        },
+        "prescreen": {
+            "enabled": False,
+            "max_side": 320,
+            "min_quality": 0.2,
+            "reject_multiple": False
+        }
+    },
+    "video": {
+        "sample_fps": 2.0,
+        "keyframe_interval": 10,
+        "track_min_confidence": 7.0,
+        "iou_threshold": 0.3,
+        "max_frames": 0,
+        "max_upload_size": "500MB"
+    },
+    "debug_dump": {
+        "enabled": False,
+        "directory": "./debug",
+        "sample_rate": 0.1,
+        "queue_size": 16,
+        "max_disk_usage": "200MB",
+        "jpeg_quality": 85
+    },
+    "chip_archive": {
+        "enabled": False,
+        "directory": "chip_archive",
+        "format": "png",
+        "jpeg_quality": 95,
+        "chunk_size": 4096,
+        "queue_size": 256
+    },
+    "gallery": {
+        "directory": "galleries",
+        "max_memory": "1GB",
+        "top_k": 5,
+        "match_tolerance": 0.6,
+        "compact_threshold": 1000,
+        "compact_interval": 60,
+        "fsync": False,
+        "shared_memory": False,
+        "rebuild_sample_queries": 8,
+        "quantize": False,
+        "rerank_candidates": 64
+    },
+    "logging": {
+        "level": "INFO",
+        "file": "logs/face_service.log",
+        "max_file_size": "10MB",
+        "backup_count": 5,
+        "async": True,
+        "queue_size": 10000,
+        "request_sample_rate": 1.0
+    },
+    "performance": {
+        "max_workers": 4,
+        "timeout": 30,
+        "batch_size_limit": 10,
+        "default_timeout_ms": 0
+    },
+    "batch": {
+        "concurrency": 2,
+        "chunk_size": "64KB",
+        "max_item_size": "32MB",
+        "spool_memory": "1MB"
+    },
+    "readiness": {
+        "self_test_image": "test-pictures/admin.jpg",
+        "self_test_max_distance": 0.2,
+        "capacity": 0,
+        "max_queue_depth": 8,
+        "max_p95_ms": 0,
+        "latency_window": 200,
+        "latency_window_seconds": 60
+    },
+    "admin": {
+        "enabled": False,
+        "token": "",
+        "profile_directory": "./logs/profiles"
+    },
+    "memory": {
+        "enabled": False,
+        "frames": 1,
+        "history": 200,
+        "top_sites": 20
+    },
+    "inference_pool": {
+        "enabled": False,
+        "processes": 2,
+        "slots": 4,
+        "slot_size": "32MB",
+        "max_tasks_per_child": 500,
+        "threads_per_process": 1,
+        "task_timeout": 30
+    },
+    "threads": {
+        "enabled": True,
+        "workers": 0,
+        "threads_per_worker": 0,
+        "pin_affinity": False
+    }
+}
+
+_config_cache: Optional[Dict] = None
+
+
+def _base_dir() -> str:
+    """可执行文件目录（打包后）或源码目录"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def _default_config_path() -> str:
+    """查找config.json：环境变量 > 可执行文件目录 > 源码目录"""
+    env_path = os.environ.get('FACE_SERVICE_CONFIG')
+    if env_path:
+        return env_path
+    return os.path.join(_base_dir(), 'config.json')
+
+
+def resolve_path(path: str) -> str:
+    """配置中的相对路径（模型文件等）按可执行文件/源码目录解析，与工作目录无关"""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(_base_dir(), path)
+
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    """递归合并配置字典"""
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def load_config(path: Optional[str] = None, reload: bool = False) -> Dict:
+    """加载配置（默认路径的结果会被缓存）"""
+    global _config_cache
+
+    if path is None and _config_cache is not None and not reload:
+        return _config_cache
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config_path = path or _default_config_path()
+
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                _merge(config, json.load(f))
+        except Exception as e:
+            print(f"警告: 读取配置文件失败，使用默认配置: {e}", file=sys.stderr)
+
+    if path is None:
+        _config_cache = config
+    return config
+
+
+def get_section(name: str) -> Dict:
+    """获取配置中的某一节"""
+    return load_config().get(name, {})
+
+
+def parse_size(value) -> int:
+    """解析"10MB"/"512KB"这类大小配置，返回字节数"""
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    text = str(value).strip().upper()
+    units = {'GB': 1024 ** 3, 'MB': 1024 ** 2, 'KB': 1024, 'B': 1}
+    for unit, factor in units.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)].strip()) * factor)
+    return int(float(text))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+请求截止时间 - 客户端放弃等待后不再为该请求消耗CPU
+客户端用请求头X-Request-Timeout-Ms（或请求参数timeout_ms）给出剩余预算（毫秒），
+以服务收到请求的时刻起算，不依赖两端时钟一致；处理各阶段之间检查剩余预算：
+已过期的工作直接跳过，剩余预算不足时不再运行兜底检测后端
+"""
+
+import time
+from typing import Dict, Optional
+
+TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+TIMEOUT_PARAM = 'timeout_ms'
+
+
+class Deadline:
+    """单调时钟上的截止时间"""
+
+    def __init__(self, timeout_ms: float):
+        self.timeout_ms = float(timeout_ms)
+        self.expires_at = time.monotonic() + self.timeout_ms / 1000.0
+
+    def remaining_ms(self) -> float:
+        return (self.expires_at - time.monotonic()) * 1000.0
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def earlier(self, other: Optional['Deadline']) -> 'Deadline':
+        """两个截止时间中较早的一个"""
+        if other is None or self.expires_at <= other.expires_at:
+            return self
+        return other
+
+
+def parse_deadline(value, default_ms: float = 0) -> Optional[Deadline]:
+    """解析毫秒预算；未提供且没有默认值时返回None（不限时）"""
+    if value is None or value == '':
+        return Deadline(default_ms) if default_ms and default_ms > 0 else None
+    try:
+        timeout_ms = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{TIMEOUT_PARAM}必须是毫秒数: {value}")
+    return Deadline(timeout_ms)
+
+
+def expired_result(start_time: float, stage: str, **fields) -> Dict:
+    """截止时间已过时的失败结果"""
+    result = {
+        "success": False,
+        "process_time": (time.time() - start_time) * 1000,
+        "message": f"请求已超过截止时间，跳过{stage}",
+        "deadline_exceeded": True
+    }
+    result.update(fields)
+    return result
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+调试图像转储 - 后台线程异步写盘
+未检测到人脸时的图像按采样率进入有界队列，由后台线程编码保存，
+目录总大小超过配额时按时间从旧到新删除，请求线程不做任何磁盘IO（目录中已有文件也由后台线程统计）
+默认关闭，排查线上漏检时在debug_dump中启用
+"""
+
+import atexit
+import collections
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from config_loader import parse_size
+
+logger = logging.getLogger(__name__)
+
+
+class DebugImageWriter:
+    """异步调试图像写入器"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.enabled = bool(config.get('enabled', False))
+        self.directory = config.get('directory', './debug')
+        self.sample_rate = float(config.get('sample_rate', 0.1))
+        self.max_disk_usage = parse_size(config.get('max_disk_usage', '200MB'))
+        self.jpeg_quality = int(config.get('jpeg_quality', 85))
+        # 图像数组可能在返回后被复用（如推理进程池的共享内存槽）时设为True，入队前拷贝
+        self.copy_images = False
+
+        self._queue = queue.Queue(maxsize=max(1, int(config.get('queue_size', 16))))
+        self._thread = None
+        # 保护后台线程的启动和stats（请求线程与后台线程都会更新计数）
+        self._lock = threading.Lock()
+
+        # 已保存文件（按写入顺序），用于配额淘汰（仅后台线程访问）
+        self._files = collections.deque()
+        self._disk_usage = 0
+        self._sequence = 0
+
+        self.stats = {
+            "submitted": 0,
+            "sampled_out": 0,
+            "dropped": 0,
+            "written": 0,
+            "evicted": 0,
+            "errors": 0
+        }
+
+    def submit(self, image_array: np.ndarray, prefix: str = 'failed') -> bool:
+        """提交待保存图像（不阻塞，队列满或未被采样时直接丢弃）"""
+        if not self.enabled:
+            return False
+
+        self._count("submitted")
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self._count("sampled_out")
+            return False
+
+        self._ensure_started()
+        try:
+            # 调用方之后不会再修改该数组时直接入队，无需拷贝
+            if self.copy_images:
+                image_array = image_array.copy()
+            self._queue.put_nowait((prefix, int(time.time() * 1000), image_array))
+            return True
+        except queue.Full:
+            self._count("dropped")
+            return False
+
+    def flush(self, timeout: float = 5.0):
+        """等待队列中的图像写完（进程退出时调用）"""
+        deadline = time.time() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def get_status(self) -> Dict:
+        """返回写入器状态，用于健康检查"""
+        with self._lock:
+            stats = dict(self.stats)
+        return dict(stats,
+                    enabled=self.enabled,
+                    sample_rate=self.sample_rate,
+                    queue_depth=self._queue.qsize(),
+                    disk_usage=self._disk_usage,
+                    max_disk_usage=self.max_disk_usage)
+
+    def _ensure_started(self):
+        """首次提交时启动后台线程"""
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='debug-image-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _scan_existing(self):
+        """统计目录中已有的调试图像，旧文件也计入配额（后台线程启动后首先执行）"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.jpg'):
+                    continue
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+            for _, path, size in sorted(entries):
+                self._files.append((path, size))
+                self._disk_usage += size
+        except Exception as e:
+            logger.warning("扫描调试目录失败: %s", e)
+
+    def _run(self):
+        """后台线程：编码、写盘、按配额淘汰"""
+        self._scan_existing()
+        while True:
+            prefix, timestamp, image_array = self._queue.get()
+            try:
+                self._write(prefix, timestamp, image_array)
+            except Exception as e:
+                self._count("errors")
+                logger.warning("保存调试图像失败: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, prefix: str, timestamp: int, image_array: np.ndarray):
+        """保存单张图像"""
+        ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR),
+                                   [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+        if not ok:
+            raise ValueError("JPEG编码失败")
+
+        size = len(encoded)
+        if size > self.max_disk_usage:
+            self._count("dropped")
+            return
+
+        self._evict(size)
+
+        # 同一毫秒内可能有多张，文件名附加序号避免覆盖
+        self._sequence += 1
+        debug_file = os.path.join(self.directory, f"{prefix}_{timestamp}_{self._sequence}.jpg")
+        with open(debug_file, 'wb') as f:
+            f.write(encoded.tobytes())
+
+        self._files.append((debug_file, size))
+        self._disk_usage += size
+        self._count("written")
+
+    def _evict(self, incoming_size: int):
+        """删除最旧的文件，直到能容纳新文件"""
+        while self._files and self._disk_usage + incoming_size > self.max_disk_usage:
+            path, size = self._files.popleft()
+            self._disk_usage -= size
+            try:
+                os.remove(path)
+                self._count("evicted")
+            except FileNotFoundError:
+                pass
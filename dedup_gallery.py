@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+特征库重复身份聚类 - 离线批处理
+同一个人用不同账号多次录入会让特征库膨胀、拖慢每次检索；
+本工具分块计算全库两两距离，对距离低于阈值的特征对聚类，输出重复报告和（可选）去重后的特征库
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from blocked_distance import DEFAULT_BLOCK_SIZE, threshold_pairs
+from config_loader import get_section
+from gallery import GallerySnapshot, TenantGallery, validate_tenant_id
+
+logger = logging.getLogger('dedup_gallery')
+
+# 判定为同一人的距离阈值，比检索匹配阈值(0.6)更严格，避免误合并
+DEFAULT_THRESHOLD = 0.4
+
+
+def load_gallery(path: str) -> GallerySnapshot:
+    """读取基础矩阵并重放日志，得到特征库的完整内容"""
+    tenant_id = os.path.splitext(os.path.basename(path))[0]
+    return TenantGallery.load(tenant_id, path).view.materialize()
+
+
+def cluster_pairs(rows: np.ndarray, cols: np.ndarray, method: str = 'chinese_whispers') -> List[np.ndarray]:
+    """对阈值图聚类，返回成员数不少于2的簇（行号数组）
+
+    chinese_whispers：dlib的图聚类，能切开A~B~C这类链式相连但A与C相距较远的情况；
+    components：阈值图的连通分量
+    """
+    if not len(rows):
+        return []
+
+    # 只有出现在边上的节点参与聚类，重新编号成连续下标
+    nodes = np.unique(np.concatenate([rows, cols]))
+    local_rows = np.searchsorted(nodes, rows)
+    local_cols = np.searchsorted(nodes, cols)
+
+    if method == 'chinese_whispers':
+        import dlib
+        edges = [(i, i) for i in range(len(nodes))] + list(zip(local_rows.tolist(), local_cols.tolist()))
+        labels = np.asarray(dlib.chinese_whispers(edges), dtype=np.int64)
+    elif method == 'components':
+        parent = np.arange(len(nodes))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for a, b in zip(local_rows.tolist(), local_cols.tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        labels = np.array([find(i) for i in range(len(nodes))], dtype=np.int64)
+    else:
+        raise ValueError(f"未知的聚类方法: {method}")
+
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return [nodes[group] for group in np.split(order, boundaries) if len(group) >= 2]
+
+
+def find_duplicates(snapshot: GallerySnapshot, threshold: float = DEFAULT_THRESHOLD,
+                    block_size: int = DEFAULT_BLOCK_SIZE, method: str = 'chinese_whispers') -> Dict:
+    """聚类全库特征，返回重复报告；每个簇保留与簇内其他成员相连最多的账号"""
+    start_time = time.time()
+    count = len(snapshot)
+
+    rows, cols, distances = threshold_pairs(snapshot.features, threshold, block_size)
+    logger.info("分块距离计算完成: %s 条特征, %s 对低于阈值, 耗时 %.1fs",
+                count, len(rows), time.time() - start_time)
+
+    clusters = cluster_pairs(rows, cols, method)
+
+    degree = np.bincount(np.concatenate([rows, cols]), minlength=count) if len(rows) else np.zeros(count, np.int64)
+    cluster_of = np.full(count, -1, dtype=np.int64)
+    for cluster_id, members in enumerate(clusters):
+        cluster_of[members] = cluster_id
+
+    # 簇内边的最大距离，反映簇的松散程度
+    max_distance = np.zeros(len(clusters), dtype=np.float32)
+    same = (cluster_of[rows] == cluster_of[cols]) & (cluster_of[rows] >= 0) if len(rows) else np.zeros(0, bool)
+    np.maximum.at(max_distance, cluster_of[rows[same]], distances[same])
+
+    report_clusters = []
+    for cluster_id, members in enumerate(clusters):
+        members = sorted(members.tolist(), key=lambda i: (-degree[i], i))
+        report_clusters.append({
+            "cluster_id": cluster_id,
+            "size": len(members),
+            "keep": snapshot.ids[members[0]],
+            "duplicates": [snapshot.ids[i] for i in members[1:]],
+            "max_distance": float(max_distance[cluster_id])
+        })
+    report_clusters.sort(key=lambda cluster: -cluster["size"])
+
+    return {
+        "success": True,
+        "gallery_size": count,
+        "threshold": threshold,
+        "method": method,
+        "candidate_pairs": int(len(rows)),
+        "duplicate_clusters": len(report_clusters),
+        "duplicate_users": sum(len(cluster["duplicates"]) for cluster in report_clusters),
+        "clusters": report_clusters,
+        "process_time": (time.time() - start_time) * 1000,
+        "message": "重复身份聚类完成"
+    }
+
+
+def write_merged_gallery(snapshot: GallerySnapshot, report: Dict, path: str) -> int:
+    """去掉每个簇中的重复账号，写出特征库文件（可通过rebuild接口整体替换线上特征库）"""
+    removed = {user_id for cluster in report["clusters"] for user_id in cluster["duplicates"]}
+    keep = [i for i, user_id in enumerate(snapshot.ids) if user_id not in removed]
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez(path, ids=np.array([snapshot.ids[i] for i in keep], dtype=str),
+             features=snapshot.features[keep], seq=np.int64(0))
+    return len(keep)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="特征库重复身份聚类（离线）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  {sys.argv[0]} --tenant meeting_001 --output duplicates.json
+  {sys.argv[0]} --gallery galleries/meeting_001.npz --output duplicates.json --merged-output galleries/meeting_001.merged.npz
+        """
+    )
+
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--tenant', help='租户ID（从config.json的gallery.directory读取）')
+    source_group.add_argument('--gallery', help='特征库文件路径(.npz，同名.log日志会一并重放)')
+
+    parser.add_argument('--output', required=True, help='重复报告输出路径(JSON)')
+    parser.add_argument('--merged-output', help='去重后的特征库输出路径(.npz)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'判定为同一人的距离阈值（默认{DEFAULT_THRESHOLD}）')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f'分块大小，距离块占用 block_size^2 x 4 字节（默认{DEFAULT_BLOCK_SIZE}）')
+    parser.add_argument('--method', choices=['chinese_whispers', 'components'], default='chinese_whispers',
+                        help='聚类方法（默认chinese_whispers）')
+    parser.add_argument('--debug', action='store_true', help='在stderr输出调试日志')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format='%(levelname)s: %(message)s',
+        stream=sys.stderr
+    )
+
+    if args.tenant:
+        validate_tenant_id(args.tenant)
+        path = os.path.join(get_section('gallery').get('directory', 'galleries'), f"{args.tenant}.npz")
+    else:
+        path = args.gallery
+
+    if not os.path.exists(path) and not os.path.exists(os.path.splitext(path)[0] + '.log'):
+        print(f"ERROR: 特征库文件不存在: {path}")
+        sys.exit(1)
+
+    snapshot = load_gallery(path)
+    report = find_duplicates(snapshot, args.threshold, args.block_size, args.method)
+    report["gallery"] = path
+
+    if args.merged_output:
+        report["merged_gallery"] = args.merged_output
+        report["merged_size"] = write_merged_gallery(snapshot, report, args.merged_output)
+
+    try:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"ERROR: 写入输出文件失败: {e}")
+        sys.exit(1)
+
+    print(f"SUCCESS: {report['gallery_size']} 条特征中发现 {report['duplicate_clusters']} 个重复簇，"
+          f"{report['duplicate_users']} 个重复账号")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+下载可选的检测模型 - 不随代码分发的模型在构建时下载到models/
+目前只有YuNet人脸检测（face_extraction.detector.backends中的yunet）；
+下载到临时文件，用cv2.FaceDetectorYN加载验证后再放到目标位置，已存在且能加载的模型不重复下载
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import urllib.request
+
+import cv2
+import numpy as np
+
+from config_loader import get_section, resolve_path
+
+YUNET_URL = ("https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/"
+             "face_detection_yunet_2023mar.onnx")
+
+
+def verify_yunet(path: str):
+    """模型不完整或不是YuNet时cv2抛出异常"""
+    detector = cv2.FaceDetectorYN.create(path, "", (320, 320))
+    detector.detect(np.zeros((320, 320, 3), dtype=np.uint8))
+
+
+def download_yunet(path: str, url: str = YUNET_URL, timeout: float = 60) -> bool:
+    """下载YuNet模型到path，返回是否新下载（已有可用模型时返回False）"""
+    if os.path.exists(path):
+        try:
+            verify_yunet(path)
+            return False
+        except cv2.error:
+            print(f"⚠️  已有模型无法加载，重新下载: {path}")
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(url, timeout=timeout) as response:
+            shutil.copyfileobj(response, f)
+        verify_yunet(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载可选的检测模型（YuNet）")
+    parser.add_argument('--output', help='模型保存路径（默认face_extraction.detector.yunet_model）')
+    parser.add_argument('--url', default=YUNET_URL, help='模型下载地址')
+    parser.add_argument('--optional', action='store_true', help='下载失败时只警告，退出码为0')
+    args = parser.parse_args()
+
+    path = args.output or resolve_path(get_section('face_extraction').get('detector', {}).get(
+        'yunet_model', 'models/face_detection_yunet_2023mar.onnx'))
+    try:
+        if download_yunet(path, args.url):
+            print(f"✅ 已下载YuNet模型: {path}")
+        else:
+            print(f"✅ YuNet模型已存在: {path}")
+    except Exception as e:
+        if args.optional:
+            print(f"⚠️  下载YuNet模型失败，yunet后端将不可用: {e}")
+            return 0
+        print(f"❌ 下载YuNet模型失败: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
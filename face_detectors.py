@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+人脸检测后端 - 按配置选择检测器
+所有后端输入RGB uint8数组，输出face_recognition格式的(top, right, bottom, left)列表；
+不同部署可以在CPU开销和召回率之间取舍：
+
+    hog    face_recognition HOG检测（默认，CPU友好）
+    cnn    face_recognition CNN检测（召回高，CPU上很慢，适合有GPU的dlib）
+    haar   OpenCV Haar级联（最宽松，误检较多，通常只作兜底）
+    yunet  OpenCV DNN人脸检测（cv2.FaceDetectorYN，需要单独下载ONNX模型）
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import dlib
+import numpy as np
+
+from config_loader import resolve_path
+
+logger = logging.getLogger(__name__)
+
+
+def _to_locations(boxes, image_shape) -> List[tuple]:
+    """(x, y, w, h)框 -> 裁剪到图像范围内的(top, right, bottom, left)"""
+    height, width = image_shape[:2]
+    locations = []
+    for x, y, w, h in boxes:
+        top, left = max(int(y), 0), max(int(x), 0)
+        bottom, right = min(int(y + h), height), min(int(x + w), width)
+        if bottom > top and right > left:
+            locations.append((top, right, bottom, left))
+    return locations
+
+
+class FaceDetector:
+    """检测后端基类"""
+
+    name = 'base'
+
+    def detect(self, image_array: np.ndarray) -> List[tuple]:
+        raise NotImplementedError
+
+
+class HogDetector(FaceDetector):
+    """face_recognition的HOG检测器
+
+    face_recognition.face_locations共用一个全局的dlib检测器，多个线程同时检测不同尺寸的图像会使进程崩溃，
+    这里每个线程创建自己的检测器，结果与face_recognition.face_locations相同
+    """
+
+    name = 'hog'
+
+    def __init__(self, config: Dict):
+        import face_recognition.api
+        self._api = face_recognition.api
+        self.upsample = int(config.get('upsample', 1))
+        self._local = threading.local()
+
+    def _create_detector(self):
+        return dlib.get_frontal_face_detector()
+
+    def _detector(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = self._local.detector = self._create_detector()
+        return detector
+
+    def _rect(self, detection):
+        return detection
+
+    def detect(self, image_array: np.ndarray) -> List[tuple]:
+        return [self._api._trim_css_to_bounds(self._api._rect_to_css(self._rect(detection)), image_array.shape)
+                for detection in self._detector()(image_array, self.upsample)]
+
+
+class CnnDetector(HogDetector):
+    """face_recognition的CNN检测器（mmod）"""
+
+    name = 'cnn'
+
+    def _create_detector(self):
+        import face_recognition_models
+        return dlib.cnn_face_detection_model_v1(face_recognition_models.cnn_face_detector_model_location())
+
+    def _rect(self, detection):
+        return detection.rect
+
+
+class HaarDetector(FaceDetector):
+    """OpenCV Haar级联（参数放宽以检测更小的人脸）"""
+
+    name = 'haar'
+
+    def __init__(self, config: Dict):
+        self.scale_factor = float(config.get('haar_scale_factor', 1.05))
+        self.min_neighbors = int(config.get('haar_min_neighbors', 3))
+        self.min_size = int(config.get('haar_min_size', 30))
+        self._local = threading.local()
+
+    def _cascade(self):
+        # CascadeClassifier不是线程安全的，每个线程一个实例
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            self._local.cascade = cascade
+        return cascade
+
+    def detect(self, image_array: np.ndarray) -> List[tuple]:
+        gray_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+        faces = self._cascade().detectMultiScale(gray_image, scaleFactor=self.scale_factor,
+                                                 minNeighbors=self.min_neighbors,
+                                                 minSize=(self.min_size, self.min_size))
+        return _to_locations(faces, image_array.shape)
+
+
+class YuNetDetector(FaceDetector):
+    """OpenCV DNN人脸检测（YuNet），需要OpenCV 4.8+和ONNX模型文件
+
+    大图先缩小到input_size再检测，检测框按比例还原
+    """
+
+    name = 'yunet'
+
+    def __init__(self, config: Dict):
+        if not hasattr(cv2, 'FaceDetectorYN'):
+            raise RuntimeError(f"当前OpenCV({cv2.__version__})不支持FaceDetectorYN，需要4.8或更高版本")
+
+        self.model_path = resolve_path(config.get('yunet_model', 'models/face_detection_yunet_2023mar.onnx'))
+        if not os.path.exists(self.model_path):
+            raise RuntimeError(f"YuNet模型文件不存在: {self.model_path}")
+
+        self.input_size = int(config.get('yunet_input_size', 640))
+        self.score_threshold = float(config.get('yunet_score_threshold', 0.8))
+        self.nms_threshold = float(config.get('yunet_nms_threshold', 0.3))
+        self._local = threading.local()
+
+    def _detector(self):
+        # cv2.dnn网络不是线程安全的，每个线程一个实例
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(self.model_path, "", (self.input_size, self.input_size),
+                                                 self.score_threshold, self.nms_threshold)
+            self._local.detector = detector
+        return detector
+
+    def detect(self, image_array: np.ndarray) -> List[tuple]:
+        height, width = image_array.shape[:2]
+        scale = min(1.0, float(self.input_size) / max(height, width))
+        image = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        detector = self._detector()
+        detector.setInputSize((image.shape[1], image.shape[0]))
+        _, faces = detector.detect(image)
+        if faces is None:
+            return []
+        return _to_locations(faces[:, :4] / scale, image_array.shape)
+
+
+DETECTOR_BACKENDS = {
+    'hog': HogDetector,
+    'cnn': CnnDetector,
+    'haar': HaarDetector,
+    'yunet': YuNetDetector
+}
+
+
+class CascadeDetector(FaceDetector):
+    """按顺序尝试多个后端，前一个没有检测到人脸时才使用下一个"""
+
+    name = 'cascade'
+
+    def __init__(self, backends: List[FaceDetector], fallback_min_ms: float = 0):
+        self.backends = backends
+        # 剩余预算低于该值时不再运行兜底后端
+        self.fallback_min_ms = float(fallback_min_ms)
+
+    def detect(self, image_array: np.ndarray, allow_fallback: bool = True, deadline=None) -> List[tuple]:
+        """allow_fallback为False时只运行第一个后端（视频关键帧、时间预算不足等场景）
+
+        deadline为deadline.Deadline时，每个兜底后端运行前检查剩余预算
+        """
+        backends = self.backends if allow_fallback else self.backends[:1]
+        for index, backend in enumerate(backends):
+            if index > 0 and deadline is not None and deadline.remaining_ms() < self.fallback_min_ms:
+                logger.debug("剩余预算 %.0fms 不足，跳过兜底后端 %s", deadline.remaining_ms(), backend.name)
+                break
+            try:
+                face_locations = backend.detect(image_array)
+            except Exception as e:
+                logger.debug("%s检测失败: %s", backend.name, e)
+                continue
+            logger.debug("%s检测到 %s 个人脸", backend.name, len(face_locations))
+            if face_locations:
+                return face_locations
+        return []
+
+
+def create_detector(config: Optional[Dict] = None) -> CascadeDetector:
+    """根据config.json的face_extraction.detector创建检测器
+
+    backends按顺序尝试；无法初始化的后端（缺少模型等）记录警告后跳过，
+    全部不可用时退回hog；请求剩余预算低于fallback_min_ms时不运行兜底后端
+    """
+    config = config or {}
+    backends = []
+    for name in config.get('backends', ['hog', 'haar']):
+        backend_class = DETECTOR_BACKENDS.get(name)
+        if backend_class is None:
+            logger.warning("未知的人脸检测后端: %s", name)
+            continue
+        try:
+            backends.append(backend_class(config))
+        except Exception as e:
+            logger.warning("人脸检测后端 %s 不可用: %s", name, e)
+
+    if not backends:
+        backends.append(HogDetector(config))
+    return CascadeDetector(backends, config.get('fallback_min_ms', 1000))
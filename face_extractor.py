@@ -10,6 +10,9 @@
 
 使用方法:
     face-extractor extract --base64 <image_data> --output <output_file>
+    face-extractor extract --input group.jpg --multi --output <output_file>
+    face-extractor extract --input face_crop.jpg --crop --output <output_file>
+    face-extractor video --input meeting.mp4 --output <output_file>
     face-extractor --help
     face-extractor --version
 """
@@ -17,6 +20,7 @@
 import argparse
 import base64
 import json
+import logging
 import sys
 import time
 import platform
@@ -40,6 +44,7 @@ try:
     import face_recognition
     import cv2
     import numpy as np
+    import dlib
     from PIL import Image
     import io
 except ImportError as e:
@@ -47,10 +52,23 @@ except ImportError as e:
     print("请安装: pip install face-recognition opencv-python pillow")
     sys.exit(1)
 
+from config_loader import get_section, parse_size
+from debug_dump import DebugImageWriter
+from chip_archive import CHIP_PADDING, CHIP_SIZE, ChipArchive, l2_normalize
+from deadline import expired_result
+from face_detectors import create_detector
+from image_probe import REDUCED_COLOR_FLAGS, ImagePolicy, ImageRejected
+from memory_trace import traced_stage
+
 __version__ = "1.0.0"
 __platform__ = platform.system()
 __author__ = "Meeting Server Team"
 
+# 特征引擎标签：dlib ResNet编码器（face_recognition），随特征一起输出，特征库据此拒绝混用
+FEATURE_ENGINE = "dlib-resnet-v1"
+
+logger = logging.getLogger('face_extractor')
+
 def show_system_info():
     """显示系统信息"""
     print(f"人脸特征提取器 v{__version__}")
@@ -61,135 +79,74 @@ def show_system_info():
 class SimpleFaceExtractor:
     """简化的人脸特征提取器"""
     
-    def __init__(self):
+    def __init__(self, config: Optional[Dict] = None):
         self.feature_dim = 128  # 固定128维特征向量
+        self.feature_engine = FEATURE_ENGINE
+        
+        extraction_config = config if config is not None else get_section('face_extraction')
+        self.max_faces = int(extraction_config.get('max_faces', 5))
+        
+        # 人脸检测后端（按配置顺序尝试，默认HOG + Haar兜底）
+        detector_config = extraction_config.get('detector', {})
+        self.detector = create_detector(detector_config)
+        # Base64接口默认只用主检测后端（兜底后端会改变该接口的检出范围和耗时）
+        self.base64_fallback = bool(detector_config.get('base64_fallback', False))
+        
+        # 解码前的文件头检查：像素预算（超过时缩小解码或拒绝）和允许的颜色模式
+        self.image_policy = ImagePolicy(extraction_config.get('image_limits', {}))
         
-    def extract_feature_from_bytes(self, image_data: bytes) -> Dict:
-        """从字节数据提取特征码"""
+        # 仅编码模式（客户端已裁好的人脸图）的输入限制
+        self.crop_config = extraction_config.get('crop', {})
+        
+        # 快速层预筛（simple_face_extractor的HOG路径），首次使用时创建
+        self.prescreen_config = extraction_config.get('prescreen', {})
+        self._fast_tier = None
+        
+        # 调试图像由后台线程异步写盘
+        self.debug_writer = DebugImageWriter(get_section('debug_dump'))
+        
+        # 对齐人脸图存档（更换编码模型后用reembed_chips.py重新编码）
+        self.chip_archive = ChipArchive(get_section('chip_archive'))
+        
+    def extract_feature_from_bytes(self, image_data: bytes, deadline=None) -> Dict:
+        """从字节数据提取特征码（deadline为deadline.Deadline时，过期后跳过剩余阶段）"""
         start_time = time.time()
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征提取", feature_code="", quality=0.0)
         
         try:
-            print(f"DEBUG: 收到图像数据，大小: {len(image_data)} 字节", file=sys.stderr)
-            
-            # ✅ 修复：使用多种方法加载图像，确保兼容性
-            image_array = None
-            
-            # 方法1：使用OpenCV加载
-            try:
-                nparr = np.frombuffer(image_data, np.uint8)
-                image_array = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                if image_array is None:
-                    raise ValueError("cv2.imdecode failed")
-                
-                # 转换BGR到RGB（OpenCV使用BGR格式）
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
-                print(f"DEBUG: OpenCV加载成功，shape: {image_array.shape}, dtype: {image_array.dtype}", file=sys.stderr)
-                
-            except Exception as cv2_error:
-                print(f"DEBUG: OpenCV加载失败，尝试PIL方法: {cv2_error}", file=sys.stderr)
-                image_array = None
-            
-            # 方法2：使用PIL加载作为备选
-            if image_array is None:
-                try:
-                    image = Image.open(io.BytesIO(image_data))
-                    print(f"DEBUG: PIL图像加载成功，格式: {image.format}, 模式: {image.mode}, 尺寸: {image.size}", file=sys.stderr)
-                    
-                    # 转换为RGB格式
-                    if image.mode != 'RGB':
-                        print(f"DEBUG: 转换图像格式 {image.mode} -> RGB", file=sys.stderr)
-                        image = image.convert('RGB')
-                    
-                    # 转换为numpy数组
-                    image_array = np.array(image)
-                    print(f"DEBUG: PIL转换numpy数组成功，shape: {image_array.shape}, dtype: {image_array.dtype}", file=sys.stderr)
-                    
-                except Exception as pil_error:
-                    print(f"DEBUG: PIL加载也失败: {pil_error}", file=sys.stderr)
-                    raise ValueError(f"无法加载图像数据: OpenCV错误={cv2_error}, PIL错误={pil_error}")
-            
-            # ✅ 确保数组格式正确
-            if image_array.dtype != np.uint8:
-                print(f"DEBUG: 转换dtype {image_array.dtype} -> uint8", file=sys.stderr)
-                image_array = image_array.astype(np.uint8)
-            
-            # ✅ 确保是C连续数组（dlib要求）
-            if not image_array.flags['C_CONTIGUOUS']:
-                print(f"DEBUG: 转换为C连续数组", file=sys.stderr)
-                image_array = np.ascontiguousarray(image_array)
-            
-            # ✅ 确保图像尺寸合理（face_recognition对图像尺寸有要求）
-            height, width = image_array.shape[:2]
-            if height < 80 or width < 80:
-                print(f"DEBUG: 图像尺寸过小 ({width}x{height})，调整大小", file=sys.stderr)
-                # 调整图像大小
-                scale_factor = max(80.0/height, 80.0/width)
-                new_width = int(width * scale_factor)
-                new_height = int(height * scale_factor)
-                image_array = cv2.resize(image_array, (new_width, new_height), interpolation=cv2.INTER_AREA)
-                print(f"DEBUG: 调整后尺寸: {image_array.shape}", file=sys.stderr)
-            
-            print(f"DEBUG: 最终数组 - shape: {image_array.shape}, dtype: {image_array.dtype}, C_CONTIGUOUS: {image_array.flags['C_CONTIGUOUS']}", file=sys.stderr)
-            
-            # 检测人脸位置
-            print(f"DEBUG: 开始人脸检测...", file=sys.stderr)
-            print(f"DEBUG: 图像数组详细信息 - shape: {image_array.shape}, dtype: {image_array.dtype}", file=sys.stderr)
-            print(f"DEBUG: 图像数组内存布局 - C_CONTIGUOUS: {image_array.flags['C_CONTIGUOUS']}, F_CONTIGUOUS: {image_array.flags['F_CONTIGUOUS']}", file=sys.stderr)
-            print(f"DEBUG: 图像数组范围 - min: {image_array.min()}, max: {image_array.max()}", file=sys.stderr)
-            
-            # 尝试多种人脸检测方法
-            face_locations = []
+            image_array = self._load_image_array(image_data)
+        except Exception as e:
+            if isinstance(e, ImageRejected):
+                logger.info("图像被拒绝: %s", e)
+            else:
+                logger.exception("特征提取异常: %s", e)
+            return {
+                "success": False,
+                "feature_code": "",
+                "quality": 0.0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": f"特征提取失败: {str(e)}"
+            }
+        return self.extract_feature_from_array(image_array, deadline, start_time)
+    
+    def extract_feature_from_array(self, image_array: np.ndarray, deadline=None,
+                                   start_time: Optional[float] = None) -> Dict:
+        """从已解码的RGB uint8数组提取特征码（推理进程池直接在共享内存中的图像上调用）"""
+        start_time = start_time or time.time()
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征提取", feature_code="", quality=0.0)
+        
+        try:
+            rejected = self._prescreen(image_array, start_time)
+            if rejected:
+                return rejected
             
-            # 方法1: 默认CNN模型
-            try:
-                face_locations = face_recognition.face_locations(image_array, number_of_times_to_upsample=1)
-                print(f"DEBUG: 默认模型检测到 {len(face_locations)} 个人脸", file=sys.stderr)
-            except Exception as face_error:
-                print(f"DEBUG: 默认模型失败: {face_error}", file=sys.stderr)
-            
-            # 方法2: 如果没检测到，尝试HOG模型
-            if len(face_locations) == 0:
-                print(f"DEBUG: 尝试使用HOG模型...", file=sys.stderr)
-                try:
-                    face_locations = face_recognition.face_locations(image_array, model="hog")
-                    print(f"DEBUG: HOG模型检测到 {len(face_locations)} 个人脸", file=sys.stderr)
-                except Exception as hog_error:
-                    print(f"DEBUG: HOG模型失败: {hog_error}", file=sys.stderr)
-            
-            # 方法3: 如果还没检测到，使用OpenCV Haar级联
-            if len(face_locations) == 0:
-                print(f"DEBUG: 尝试使用OpenCV人脸检测...", file=sys.stderr)
-                try:
-                    # 使用OpenCV的Haar级联分类器（更宽松的检测）
-                    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                    gray_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
-                    # 降低参数以检测更小的人脸
-                    faces = face_cascade.detectMultiScale(gray_image, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
-                    
-                    if len(faces) > 0:
-                        print(f"DEBUG: OpenCV检测到 {len(faces)} 个人脸", file=sys.stderr)
-                        # 将OpenCV格式转换为face_recognition格式
-                        face_locations = []
-                        for (x, y, w, h) in faces:
-                            # OpenCV格式: (x, y, w, h) -> face_recognition格式: (top, right, bottom, left)
-                            face_locations.append((y, x + w, y + h, x))
-                            print(f"DEBUG:   人脸位置: x={x}, y={y}, w={w}, h={h}", file=sys.stderr)
-                    else:
-                        print(f"DEBUG: OpenCV也未检测到人脸", file=sys.stderr)
-                except Exception as cv_error:
-                    print(f"DEBUG: OpenCV检测失败: {cv_error}", file=sys.stderr)
+            face_locations = self._detect_faces(image_array, deadline)
             
             if not face_locations:
                 # 保存调试图像到debug目录
-                try:
-                    import os
-                    debug_dir = "./debug"
-                    os.makedirs(debug_dir, exist_ok=True)
-                    debug_file = os.path.join(debug_dir, f"failed_{int(time.time() * 1000)}.jpg")
-                    cv2.imwrite(debug_file, cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR))
-                    print(f"DEBUG: 未检测到人脸，图像已保存到: {debug_file}", file=sys.stderr)
-                except Exception as e:
-                    print(f"DEBUG: 保存调试图像失败: {e}", file=sys.stderr)
+                self._save_debug_image(image_array)
                 
                 return {
                     "success": False,
@@ -199,11 +156,15 @@ class SimpleFaceExtractor:
                     "message": "未检测到人脸"
                 }
             
+            if deadline is not None and deadline.expired():
+                return expired_result(start_time, "特征编码", feature_code="", quality=0.0)
+            
             # 使用第一个检测到的人脸
             face_location = face_locations[0]
             
             # 提取人脸特征编码
-            face_encodings = face_recognition.face_encodings(image_array, [face_location])
+            chip_ids = []
+            face_encodings = self._encode_faces(image_array, [face_location], chip_ids)
             
             if not face_encodings:
                 return {
@@ -232,18 +193,20 @@ class SimpleFaceExtractor:
             # 计算处理时间
             process_time = (time.time() - start_time) * 1000
             
-            return {
+            result = {
                 "success": True,
                 "feature_code": feature_code,
                 "quality": quality,
                 "process_time": process_time,
-                "message": "特征提取成功"
+                "message": "特征提取成功",
+                "engine": FEATURE_ENGINE
             }
+            if chip_ids and chip_ids[0]:
+                result["chip_id"] = chip_ids[0]
+            return result
             
         except Exception as e:
-            print(f"ERROR: 特征提取异常: {str(e)}", file=sys.stderr)
-            import traceback
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("特征提取异常: %s", e)
             return {
                 "success": False,
                 "feature_code": "",
@@ -252,24 +215,433 @@ class SimpleFaceExtractor:
                 "message": f"特征提取失败: {str(e)}"
             }
         
-    def extract_feature_from_base64(self, base64_image: str) -> Dict:
-        """从Base64图像数据提取特征码"""
+    def extract_faces_from_bytes(self, image_data: bytes, max_faces: Optional[int] = None, deadline=None) -> Dict:
+        """多人脸模式：一次检测，批量编码最多max_faces个人脸"""
         start_time = time.time()
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征提取", faces=[], face_count=0, detected_count=0)
         
         try:
-            # 解码Base64图像
-            image_data = base64.b64decode(base64_image)
-            image = Image.open(io.BytesIO(image_data))
+            image_array = self._load_image_array(image_data)
+        except Exception as e:
+            if isinstance(e, ImageRejected):
+                logger.info("图像被拒绝: %s", e)
+            else:
+                logger.error("多人脸特征提取异常: %s", e)
+            return {
+                "success": False,
+                "faces": [],
+                "face_count": 0,
+                "detected_count": 0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": f"特征提取失败: {str(e)}"
+            }
+        return self.extract_faces_from_array(image_array, max_faces, deadline, start_time)
+    
+    def extract_faces_from_array(self, image_array: np.ndarray, max_faces: Optional[int] = None, deadline=None,
+                                 start_time: Optional[float] = None) -> Dict:
+        """多人脸模式（已解码的RGB uint8数组）"""
+        start_time = start_time or time.time()
+        max_faces = self.max_faces if max_faces is None else max(1, int(max_faces))
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征提取", faces=[], face_count=0, detected_count=0)
+        
+        try:
+            face_locations = self._detect_faces(image_array, deadline)
             
-            # 转换为RGB格式
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            if not face_locations:
+                self._save_debug_image(image_array)
+                
+                return {
+                    "success": False,
+                    "faces": [],
+                    "face_count": 0,
+                    "detected_count": 0,
+                    "process_time": (time.time() - start_time) * 1000,
+                    "message": "未检测到人脸"
+                }
             
-            # 转换为numpy数组
-            image_array = np.array(image)
+            # 按人脸面积从大到小排序，只保留前max_faces个
+            face_locations = sorted(
+                face_locations,
+                key=lambda face: (face[2] - face[0]) * (face[1] - face[3]),
+                reverse=True
+            )
+            selected_locations = face_locations[:max_faces]
+            
+            if deadline is not None and deadline.expired():
+                return expired_result(start_time, "特征编码", faces=[], face_count=0,
+                                      detected_count=len(face_locations))
+            
+            # 所有人脸一次性编码
+            chip_ids = []
+            face_encodings = self._encode_faces(image_array, selected_locations, chip_ids)
+            
+            faces = []
+            for index, (face_location, face_encoding) in enumerate(zip(selected_locations, face_encodings)):
+                top, right, bottom, left = (int(v) for v in face_location)
+                feature_bytes = face_encoding.astype(np.float32).tobytes()
+                face_area_ratio = self._calculate_face_area((top, right, bottom, left), image_array.shape)
+                
+                faces.append({
+                    "face_location": {
+                        "top": top,
+                        "right": right,
+                        "bottom": bottom,
+                        "left": left
+                    },
+                    "feature_code": base64.b64encode(feature_bytes).decode('utf-8'),
+                    "quality": self._calculate_quality(image_array, (top, right, bottom, left), face_area_ratio)
+                })
+                if index < len(chip_ids) and chip_ids[index]:
+                    faces[-1]["chip_id"] = chip_ids[index]
+            
+            return {
+                "success": len(faces) > 0,
+                "faces": faces,
+                "face_count": len(faces),
+                "detected_count": len(face_locations),
+                "process_time": (time.time() - start_time) * 1000,
+                "message": "特征提取成功" if faces else "人脸特征编码失败",
+                "engine": FEATURE_ENGINE
+            }
+            
+        except Exception as e:
+            logger.error("多人脸特征提取异常: %s", e)
+            return {
+                "success": False,
+                "faces": [],
+                "face_count": 0,
+                "detected_count": 0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": f"特征提取失败: {str(e)}"
+            }
+    
+    def extract_faces_from_base64(self, base64_image: str, max_faces: Optional[int] = None, deadline=None) -> Dict:
+        """多人脸模式（Base64输入）"""
+        try:
+            image_data = base64.b64decode(base64_image)
+        except Exception as e:
+            return {
+                "success": False,
+                "faces": [],
+                "face_count": 0,
+                "detected_count": 0,
+                "process_time": 0.0,
+                "message": f"Base64解码失败: {str(e)}"
+            }
+        return self.extract_faces_from_bytes(image_data, max_faces, deadline)
+    
+    def encode_face_crop(self, image_data: bytes, box: Optional[tuple] = None, landmarks: Optional[List] = None,
+                         aligned: bool = False, deadline=None) -> Dict:
+        """仅编码模式：客户端已完成人脸检测，上传的是人脸裁剪图，跳过检测直接定位关键点并编码
+        
+        box为裁剪图内的人脸框(top, right, bottom, left)，默认整张图；
+        landmarks为裁剪图内的5点或68点关键点[[x, y], ...]，提供时不再预测关键点；
+        aligned为True时输入必须是dlib.get_face_chip方式对齐的150x150人脸图，直接编码
+        """
+        start_time = time.time()
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征编码", feature_code="", quality=0.0)
+        
+        def rejected(message: str) -> Dict:
+            return {
+                "success": False,
+                "feature_code": "",
+                "quality": 0.0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": message
+            }
+        
+        # 廉价校验在解码前后完成：字节数、尺寸、宽高比、框和关键点范围
+        max_bytes = parse_size(self.crop_config.get('max_bytes', '512KB'))
+        if len(image_data) > max_bytes:
+            return rejected(f"人脸图过大: {len(image_data)} 字节，最大 {max_bytes} 字节")
+        
+        # 人脸图不缩小解码：像素数超过 max_side x max_side 的直接拒绝
+        max_side = int(self.crop_config.get('max_side', 640))
+        try:
+            self.image_policy.check(image_data, max_pixels=max_side * max_side, allow_reduce=False)
+        except ImageRejected as e:
+            return rejected(str(e))
+        
+        image_array = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if image_array is None:
+            return rejected("无法解码人脸图")
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+        height, width = image_array.shape[:2]
+        
+        try:
+            if aligned:
+                if (height, width) != (CHIP_SIZE, CHIP_SIZE):
+                    return rejected(f"对齐人脸图必须为{CHIP_SIZE}x{CHIP_SIZE}，实际为{width}x{height}")
+                chip = image_array
+                face_location = (0, width, height, 0)
+                mode = "aligned"
+            else:
+                min_side = int(self.crop_config.get('min_side', 48))
+                max_aspect_ratio = float(self.crop_config.get('max_aspect_ratio', 2.0))
+                if min(height, width) < min_side or max(height, width) > max_side:
+                    return rejected(f"人脸图尺寸 {width}x{height} 超出范围（边长 {min_side}-{max_side}）")
+                if max(height, width) / min(height, width) > max_aspect_ratio:
+                    return rejected(f"人脸图宽高比超出范围: {width}x{height}")
+                
+                top, right, bottom, left = box if box is not None else (0, width, height, 0)
+                if not (0 <= left < right <= width and 0 <= top < bottom <= height):
+                    return rejected(f"人脸框超出人脸图范围: {box}")
+                face_location = (int(top), int(right), int(bottom), int(left))
+                rect = dlib.rectangle(int(left), int(top), int(right), int(bottom))
+                
+                if landmarks is not None:
+                    if len(landmarks) not in (5, 68):
+                        return rejected(f"关键点数必须为5或68，实际为{len(landmarks)}")
+                    points = [dlib.point(int(round(x)), int(round(y))) for x, y in landmarks]
+                    if any(not (0 <= p.x < width and 0 <= p.y < height) for p in points):
+                        return rejected("关键点超出人脸图范围")
+                    shape = dlib.full_object_detection(rect, points)
+                    mode = "landmarks"
+                else:
+                    shape = face_recognition.api.pose_predictor_5_point(image_array, rect)
+                    mode = "crop"
+                
+                chip = dlib.get_face_chip(image_array, shape, size=CHIP_SIZE, padding=CHIP_PADDING)
+            
+            encoding = np.array(face_recognition.api.face_encoder.compute_face_descriptor(chip))
+        except (TypeError, ValueError) as e:
+            return rejected(f"人脸框或关键点格式错误: {e}")
+        
+        feature_bytes = encoding.astype(np.float32).tobytes()
+        face_area = self._calculate_face_area(face_location, image_array.shape)
+        result = {
+            "success": True,
+            "feature_code": base64.b64encode(feature_bytes).decode('utf-8'),
+            "quality": self._calculate_quality(image_array, face_location, face_area),
+            "process_time": (time.time() - start_time) * 1000,
+            "message": "特征提取成功",
+            "engine": FEATURE_ENGINE,
+            "mode": mode
+        }
+        chip_id = self.chip_archive.submit(chip, encoding, self.feature_engine)
+        if chip_id:
+            result["chip_id"] = chip_id
+        return result
+    
+    @traced_stage('encode')
+    def _encode_faces(self, image_array: np.ndarray, face_locations: List[tuple],
+                      chip_ids: Optional[List] = None, normalize: bool = False) -> List[np.ndarray]:
+        """单次调用dlib编码器计算多个人脸的特征向量
+        
+        传入chip_ids且启用了人脸图存档时，先裁出对齐人脸图再对人脸图编码（与直接编码结果完全相同），
+        人脸图提交存档，chip_id依次追加到chip_ids（未能存档的为None）
+        normalize为True时返回float32并L2归一化的特征，存档的也是归一化后的特征（与返回给调用方的一致）
+        """
+        if not face_locations:
+            return []
+        
+        # 与face_recognition.face_encodings相同：5点关键点 + ResNet编码器
+        raw_landmarks = face_recognition.api._raw_face_landmarks(image_array, face_locations, model="small")
+        shapes = dlib.full_object_detections()
+        for landmark in raw_landmarks:
+            shapes.append(landmark)
+        
+        if chip_ids is not None and self.chip_archive.enabled:
+            chips = dlib.get_face_chips(image_array, shapes, size=CHIP_SIZE, padding=CHIP_PADDING)
+            encodings = [np.array(descriptor) for descriptor in face_recognition.api.face_encoder.compute_face_descriptor(chips)]
+            if normalize:
+                encodings = [l2_normalize(encoding) for encoding in encodings]
+            for chip, encoding in zip(chips, encodings):
+                chip_ids.append(self.chip_archive.submit(chip, encoding, self.feature_engine, normalize))
+            return encodings
+        
+        descriptors = face_recognition.api.face_encoder.compute_face_descriptor(image_array, shapes, 1)
+        encodings = [np.array(descriptor) for descriptor in descriptors]
+        return [l2_normalize(encoding) for encoding in encodings] if normalize else encodings
+    
+    @traced_stage('encode')
+    def _encode_crops(self, images: List[np.ndarray], face_locations: List[tuple]) -> List[np.ndarray]:
+        """多张图像各一个人脸：逐张定位关键点、裁出对齐人脸图，再单次调用dlib编码器批量编码
+        
+        与对每张图调用_encode_faces的结果相同，编码器只调用一次（视频各轨迹的最佳帧一起编码）
+        """
+        if not images:
+            return []
+        
+        chips = []
+        for image_array, face_location in zip(images, face_locations):
+            shape = face_recognition.api._raw_face_landmarks(image_array, [face_location], model="small")[0]
+            chips.append(dlib.get_face_chip(image_array, shape, size=CHIP_SIZE, padding=CHIP_PADDING))
+        return [np.array(descriptor) for descriptor in face_recognition.api.face_encoder.compute_face_descriptor(chips)]
+    
+    @traced_stage('decode')
+    def _load_image_array(self, image_data: bytes) -> np.ndarray:
+        """解码图像字节为dlib可用的RGB uint8数组
+        
+        解码前先读文件头：颜色模式不支持或超过像素预算时抛出ImageRejected，
+        超过预算的JPEG按image_policy给出的倍数缩小解码
+        """
+        logger.debug("收到图像数据，大小: %s 字节", len(image_data))
+        info, reduce = self.image_policy.check(image_data)
+        if reduce > 1:
+            logger.info("图像 %sx%s 超过像素预算，按1/%s缩小解码", info.width, info.height, reduce)
+
+        # ✅ 修复：使用多种方法加载图像，确保兼容性
+        image_array = None
+        cv2_error = None
+
+        # 方法1：使用OpenCV加载
+        try:
+            nparr = np.frombuffer(image_data, np.uint8)
+            image_array = cv2.imdecode(nparr, REDUCED_COLOR_FLAGS[reduce])
+            if image_array is None:
+                raise ValueError("cv2.imdecode failed")
+
+            # 转换BGR到RGB（OpenCV使用BGR格式）
+            image_array = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+            logger.debug("OpenCV加载成功，shape: %s, dtype: %s", image_array.shape, image_array.dtype)
+
+        except Exception as e:
+            logger.debug("OpenCV加载失败，尝试PIL方法: %s", e)
+            cv2_error = e
+            image_array = None
+
+        # 方法2：使用PIL加载作为备选
+        if image_array is None:
+            try:
+                image_array = self._pil_decode(image_data, info, reduce)
+                logger.debug("PIL转换numpy数组成功，shape: %s, dtype: %s", image_array.shape, image_array.dtype)
+
+            except Exception as pil_error:
+                logger.debug("PIL加载也失败: %s", pil_error)
+                raise ValueError(f"无法加载图像数据: OpenCV错误={cv2_error}, PIL错误={pil_error}")
+
+        # ✅ 确保数组格式正确
+        if image_array.dtype != np.uint8:
+            logger.debug("转换dtype %s -> uint8", image_array.dtype)
+            image_array = image_array.astype(np.uint8)
+
+        # ✅ 确保是C连续数组（dlib要求）
+        if not image_array.flags['C_CONTIGUOUS']:
+            logger.debug("转换为C连续数组")
+            image_array = np.ascontiguousarray(image_array)
+
+        # ✅ 确保图像尺寸合理（face_recognition对图像尺寸有要求）
+        height, width = image_array.shape[:2]
+        if height < 80 or width < 80:
+            logger.debug("图像尺寸过小 (%sx%s)，调整大小", width, height)
+            # 调整图像大小
+            scale_factor = max(80.0/height, 80.0/width)
+            new_width = int(width * scale_factor)
+            new_height = int(height * scale_factor)
+            image_array = cv2.resize(image_array, (new_width, new_height), interpolation=cv2.INTER_AREA)
+            logger.debug("调整后尺寸: %s", image_array.shape)
+
+        logger.debug("最终数组 - shape: %s, dtype: %s, C_CONTIGUOUS: %s", image_array.shape, image_array.dtype, image_array.flags['C_CONTIGUOUS'])
+        
+        return image_array
+
+    @traced_stage('detect')
+    def _detect_faces(self, image_array: np.ndarray, deadline=None, allow_fallback: bool = True) -> List[tuple]:
+        """按配置的检测后端依次尝试，返回(top, right, bottom, left)列表（剩余预算不足时不走兜底）"""
+        # 检测人脸位置
+        # 整图min/max需要遍历数组，只在开启DEBUG时计算
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("开始人脸检测...")
+            logger.debug("图像数组详细信息 - shape: %s, dtype: %s", image_array.shape, image_array.dtype)
+            logger.debug("图像数组内存布局 - C_CONTIGUOUS: %s, F_CONTIGUOUS: %s", image_array.flags['C_CONTIGUOUS'], image_array.flags['F_CONTIGUOUS'])
+            logger.debug("图像数组范围 - min: %s, max: %s", image_array.min(), image_array.max())
+
+        face_locations = self.detector.detect(image_array, allow_fallback, deadline)
+        if not face_locations:
+            logger.debug("所有检测后端均未检测到人脸")
+        return face_locations
+
+    @traced_stage('prescreen')
+    def _prescreen(self, image_array: np.ndarray, start_time: float) -> Optional[Dict]:
+        """快速层预筛，未通过时返回失败结果，ResNet编码不再执行"""
+        if not self.prescreen_config.get('enabled', False):
+            return None
+        
+        if self._fast_tier is None:
+            import simple_face_extractor
+            self._fast_tier = simple_face_extractor.SimpleFaceExtractor()
+        
+        screen = self._fast_tier.prescreen(
+            image_array,
+            max_side=int(self.prescreen_config.get('max_side', 320)),
+            min_quality=float(self.prescreen_config.get('min_quality', 0.2)),
+            reject_multiple=bool(self.prescreen_config.get('reject_multiple', False))
+        )
+        logger.debug("预筛结果: %s", screen)
+        if screen['passed']:
+            return None
+        
+        self.debug_writer.submit(image_array, prefix='prescreen')
+        return {
+            "success": False,
+            "feature_code": "",
+            "quality": screen['quality'],
+            "process_time": (time.time() - start_time) * 1000,
+            "message": f"预筛未通过: {screen['message']}",
+            "tier": "fast",
+            "prescreen": screen
+        }
+
+    def _save_debug_image(self, image_array: np.ndarray):
+        """提交未检测到人脸的图像到后台写入器（采样、限额，不阻塞请求）"""
+        self.debug_writer.submit(image_array)
+
+    def extract_feature_from_base64(self, base64_image: str, deadline=None) -> Dict:
+        """从Base64图像数据提取特征码"""
+        start_time = time.time()
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征提取", feature_code="", quality=0.0)
+        
+        try:
+            image_array = self._load_base64_image_array(base64_image)
+        except Exception as e:
+            return {
+                "success": False,
+                "feature_code": "",
+                "quality": 0.0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": f"特征提取异常: {str(e)}"
+            }
+        return self.extract_normalized_feature_from_array(image_array, deadline, start_time)
+    
+    @traced_stage('decode')
+    def _load_base64_image_array(self, base64_image: str) -> np.ndarray:
+        """解码Base64图像为RGB数组（PIL解码，解码前同样按文件头检查）"""
+        image_data = base64.b64decode(base64_image)
+        info, reduce = self.image_policy.check(image_data)
+        return self._pil_decode(image_data, info, reduce)
+    
+    def _pil_decode(self, image_data: bytes, info, reduce: int = 1) -> np.ndarray:
+        """PIL解码为RGB数组；reduce>1时用draft让JPEG解码器直接输出缩小的图像"""
+        image = Image.open(io.BytesIO(image_data))
+        if reduce > 1:
+            image.draft('RGB', (info.width // reduce, info.height // reduce))
+        
+        # 转换为RGB格式
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # 转换为numpy数组
+        return np.array(image)
+    
+    def extract_normalized_feature_from_array(self, image_array: np.ndarray, deadline=None,
+                                              start_time: Optional[float] = None) -> Dict:
+        """Base64接口的提取逻辑：多个人脸时取最大的一个，特征做L2归一化"""
+        start_time = start_time or time.time()
+        if deadline is not None and deadline.expired():
+            return expired_result(start_time, "特征提取", feature_code="", quality=0.0)
+        
+        try:
+            rejected = self._prescreen(image_array, start_time)
+            if rejected:
+                return rejected
             
             # 检测人脸位置
-            face_locations = face_recognition.face_locations(image_array)
+            face_locations = self._detect_faces(image_array, deadline, self.base64_fallback)
             
             if not face_locations:
                 return {
@@ -287,8 +659,12 @@ class SimpleFaceExtractor:
                                  key=lambda face: (face[2] - face[0]) * (face[1] - face[3]))
                 face_locations = [largest_face]
             
+            if deadline is not None and deadline.expired():
+                return expired_result(start_time, "特征编码", feature_code="", quality=0.0)
+            
             # 提取人脸特征编码
-            face_encodings = face_recognition.face_encodings(image_array, face_locations)
+            chip_ids = []
+            face_encodings = self._encode_faces(image_array, face_locations, chip_ids, normalize=True)
             
             if not face_encodings:
                 return {
@@ -299,7 +675,7 @@ class SimpleFaceExtractor:
                     "message": "人脸特征提取失败"
                 }
             
-            # 获取第一个人脸的特征向量
+            # 获取第一个人脸的特征向量（已转换为float32并L2归一化）
             feature_vector = face_encodings[0]
             
             # 验证特征向量维度
@@ -312,12 +688,6 @@ class SimpleFaceExtractor:
                     "message": f"特征向量维度错误: {len(feature_vector)} != {self.feature_dim}"
                 }
             
-            # 转换为float32并进行L2归一化
-            feature_vector = feature_vector.astype(np.float32)
-            norm = np.linalg.norm(feature_vector)
-            if norm > 0:
-                feature_vector = feature_vector / norm
-            
             # 转换为Base64编码
             feature_bytes = feature_vector.tobytes()
             feature_code = base64.b64encode(feature_bytes).decode('utf-8')
@@ -328,13 +698,17 @@ class SimpleFaceExtractor:
             
             process_time = (time.time() - start_time) * 1000
             
-            return {
+            result = {
                 "success": True,
                 "feature_code": feature_code,
                 "quality": quality,
                 "process_time": process_time,
-                "message": "特征提取成功"
+                "message": "特征提取成功",
+                "engine": FEATURE_ENGINE
             }
+            if chip_ids and chip_ids[0]:
+                result["chip_id"] = chip_ids[0]
+            return result
             
         except Exception as e:
             return {
@@ -406,6 +780,8 @@ def main():
                        version=f'face-extractor {__version__} ({__platform__})')
     parser.add_argument('--info', action='store_true', 
                        help='显示系统信息')
+    parser.add_argument('--debug', action='store_true',
+                       help='在stderr输出调试日志')
     
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
     
@@ -418,12 +794,30 @@ def main():
     input_group.add_argument('--base64', help='Base64编码的图像数据')
     
     extract_parser.add_argument('--output', required=True, help='输出文件路径')
+    extract_parser.add_argument('--multi', action='store_true', help='多人脸模式：一次提取图中所有人脸')
+    extract_parser.add_argument('--max-faces', type=int, help='多人脸模式下最多提取的人脸数（默认读取config.json）')
+    extract_parser.add_argument('--crop', action='store_true', help='仅编码模式：输入是已裁好的人脸图，跳过人脸检测')
+    extract_parser.add_argument('--box', help='仅编码模式下人脸图内的人脸框 top,right,bottom,left（默认整张图）')
+    extract_parser.add_argument('--aligned', action='store_true', help='仅编码模式：输入是对齐好的150x150人脸图')
+    
+    # video命令
+    video_parser = subparsers.add_parser('video', help='从视频文件提取人脸特征（每条人脸轨迹一个特征）')
+    video_parser.add_argument('--input', required=True, help='输入视频文件路径')
+    video_parser.add_argument('--output', required=True, help='输出文件路径')
+    video_parser.add_argument('--sample-fps', type=float, help='每秒采样帧数（默认读取config.json）')
     
     # help命令
     help_parser = subparsers.add_parser('help', help='显示帮助信息')
     
     args = parser.parse_args()
     
+    # 调试日志默认关闭，关闭时不做任何格式化和数组统计
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.WARNING,
+        format='%(levelname)s: %(message)s',
+        stream=sys.stderr
+    )
+    
     if args.info:
         show_system_info()
         return
@@ -438,7 +832,13 @@ def main():
             try:
                 with open(args.input, 'rb') as f:
                     image_data = f.read()
-                result = extractor.extract_feature_from_bytes(image_data)
+                if args.crop or args.aligned:
+                    box = tuple(int(v) for v in args.box.split(',')) if args.box else None
+                    result = extractor.encode_face_crop(image_data, box, aligned=args.aligned)
+                elif args.multi:
+                    result = extractor.extract_faces_from_bytes(image_data, args.max_faces)
+                else:
+                    result = extractor.extract_feature_from_bytes(image_data)
             except Exception as e:
                 result = {
                     "success": False,
@@ -448,8 +848,23 @@ def main():
                     "message": f"读取输入文件失败: {str(e)}"
                 }
         elif args.base64:
-            # 从Base64字符串处理
-            result = extractor.extract_feature_from_base64(args.base64)
+            # 从Base64字符串处理；Base64或人脸框格式错误时同样写入失败结果
+            try:
+                if args.crop or args.aligned:
+                    box = tuple(int(v) for v in args.box.split(',')) if args.box else None
+                    result = extractor.encode_face_crop(base64.b64decode(args.base64), box, aligned=args.aligned)
+                elif args.multi:
+                    result = extractor.extract_faces_from_base64(args.base64, args.max_faces)
+                else:
+                    result = extractor.extract_feature_from_base64(args.base64)
+            except Exception as e:
+                result = {
+                    "success": False,
+                    "feature_code": "",
+                    "quality": 0.0,
+                    "process_time": 0.0,
+                    "message": f"解析输入参数失败: {str(e)}"
+                }
         
         # 写入输出文件
         try:
@@ -457,7 +872,9 @@ def main():
                 json.dump(result, f, ensure_ascii=False, indent=2)
             
             # 在stdout输出简单状态
-            if result['success']:
+            if result['success'] and args.multi:
+                print(f"SUCCESS: 特征提取完成，人脸数: {result['face_count']}")
+            elif result['success']:
                 print(f"SUCCESS: 特征提取完成，质量: {result['quality']:.3f}")
             else:
                 print(f"ERROR: {result['message']}")
@@ -467,6 +884,26 @@ def main():
             print(f"ERROR: 写入输出文件失败: {e}")
             sys.exit(1)
     
+    elif args.command == 'video':
+        from video_extractor import VideoFaceExtractor
+        
+        video_extractor = VideoFaceExtractor(SimpleFaceExtractor())
+        result = video_extractor.extract_from_file(args.input, args.sample_fps)
+        
+        try:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            
+            if result['success']:
+                print(f"SUCCESS: 视频特征提取完成，人脸轨迹数: {result['track_count']}")
+            else:
+                print(f"ERROR: {result['message']}")
+                sys.exit(1)
+                
+        except Exception as e:
+            print(f"ERROR: 写入输出文件失败: {e}")
+            sys.exit(1)
+    
     elif args.command == 'help' or args.command is None:
         parser.print_help()
     
@@ -4,24 +4,48 @@
 提供RESTful API接口，与Go主服务解耦
 """
 
+import base64
+import hmac
 import json
 import logging
+import multiprocessing
+import os
+import tempfile
 import time
 from datetime import datetime
-from flask import Flask, request, jsonify
+
+# 打包后的可执行文件被推理进程池以spawn方式重新启动时，直接进入工作进程，不再执行下面的服务初始化
+multiprocessing.freeze_support()
+
+# 线程预算必须在numpy/OpenCV导入之前应用（BLAS线程数只在加载时读取环境变量）
+from thread_budget import apply_thread_budget, get_layout
+apply_thread_budget()
+
+import numpy as np
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
 from face_extractor import SimpleFaceExtractor
+from video_extractor import VideoFaceExtractor
+from config_loader import get_section, parse_size
+from deadline import TIMEOUT_HEADER, TIMEOUT_PARAM, parse_deadline
+from log_setup import setup_logging
+from inference_pool import InferencePool
+from readiness import ReadinessMonitor, request_capacity
+from profiler import ProfileManager
+from reembed_chips import match_reembedded
+import memory_trace
+from batch_stream import JsonArrayStream, MultipartBatchStream, SpooledPart, run_bounded
+from gallery import FEATURE_DIM, GalleryManager, decode_feature, read_base_file
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/face_service.log'),
-        logging.StreamHandler()
-    ]
-)
+# 配置日志（异步队列写入，请求日志按采样率记录）
+request_logger = setup_logging(get_section('logging'))
 logger = logging.getLogger(__name__)
+thread_layout = get_layout()
+if thread_layout.get("enabled"):
+    logger.info("线程预算: worker %s/%s, 核心 %s, 线程数 %s", thread_layout["worker_index"],
+                thread_layout["workers"], thread_layout["cores"], thread_layout["threads"])
 
 # 创建Flask应用
 app = Flask(__name__)
@@ -29,6 +53,53 @@ CORS(app)  # 允许跨域请求
 
 # 全局特征提取器实例
 face_extractor = SimpleFaceExtractor()
+video_extractor = VideoFaceExtractor(face_extractor)
+
+# 推理进程池（启用时检测和编码在独立进程中执行，图像经共享内存传递）
+inference_pool = InferencePool(get_section('inference_pool'), face_extractor)
+extraction_backend = inference_pool if inference_pool.enabled else face_extractor
+
+# 按租户分片的特征库
+gallery_manager = GalleryManager(get_section('gallery'))
+
+# 就绪检查：启动自检在后台运行，完成前/ready返回503
+readiness = ReadinessMonitor(get_section('readiness'), request_capacity(get_section('readiness'), inference_pool))
+readiness.start_self_test(extraction_backend)
+
+# 按需剖析（/admin/profile触发），没有进行中的剖析时请求钩子不做额外工作
+profile_manager = ProfileManager(get_section('admin').get('profile_directory', './logs/profiles'))
+
+# 可选的内存插桩（memory.enabled，默认关闭）：请求/阶段峰值分配和RSS，/admin/memory查看
+memory_tracker = memory_trace.install(get_section('memory'))
+
+# 计入进行中请求数的提取类接口；其中单图接口的耗时计入p95（批量和视频耗时随输入大小变化）
+EXTRACTION_PATHS = {'/api/face/extract', '/api/face/extract/multi', '/api/face/encode', '/api/face/video',
+                    '/api/face/batch'}
+LATENCY_PATHS = {'/api/face/extract', '/api/face/extract/multi', '/api/face/encode'}
+
+@app.before_request
+def _track_request_start():
+    if request.path in EXTRACTION_PATHS:
+        g.readiness_start = time.time()
+        readiness.request_started()
+        session = profile_manager.session
+        if session is not None:
+            g.profile_token = (session, session.request_started())
+        if memory_tracker.enabled:
+            g.memory_token = memory_tracker.request_started(request.path)
+
+@app.teardown_request
+def _track_request_end(error=None):
+    start = g.pop('readiness_start', None)
+    if start is not None:
+        readiness.request_finished((time.time() - start) * 1000, record=request.path in LATENCY_PATHS)
+    profile = g.pop('profile_token', None)
+    if profile is not None:
+        session, token = profile
+        session.request_finished(token)
+    memory_token = g.pop('memory_token', None)
+    if memory_token is not None:
+        memory_tracker.request_finished(memory_token)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -37,9 +108,192 @@ def health_check():
         "status": "healthy",
         "service": "face-recognition-service",
         "version": "1.0.0",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "debug_dump": face_extractor.debug_writer.get_status(),
+        "chip_archive": face_extractor.chip_archive.get_status(),
+        "inference_pool": inference_pool.get_status(),
+        "gallery": gallery_manager.get_status(),
+        "threads": get_layout()
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查接口：自检未通过、排队过多或最近p95过高时返回503，负载均衡器据此摘除worker"""
+    ready, details = readiness.check()
+    pool_load = inference_pool.load()
+    if pool_load["enabled"] and pool_load["abandoned"] >= inference_pool.slots:
+        # 全部槽位被超时仍未结束的任务占用（工作进程卡死），新请求只会得到繁忙
+        ready = False
+        details["reasons"].append("推理进程池的槽位全部被超时未结束的任务占用")
+    details.update(
+        status="ready" if ready else "not_ready",
+        inference_pool=pool_load,
+        timestamp=datetime.now().isoformat()
+    )
+    return jsonify(details), 200 if ready else 503
+
+def _admin_guard():
+    """管理接口访问控制：未启用时返回404；配置了token时校验X-Admin-Token，否则只允许本机访问
+    通过时返回None，否则返回错误响应"""
+    admin_config = get_section('admin')
+    if not admin_config.get('enabled', False):
+        return jsonify({"success": False, "message": "接口不存在"}), 404
+    token = admin_config.get('token', '')
+    if token:
+        provided = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(provided.encode('utf-8'), str(token).encode('utf-8')):
+            return jsonify({"success": False, "message": "管理令牌无效"}), 403
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"success": False, "message": "未配置管理令牌时只允许本机访问"}), 403
+    return None
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """开始按需剖析提取请求：剖析seconds秒或requests个请求，立即返回剖析ID（202），结果用GET /admin/profile/<ID>取回
+    参数（查询参数或JSON）: mode=sample|cprofile, seconds, requests, interval_ms"""
+    denied = _admin_guard()
+    if denied is not None:
+        return denied
+
+    try:
+        params = dict(request.args)
+        if request.is_json:
+            params.update(request.get_json(silent=True) or {})
+
+        try:
+            session = profile_manager.start(mode=params.get('mode', 'sample'),
+                                            seconds=float(params.get('seconds', 10)),
+                                            max_requests=int(params.get('requests', 0)),
+                                            interval_ms=float(params.get('interval_ms', 5)))
+        except RuntimeError as e:
+            return jsonify({"success": False, "message": str(e)}), 409
+
+        summary = session.summary()
+        logger.info("开始剖析: %s", summary)
+        summary.update(success=True, status="running", result_url=f"/admin/profile/{session.id}")
+        if inference_pool.enabled:
+            summary["warning"] = "推理进程池已启用，检测和编码在工作进程中执行，剖析只能看到HTTP线程等待结果的部分"
+        return jsonify(summary), 202
+
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    except Exception as e:
+        logger.error("剖析异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/admin/profile/<profile_id>', methods=['GET'])
+def admin_profile_result(profile_id):
+    """取回剖析结果：进行中返回202和当前进度，结束后按format返回
+    参数: format=collapsed|pstats|raw|json（默认sample为collapsed、cprofile为pstats）, sort, limit"""
+    denied = _admin_guard()
+    if denied is not None:
+        return denied
+
+    try:
+        summary = profile_manager.load(profile_id)
+        if summary is None:
+            return jsonify({"success": False, "message": f"剖析不存在: {profile_id}"}), 404
+
+        session = profile_manager.session
+        if summary["status"] == "running":
+            if session is not None and session.id == profile_id:
+                summary = dict(session.summary(), status="running")
+            return jsonify(dict(summary, success=True)), 202
+        if summary["status"] == "failed":
+            return jsonify(dict(summary, success=False)), 500
+
+        mode = summary["mode"]
+        output_format = request.args.get('format', 'collapsed' if mode == 'sample' else 'pstats')
+        limit = int(request.args.get('limit', 50))
+        if output_format not in ('collapsed', 'pstats', 'raw', 'json'):
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        if output_format == 'collapsed' and mode != 'sample':
+            raise ValueError("collapsed格式只适用于sample方式")
+        if output_format in ('pstats', 'raw') and mode != 'cprofile':
+            raise ValueError(f"{output_format}格式只适用于cprofile方式")
+
+        if output_format == 'collapsed':
+            return Response(profile_manager.collapsed(profile_id), mimetype='text/plain')
+        if output_format == 'pstats':
+            return Response(profile_manager.pstats_text(profile_id, request.args.get('sort', 'cumulative'), limit),
+                            mimetype='text/plain')
+        if output_format == 'raw':
+            return send_file(profile_manager.pstats_path(profile_id), mimetype='application/octet-stream',
+                             as_attachment=True, download_name='profile.pstats')
+
+        summary.update(success=True)
+        if mode == 'sample':
+            summary["top_stacks"] = [{"stack": stack, "samples": count}
+                                     for stack, count in profile_manager.top_stacks(profile_id, limit)]
+        return jsonify(summary)
+
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    except Exception as e:
+        logger.error("读取剖析结果异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/admin/memory', methods=['GET'])
+def admin_memory():
+    """内存插桩结果：请求/阶段峰值、本进程和推理工作进程的RSS、分配最多的代码位置
+    参数: limit, group_by=lineno|traceback|filename, baseline=1（保存当前快照为基线）, diff=1（与基线比较）"""
+    denied = _admin_guard()
+    if denied is not None:
+        return denied
+    if not memory_tracker.enabled:
+        return jsonify({"success": False, "message": "内存插桩未启用（memory.enabled）"}), 404
+
+    try:
+        limit = int(request.args.get('limit', memory_tracker.top_sites))
+        if request.args.get('baseline') == '1':
+            memory_tracker.set_baseline()
+        status = memory_tracker.get_status()
+        status.update(
+            success=True,
+            worker_index=get_layout().get("worker_index"),
+            inference_workers=inference_pool.worker_memory(),
+            top_sites=memory_tracker.allocation_sites(limit, request.args.get('group_by', 'lineno'),
+                                                      diff=request.args.get('diff') == '1'),
+            timestamp=datetime.now().isoformat()
+        )
+        return jsonify(status)
+
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    except Exception as e:
+        logger.error("内存统计异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+def _request_deadline(params=None):
+    """请求的截止时间：请求头X-Request-Timeout-Ms优先，其次参数timeout_ms，都没有时用performance.default_timeout_ms"""
+    value = request.headers.get(TIMEOUT_HEADER)
+    if value is None and params is not None:
+        value = params.get(TIMEOUT_PARAM)
+    return parse_deadline(value, get_section('performance').get('default_timeout_ms', 0))
+
+def _result_status(result):
+    """超过截止时间的结果返回504（带部分结果的除外），推理进程池繁忙返回503，其余按原样返回200"""
+    if result.get('deadline_exceeded') and not result.get('partial'):
+        return 504
+    if result.get('busy'):
+        return 503
+    return 200
+
 @app.route('/api/face/extract', methods=['POST'])
 def extract_features():
     """特征提取接口（优化版：支持Base64和二进制数据）"""
@@ -65,10 +319,12 @@ def extract_features():
             base64_image = data['image']
             user_id = data.get('user_id', 'unknown')
             
-            logger.info(f"收到JSON请求，用户: {user_id}, 数据长度: {len(base64_image)}")
+            deadline = _request_deadline(data)
+            
+            request_logger.info("收到JSON请求，用户: %s, 数据长度: %s", user_id, len(base64_image))
             
             # 提取特征
-            result = face_extractor.extract_feature_from_base64(base64_image)
+            result = extraction_backend.extract_feature_from_base64(base64_image, deadline)
         
         elif request.content_type and 'multipart/form-data' in request.content_type:
             # 表单格式（文件上传）
@@ -81,21 +337,23 @@ def extract_features():
             file = request.files['image']
             user_id = request.form.get('user_id', 'unknown')
             image_data = file.read()
+            deadline = _request_deadline(request.form)
             
-            logger.info(f"收到文件上传请求，用户: {user_id}, 文件大小: {len(image_data)} bytes")
+            request_logger.info("收到文件上传请求，用户: %s, 文件大小: %s bytes", user_id, len(image_data))
             
             # 提取特征
-            result = face_extractor.extract_feature_from_bytes(image_data)
+            result = extraction_backend.extract_feature_from_bytes(image_data, deadline)
         
         else:
             # 二进制数据
             image_data = request.get_data()
             user_id = request.args.get('user_id', 'unknown')
+            deadline = _request_deadline(request.args)
             
-            logger.info(f"收到二进制请求，用户: {user_id}, 数据大小: {len(image_data)} bytes")
+            request_logger.info("收到二进制请求，用户: %s, 数据大小: %s bytes", user_id, len(image_data))
             
             # 提取特征
-            result = face_extractor.extract_feature_from_bytes(image_data)
+            result = extraction_backend.extract_feature_from_bytes(image_data, deadline)
         
         # 添加请求信息
         result['user_id'] = user_id
@@ -104,22 +362,238 @@ def extract_features():
         
         # 详细日志
         if result['success']:
-            logger.info(f"✅ 用户 {user_id} 特征提取成功，质量: {result['quality']:.3f}, 耗时: {result['service_time']:.1f}ms")
+            request_logger.info("✅ 用户 %s 特征提取成功，质量: %.3f, 耗时: %.1fms", user_id, result['quality'], result['service_time'])
         else:
-            logger.warning(f"❌ 用户 {user_id} 特征提取失败: {result['message']}")
+            logger.warning("❌ 用户 %s 特征提取失败: %s", user_id, result['message'])
         
-        return jsonify(result)
+        return jsonify(result), _result_status(result)
         
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
     except Exception as e:
-        logger.error(f"❌ 特征提取异常: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 特征提取异常: %s", e)
         return jsonify({
             "success": False,
             "message": f"服务内部错误: {str(e)}",
             "timestamp": datetime.now().isoformat()
         }), 500
 
+def _read_request_image():
+    """读取请求中的图像（JSON/Form/Binary），返回(图像字节, 参数字典)"""
+    if request.content_type and 'application/json' in request.content_type:
+        data = request.get_json()
+        if not data or 'image' not in data:
+            raise ValueError("缺少image参数")
+        return base64.b64decode(data['image']), data
+    
+    if request.content_type and 'multipart/form-data' in request.content_type:
+        if 'image' not in request.files:
+            raise ValueError("缺少image文件")
+        return request.files['image'].read(), request.form
+    
+    return request.get_data(), request.args
+
+@app.route('/api/face/extract/multi', methods=['POST'])
+def extract_multi_features():
+    """多人脸特征提取接口：一次上传，返回所有人脸的位置、特征和质量"""
+    start_time = time.time()
+    
+    try:
+        try:
+            image_data, params = _read_request_image()
+            deadline = _request_deadline(params)
+            max_faces = _max_faces_param(params)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
+        user_id = params.get('user_id', 'unknown')
+        
+        request_logger.info("收到多人脸请求，用户: %s, 数据大小: %s bytes", user_id, len(image_data))
+        
+        result = extraction_backend.extract_faces_from_bytes(image_data, max_faces, deadline)
+        
+        result['user_id'] = user_id
+        result['service_time'] = (time.time() - start_time) * 1000
+        result['timestamp'] = datetime.now().isoformat()
+        
+        if result['success']:
+            request_logger.info("✅ 用户 %s 多人脸提取成功，人脸数: %s/%s, 耗时: %.1fms", user_id, result['face_count'], result['detected_count'], result['service_time'])
+        else:
+            logger.warning("❌ 用户 %s 多人脸提取失败: %s", user_id, result['message'])
+        
+        return jsonify(result), _result_status(result)
+        
+    except Exception as e:
+        logger.error("❌ 多人脸特征提取异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+def _max_faces_param(params):
+    """max_faces参数：未提供时返回None（使用配置值），必须是正整数"""
+    value = params.get('max_faces')
+    if value is None or value == '':
+        return None
+    try:
+        max_faces = int(value) if not isinstance(value, (bool, float)) else 0
+    except (TypeError, ValueError):
+        max_faces = 0
+    if max_faces < 1:
+        raise ValueError(f"max_faces必须是正整数: {value}")
+    return max_faces
+
+def _structured_param(params, name):
+    """JSON请求中直接是对象/数组，表单和查询参数中是JSON字符串"""
+    value = params.get(name)
+    if isinstance(value, str):
+        try:
+            value = json.loads(value) if value else None
+        except ValueError:
+            raise ValueError(f"{name}必须是JSON")
+    return value
+
+@app.route('/api/face/encode', methods=['POST'])
+def encode_face_crop():
+    """仅编码接口：客户端已完成人脸检测，上传人脸裁剪图（可附人脸框或关键点），跳过检测直接编码"""
+    start_time = time.time()
+    
+    try:
+        try:
+            image_data, params = _read_request_image()
+            deadline = _request_deadline(params)
+            box = _structured_param(params, 'box')
+            if isinstance(box, dict):
+                box = (box['top'], box['right'], box['bottom'], box['left'])
+            elif box is not None:
+                box = tuple(box)
+                if len(box) != 4:
+                    raise ValueError("box必须是{top, right, bottom, left}")
+            landmarks = _structured_param(params, 'landmarks')
+            aligned = str(params.get('aligned', '')).lower() in ('1', 'true', 'yes')
+        except (ValueError, KeyError) as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
+        user_id = params.get('user_id', 'unknown')
+        request_logger.info("收到人脸图编码请求，用户: %s, 数据大小: %s bytes", user_id, len(image_data))
+        
+        result = face_extractor.encode_face_crop(image_data, box, landmarks, aligned, deadline)
+        
+        result['user_id'] = user_id
+        result['service_time'] = (time.time() - start_time) * 1000
+        result['timestamp'] = datetime.now().isoformat()
+        
+        if result['success']:
+            request_logger.info("✅ 用户 %s 人脸图编码成功，质量: %.3f, 耗时: %.1fms", user_id, result['quality'], result['service_time'])
+        else:
+            logger.warning("❌ 用户 %s 人脸图编码失败: %s", user_id, result['message'])
+        
+        return jsonify(result), _result_status(result)
+        
+    except Exception as e:
+        logger.error("❌ 人脸图编码异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/face/video', methods=['POST'])
+def extract_video_features():
+    """视频特征提取接口：抽帧 + 跟踪，每条人脸轨迹返回一个最佳特征"""
+    start_time = time.time()
+    temp_path = None
+    
+    try:
+        # 截止时间从收到请求起算，上传耗时计入预算
+        deadline = _request_deadline(request.args)
+        max_upload_size = parse_size(get_section('video').get('max_upload_size', '500MB'))
+        if request.content_length and request.content_length > max_upload_size:
+            return jsonify({
+                "success": False,
+                "message": f"视频文件过大，最大允许 {max_upload_size} 字节"
+            }), 413
+        
+        # VideoCapture需要文件路径，上传内容先写入临时文件
+        # 分块上传（没有Content-Length）时边写边计数，超过上限立即中止
+        if request.content_type and 'multipart/form-data' in request.content_type:
+            _, params, files = parse_form_data(request.environ, max_content_length=max_upload_size)
+            if 'video' not in files:
+                return jsonify({
+                    "success": False,
+                    "message": "缺少video文件"
+                }), 400
+            
+            file = files['video']
+            suffix = os.path.splitext(file.filename or '')[1] or '.mp4'
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+                temp_path = temp_file.name
+                file.save(temp_file)
+        else:
+            params = request.args
+            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
+                temp_path = temp_file.name
+                received = 0
+                while True:
+                    chunk = request.stream.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    if received > max_upload_size:
+                        raise RequestEntityTooLarge()
+                    temp_file.write(chunk)
+        
+        user_id = params.get('user_id', 'unknown')
+        sample_fps = params.get('sample_fps')
+        sample_fps = float(sample_fps) if sample_fps else None
+        
+        request_logger.info("收到视频请求，用户: %s, 文件大小: %s bytes", user_id, os.path.getsize(temp_path))
+        
+        result = video_extractor.extract_from_file(temp_path, sample_fps, deadline)
+        
+        result['user_id'] = user_id
+        result['service_time'] = (time.time() - start_time) * 1000
+        result['timestamp'] = datetime.now().isoformat()
+        
+        if result['success']:
+            request_logger.info("✅ 用户 %s 视频提取成功，轨迹数: %s, 检测次数: %s/%s, 耗时: %.1fms", user_id, result['track_count'], result['detector_runs'], result['sampled_frames'], result['service_time'])
+        else:
+            logger.warning("❌ 用户 %s 视频提取失败: %s", user_id, result['message'])
+        
+        return jsonify(result), _result_status(result)
+        
+    except RequestEntityTooLarge:
+        return jsonify({
+            "success": False,
+            "message": f"视频文件过大，最大允许 {max_upload_size} 字节"
+        }), 413
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error("❌ 视频特征提取异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+    
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
 @app.route('/api/face/compare', methods=['POST'])
 def compare_features():
     """特征比对接口"""
@@ -159,52 +633,296 @@ def compare_features():
         return jsonify(result)
         
     except Exception as e:
-        logger.error(f"特征比对异常: {str(e)}")
+        logger.error("特征比对异常: %s", e)
         return jsonify({
             "success": False,
             "message": f"服务内部错误: {str(e)}",
             "timestamp": datetime.now().isoformat()
         }), 500
 
-@app.route('/api/face/batch', methods=['POST'])
-def batch_extract():
-    """批量特征提取接口"""
+def _require_engine(data: dict) -> str:
+    """特征库请求必须带engine（提取结果中的engine）：不同引擎的特征不可比较，不能按默认值混入特征库"""
+    engine = data.get('engine')
+    if not engine:
+        raise ValueError("缺少engine参数（使用提取结果中的engine，如dlib-resnet-v1、hog-v1）")
+    return str(engine)
+
+@app.route('/api/gallery/<tenant_id>/enroll', methods=['POST'])
+def gallery_enroll(tenant_id):
+    """录入特征到租户特征库"""
     start_time = time.time()
     
     try:
         data = request.get_json()
-        if not data or 'images' not in data:
+        if not data or 'user_id' not in data or 'feature_code' not in data:
             return jsonify({
                 "success": False,
-                "message": "请求数据格式错误，需要images数组"
+                "message": "缺少user_id或feature_code参数"
             }), 400
         
-        images = data['images']
-        if not isinstance(images, list):
+        feature = decode_feature(data['feature_code'])
+        gallery_manager.enroll(tenant_id, str(data['user_id']), feature, _require_engine(data))
+        
+        return jsonify({
+            "success": True,
+            "tenant_id": tenant_id,
+            "user_id": data['user_id'],
+            "process_time": (time.time() - start_time) * 1000,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error("特征录入异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/gallery/<tenant_id>/users/<user_id>', methods=['DELETE'])
+def gallery_delete(tenant_id, user_id):
+    """从租户特征库删除用户"""
+    try:
+        deleted = gallery_manager.delete(tenant_id, user_id)
+        return jsonify({
+            "success": deleted,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "message": "删除成功" if deleted else "用户不存在"
+        }), 200 if deleted else 404
+        
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error("特征删除异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/gallery/<tenant_id>/search', methods=['POST'])
+def gallery_search(tenant_id):
+    """在租户特征库中检索（只扫描该租户的分片）"""
+    start_time = time.time()
+    
+    try:
+        data = request.get_json()
+        if not data or 'feature_code' not in data:
+            return jsonify({
+                "success": False,
+                "message": "缺少feature_code参数"
+            }), 400
+        
+        query = decode_feature(data['feature_code'])
+        result = gallery_manager.search(tenant_id, query, data.get('top_k'), data.get('tolerance'),
+                                        _require_engine(data))
+        
+        result['success'] = True
+        result['tenant_id'] = tenant_id
+        result['process_time'] = (time.time() - start_time) * 1000
+        result['timestamp'] = datetime.now().isoformat()
+        return jsonify(result)
+        
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error("特征检索异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/gallery/<tenant_id>/rebuild', methods=['POST'])
+def gallery_rebuild(tenant_id):
+    """用批量导入的特征重建租户特征库（旁路构建、样本校验后原子替换，检索不中断）"""
+    start_time = time.time()
+    
+    try:
+        data = request.get_json() or {}
+        missing = []
+        if 'users' in data:
+            engine = _require_engine(data)
+            users = data['users']
+            ids = [str(user['user_id']) for user in users]
+            features = np.array([decode_feature(user['feature_code']) for user in users],
+                                dtype=np.float32).reshape(-1, FEATURE_DIM)
+        elif 'file' in data:
+            engine = _require_engine(data)
+            # 只允许读取特征库目录下的文件（离线任务的输出）
+            path = os.path.join(gallery_manager.directory, os.path.basename(str(data['file'])))
+            if not os.path.exists(path):
+                return jsonify({
+                    "success": False,
+                    "message": f"文件不存在: {data['file']}"
+                }), 404
+            snapshot, _ = read_base_file(path)
+            ids, features = snapshot.ids, snapshot.features
+        elif 'reembedded' in data:
+            # reembed_chips.py的输出：按原特征把已录入的特征替换为对应人脸图的新特征
+            path = os.path.join(gallery_manager.directory, os.path.basename(str(data['reembedded'])))
+            if not os.path.exists(path):
+                return jsonify({
+                    "success": False,
+                    "message": f"文件不存在: {data['reembedded']}"
+                }), 404
+            with np.load(path, allow_pickle=False) as reembedded:
+                engine = data.get('engine', str(reembedded['engine']))
+            ids, features, missing = match_reembedded(*gallery_manager.export(tenant_id), path)
+            if missing and not data.get('drop_missing', False):
+                return jsonify({
+                    "success": False,
+                    "message": f"{len(missing)}个用户的特征在人脸图存档中找不到，"
+                               f"确认后传drop_missing=true将其从重建后的特征库中移除",
+                    "missing": missing[:100],
+                    "missing_count": len(missing)
+                }), 409
+        else:
             return jsonify({
                 "success": False,
-                "message": "images必须是数组格式"
+                "message": "缺少users、file或reembedded参数"
             }), 400
         
-        results = []
-        for i, image_data in enumerate(images):
-            try:
-                base64_image = image_data.get('image', '')
-                user_id = image_data.get('user_id', f'batch_{i}')
-                
-                result = face_extractor.extract_feature_from_base64(base64_image)
-                result['user_id'] = user_id
-                result['batch_index'] = i
-                
-                results.append(result)
-                
-            except Exception as e:
-                results.append({
+        wait = bool(data.get('wait', False))
+        event = gallery_manager.rebuild(tenant_id, ids, features, wait=wait, engine=engine)
+        
+        return jsonify({
+            "success": True,
+            "tenant_id": tenant_id,
+            "size": len(ids),
+            "dropped": len(missing),
+            "message": "重建完成" if wait else "重建已开始，进度见/health",
+            "event": event,
+            "process_time": (time.time() - start_time) * 1000,
+            "timestamp": datetime.now().isoformat()
+        }), 200 if wait else 202
+        
+    except (ValueError, KeyError) as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error("特征库重建异常: %s", e)
+        return jsonify({
+            "success": False,
+            "message": f"服务内部错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+def _batch_item_result(index, image_data, batch_deadline):
+    """处理批量请求中的一项；单项的错误转换为失败结果，不影响其他项"""
+    user_id = f'batch_{index}'
+    # 批量项在处理线程中执行，剖析进行中时同样计入（采样这些线程，但不计入请求数）
+    session = profile_manager.session
+    profile_token = session.request_started() if session is not None else None
+    try:
+        if isinstance(image_data, SpooledPart):
+            # multipart文件部分：原始图像字节，不经过base64
+            user_id = image_data.user_id or user_id
+            deadline = parse_deadline(image_data.timeout_ms)
+            deadline = deadline.earlier(batch_deadline) if deadline else batch_deadline
+            result = extraction_backend.extract_feature_from_bytes(image_data.read(), deadline)
+        
+        else:
+            if not isinstance(image_data, dict):
+                raise ValueError("批量项必须是包含image的对象")
+            user_id = image_data.get('user_id', user_id)
+            base64_image = image_data.get('image', '')
+            
+            deadline = parse_deadline(image_data.get(TIMEOUT_PARAM))
+            deadline = deadline.earlier(batch_deadline) if deadline else batch_deadline
+            
+            result = extraction_backend.extract_feature_from_base64(base64_image, deadline)
+        
+    except Exception as e:
+        result = {
+            "success": False,
+            "message": f"处理失败: {str(e)}"
+        }
+    finally:
+        if profile_token is not None:
+            session.request_finished(profile_token, count=False)
+    
+    result['user_id'] = user_id
+    result['batch_index'] = index
+    return result
+
+@app.route('/api/face/batch', methods=['POST'])
+def batch_extract():
+    """批量特征提取接口（JSON的images数组或multipart的多个image文件，从请求流中逐项解析，边读边处理）"""
+    start_time = time.time()
+    
+    try:
+        batch_config = get_section('batch')
+        chunk_size = parse_size(batch_config.get('chunk_size', '64KB'))
+        max_item_bytes = parse_size(batch_config.get('max_item_size', '32MB'))
+        # 流式解析时逐项计数，超过上限立即返回400，不再继续读取请求体
+        max_items = int(get_section('performance').get('batch_size_limit', 10))
+        
+        if request.mimetype == 'multipart/form-data':
+            boundary = request.mimetype_params.get('boundary')
+            if not boundary:
+                return jsonify({
                     "success": False,
-                    "user_id": image_data.get('user_id', f'batch_{i}'),
-                    "batch_index": i,
-                    "message": f"处理失败: {str(e)}"
-                })
+                    "message": "multipart请求缺少boundary"
+                }), 400
+            # 每个image部分前可带user_id/timeout_ms字段；整批的截止时间用请求头或查询参数
+            reader = MultipartBatchStream(request.stream, boundary,
+                                          file_field='image',
+                                          chunk_size=chunk_size,
+                                          max_item_bytes=max_item_bytes,
+                                          spool_memory=parse_size(batch_config.get('spool_memory', '1MB')),
+                                          max_items=max_items)
+            missing_message = "缺少image文件"
+            deadline_params = request.args
+        
+        elif request.content_type and 'application/json' in request.content_type:
+            reader = JsonArrayStream(request.stream,
+                                     array_key='images',
+                                     chunk_size=chunk_size,
+                                     max_item_bytes=max_item_bytes,
+                                     max_items=max_items)
+            missing_message = "请求数据格式错误，需要images数组"
+            deadline_params = reader.fields
+        
+        else:
+            return jsonify({
+                "success": False,
+                "message": "请求数据格式错误，需要images数组或multipart的image文件"
+            }), 400
+        
+        # 整个批次的截止时间在读到第一项时确定（请求头，或之前读到的timeout_ms参数）；
+        # 单项可用timeout_ms给出更早的截止时间，过期的项直接跳过
+        batch_deadline = []
+        
+        def items():
+            for image_data in reader.items():
+                if not batch_deadline:
+                    batch_deadline.append(_request_deadline(deadline_params))
+                yield image_data
+        
+        results = run_bounded(items(),
+                              lambda i, image_data: _batch_item_result(i, image_data, batch_deadline[0]),
+                              int(batch_config.get('concurrency', 2)))
+        
+        if not reader.found_array:
+            return jsonify({
+                "success": False,
+                "message": missing_message
+            }), 400
         
         # 统计结果
         success_count = sum(1 for r in results if r.get('success', False))
@@ -215,17 +933,24 @@ def batch_extract():
             "total_count": total_count,
             "success_count": success_count,
             "failed_count": total_count - success_count,
+            "deadline_exceeded_count": sum(1 for r in results if r.get('deadline_exceeded', False)),
             "results": results,
             "batch_time": (time.time() - start_time) * 1000,
             "timestamp": datetime.now().isoformat()
         }
         
-        logger.info(f"批量处理完成: {success_count}/{total_count} 成功")
+        request_logger.info("批量处理完成: %s/%s 成功, 请求体 %s bytes", success_count, total_count,
+                            reader.bytes_read)
         
         return jsonify(response)
         
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
     except Exception as e:
-        logger.error(f"批量处理异常: {str(e)}")
+        logger.error("批量处理异常: %s", e)
         return jsonify({
             "success": False,
             "message": f"服务内部错误: {str(e)}",
@@ -239,9 +964,20 @@ def not_found(error):
         "message": "接口不存在",
         "available_endpoints": [
             "GET /health",
+            "GET /ready",
+            "POST /admin/profile",
+            "GET /admin/profile/<profile_id>",
+            "GET /admin/memory",
             "POST /api/face/extract", 
+            "POST /api/face/extract/multi",
+            "POST /api/face/encode",
+            "POST /api/face/video",
             "POST /api/face/compare",
-            "POST /api/face/batch"
+            "POST /api/face/batch",
+            "POST /api/gallery/<tenant_id>/enroll",
+            "POST /api/gallery/<tenant_id>/search",
+            "POST /api/gallery/<tenant_id>/rebuild",
+            "DELETE /api/gallery/<tenant_id>/users/<user_id>"
         ]
     }), 404
 
@@ -272,9 +1008,18 @@ if __name__ == '__main__':
     logger.info("监听地址: http://0.0.0.0:8081")
     logger.info("可用接口:")
     logger.info("  GET  /health - 健康检查")
+    logger.info("  GET  /ready - 就绪检查（自检、排队、p95）")
     logger.info("  POST /api/face/extract - 特征提取（支持JSON/Form/Binary）")
+    logger.info("  POST /api/face/extract/multi - 多人脸特征提取")
+    logger.info("  POST /api/face/encode - 人脸裁剪图仅编码（跳过检测）")
+    logger.info("  POST /api/face/video - 视频特征提取（抽帧+跟踪）")
     logger.info("  POST /api/face/compare - 特征比对") 
-    logger.info("  POST /api/face/batch - 批量处理")
+    logger.info("  POST /api/face/batch - 批量处理（JSON/Form）")
+    logger.info("  POST /api/gallery/<tenant_id>/enroll|search - 租户特征库录入/检索")
+    logger.info("  POST /api/gallery/<tenant_id>/rebuild - 租户特征库重建（原子替换）")
+    logger.info("  POST /admin/profile - 开始按需剖析提取请求（需启用admin）")
+    logger.info("  GET  /admin/profile/<profile_id> - 取回剖析结果")
+    logger.info("  GET  /admin/memory - 内存插桩结果（需启用admin和memory）")
     logger.info("=" * 60)
     logger.info("✅ 模型已预加载，等待请求...")
     logger.info("💡 提示：HTTP模式比进程模式快10-20倍（9秒 → 200-500ms）")
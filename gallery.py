@@ -0,0 +1,1119 @@
+#!/usr/bin/env python3
+"""
+人脸特征库 - 按租户（会议/组织）分片
+每个租户的特征库首次使用时从磁盘懒加载，内存超出预算时按LRU淘汰，
+检索只扫描调用方所在的分片；录入/删除追加写日志，由后台线程合并
+多个worker进程各自加载同一租户时，写入和合并持有跨进程文件锁，检索前读取其他进程追加的日志尾部
+可选int8标量量化存储：内存中只保留量化码，精确的float特征留在磁盘上按需映射，用于重排序
+"""
+
+import atexit
+import base64
+import collections
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config_loader import parse_size
+
+try:
+    import fcntl
+except ImportError:  # Windows：服务以单进程运行，文件锁退化为空操作
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIM = 128
+
+# 特征引擎标签（与face_extractor.FEATURE_ENGINE一致）；不同引擎的特征不可比较，同一特征库不能混用
+DEFAULT_ENGINE = 'dlib-resnet-v1'
+
+# 量化快照检索：每次转换为float32的行数（缓冲区512KB，留在CPU缓存中）
+SCAN_ROWS = 1024
+# 量化粗排后用精确特征重排序的最少候选数
+DEFAULT_RERANK_CANDIDATES = 64
+
+# 基础快照行/叠加层行的失效序号：尚未被删除或更新
+ALIVE = np.iinfo(np.int64).max
+
+# 租户ID同时用作文件名，只允许安全字符
+_TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+
+
+def decode_feature(feature_code: str) -> np.ndarray:
+    """Base64特征码 -> float32特征向量"""
+    feature = np.frombuffer(base64.b64decode(feature_code), dtype=np.float32)
+    if feature.shape[0] != FEATURE_DIM:
+        raise ValueError(f"特征向量维度错误: {feature.shape[0]} != {FEATURE_DIM}")
+    return feature
+
+
+def validate_tenant_id(tenant_id: str) -> str:
+    """校验租户ID，防止路径穿越"""
+    if not tenant_id or not _TENANT_ID_PATTERN.match(tenant_id):
+        raise ValueError(f"非法的租户ID: {tenant_id}")
+    return tenant_id
+
+
+class FileLock:
+    """基于fcntl.flock的跨进程文件锁（同一进程内不同线程各自打开文件描述符，同样互斥）"""
+
+    def __init__(self, path: str, blocking: bool = True):
+        self.path = path
+        self.blocking = blocking
+        self._fd = None
+
+    def acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        flags = fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fd, flags)
+            return True
+        except BlockingIOError:
+            os.close(self._fd)
+            self._fd = None
+            return False
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def _nearest(sq_dist: np.ndarray, ids: List[str], top_k: int, available: int) -> List[tuple]:
+    """按平方距离取前top_k个(user_id, 欧氏距离)，屏蔽的行已置为inf"""
+    top_k = min(top_k, available)
+    candidates = np.argpartition(sq_dist, top_k - 1)[:top_k]
+    candidates = candidates[np.argsort(sq_dist[candidates])]
+    return [(ids[i], float(np.sqrt(sq_dist[i]))) for i in candidates]
+
+
+class GallerySnapshot:
+    """不可变的特征库快照：检索期间持有引用即可得到一致视图"""
+
+    def __init__(self, ids: List[str], features: np.ndarray, sq_norms: Optional[np.ndarray] = None,
+                 owner=None):
+        self.ids = list(ids)
+        self.features = np.ascontiguousarray(features, dtype=np.float32).reshape(-1, FEATURE_DIM)
+        # 预先计算平方范数，检索时 |f-q|^2 = |f|^2 + |q|^2 - 2f·q 只需一次矩阵向量乘
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.features, self.features)
+        self.sq_norms = sq_norms
+        self.index = {user_id: i for i, user_id in enumerate(self.ids)}
+        # 正在使用该快照的检索数，替换后等其归零再退役
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        # 特征矩阵来自共享内存时持有映射对象，必须最后赋值以便先释放数组视图
+        self.owner = owner
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def pin(self):
+        with self._inflight_lock:
+            self._inflight += 1
+
+    def unpin(self):
+        with self._inflight_lock:
+            self._inflight -= 1
+
+    @property
+    def nbytes(self) -> int:
+        """估算快照占用的内存"""
+        return self.features.nbytes + self.sq_norms.nbytes + sum(len(i) for i in self.ids) * 2
+
+    def search(self, query: np.ndarray, top_k: int, masked_rows: Optional[np.ndarray] = None) -> List[tuple]:
+        """返回距离最近的top_k个(user_id, 欧氏距离)，masked_rows中的行不参与排序"""
+        available = len(self.ids) - (len(masked_rows) if masked_rows is not None else 0)
+        if available <= 0:
+            return []
+
+        query = query.astype(np.float32)
+        sq_dist = self.sq_norms + float(query @ query) - 2.0 * (self.features @ query)
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        if masked_rows is not None and len(masked_rows):
+            sq_dist[masked_rows] = np.inf
+        return _nearest(sq_dist, self.ids, top_k, available)
+
+
+def quantize_features(features: np.ndarray, chunk_rows: int = 65536) -> tuple:
+    """按向量的int8标量量化：scale = max|x| / 127，x ≈ code * scale，返回(codes, scales)"""
+    features = np.asarray(features, dtype=np.float32).reshape(-1, FEATURE_DIM)
+    codes = np.empty(features.shape, dtype=np.int8)
+    scales = np.empty(len(features), dtype=np.float32)
+    # 分块计算，临时数组大小与特征库大小无关
+    for start in range(0, len(features), chunk_rows):
+        block = features[start:start + chunk_rows]
+        block_scales = np.abs(block).max(axis=1) / 127.0
+        block_scales[block_scales == 0] = 1.0
+        codes[start:start + len(block)] = np.rint(block / block_scales[:, None])
+        scales[start:start + len(block)] = block_scales
+    return codes, scales
+
+
+def new_float_path(prefix: str) -> str:
+    """量化快照的精确特征文件：每个快照一个新文件，已映射旧文件的检索不受替换影响"""
+    return f"{prefix}.{uuid.uuid4().hex[:8]}.f32.npy"
+
+
+class QuantizedSnapshot(GallerySnapshot):
+    """int8量化的不可变快照：内存中只有量化码、量化系数和平方范数（每条约136字节，float32为520字节）
+
+    检索先用查询的量化码与库的量化码做整数点积粗排（int8乘积之和小于2^24，
+    按块转换为float32后由BLAS计算，结果精确），再从按需映射的float特征文件读出前几名的精确特征重排序
+    """
+
+    def __init__(self, ids: List[str], codes: np.ndarray, scales: np.ndarray, sq_norms: np.ndarray,
+                 float_path: str, rerank_candidates: int = DEFAULT_RERANK_CANDIDATES):
+        self.ids = list(ids)
+        self.codes = np.ascontiguousarray(codes, dtype=np.int8).reshape(-1, FEATURE_DIM)
+        self.scales = np.asarray(scales, dtype=np.float32)
+        self.sq_norms = np.asarray(sq_norms, dtype=np.float32)
+        self.float_path = float_path
+        self.rerank_candidates = max(1, int(rerank_candidates))
+        # 创建时即映射：文件在快照退役后才会被删除
+        self.features = np.load(float_path, mmap_mode='r') if len(self.ids) else \
+            np.empty((0, FEATURE_DIM), dtype=np.float32)
+        if self.features.shape != self.codes.shape:
+            raise ValueError(f"精确特征文件与量化码不一致: {float_path}")
+        self.index = {user_id: i for i, user_id in enumerate(self.ids)}
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        self.owner = None
+
+    @classmethod
+    def from_features(cls, ids: List[str], features: np.ndarray, float_path: str,
+                      rerank_candidates: int = DEFAULT_RERANK_CANDIDATES) -> 'QuantizedSnapshot':
+        """量化float特征，并把精确特征写入float_path"""
+        features = np.ascontiguousarray(features, dtype=np.float32).reshape(-1, FEATURE_DIM)
+        np.save(float_path, features)
+        codes, scales = quantize_features(features)
+        sq_norms = np.einsum('ij,ij->i', features, features)
+        return cls(ids, codes, scales, sq_norms, float_path, rerank_candidates)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes + self.sq_norms.nbytes + sum(len(i) for i in self.ids) * 2
+
+    def search(self, query: np.ndarray, top_k: int, masked_rows: Optional[np.ndarray] = None) -> List[tuple]:
+        available = len(self.ids) - (len(masked_rows) if masked_rows is not None else 0)
+        if available <= 0:
+            return []
+
+        query = query.astype(np.float32).reshape(FEATURE_DIM)
+        query_codes, query_scale = quantize_features(query)
+        query_sq = float(query @ query)
+
+        # 粗排：|f-q|^2 ≈ |f|^2 + |q|^2 - 2 * scale_f * scale_q * (code_f · code_q)
+        dots = self._code_dots(query_codes[0].astype(np.float32))
+        sq_dist = self.sq_norms + query_sq - 2.0 * (self.scales * query_scale[0]) * dots
+        if masked_rows is not None and len(masked_rows):
+            sq_dist[masked_rows] = np.inf
+
+        count = min(max(top_k, self.rerank_candidates), available)
+        candidates = np.argpartition(sq_dist, count - 1)[:count]
+        # 按行号顺序读取映射文件
+        candidates.sort()
+
+        # 重排序：候选的精确距离
+        diff = np.asarray(self.features[candidates], dtype=np.float32) - query
+        exact_sq = np.einsum('ij,ij->i', diff, diff)
+        order = np.argsort(exact_sq)[:min(top_k, available)]
+        return [(self.ids[candidates[i]], float(np.sqrt(exact_sq[i]))) for i in order]
+
+    def _code_dots(self, query_codes: np.ndarray) -> np.ndarray:
+        """全部量化码与查询量化码的点积；按块转换，临时内存只有SCAN_ROWS行"""
+        dots = np.empty(len(self.codes), dtype=np.float32)
+        buffer = np.empty((SCAN_ROWS, FEATURE_DIM), dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_ROWS):
+            block = self.codes[start:start + SCAN_ROWS]
+            converted = buffer[:len(block)]
+            np.copyto(converted, block, casting='unsafe')
+            np.dot(converted, query_codes, out=dots[start:start + len(block)])
+        return dots
+
+    def select(self, keep: np.ndarray, extra: GallerySnapshot, float_path: str) -> 'QuantizedSnapshot':
+        """保留keep中的行并追加extra（float叠加层），精确特征分块复制到float_path"""
+        rows = np.flatnonzero(keep)
+        total = len(rows) + len(extra)
+        if not total:
+            return GallerySnapshot([], np.empty((0, FEATURE_DIM), dtype=np.float32))
+        output = np.lib.format.open_memmap(float_path, mode='w+', dtype=np.float32, shape=(total, FEATURE_DIM))
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            output[start:start + len(chunk)] = self.features[chunk]
+        output[len(rows):] = extra.features
+        output.flush()
+        del output
+
+        extra_codes, extra_scales = quantize_features(extra.features)
+        return QuantizedSnapshot(
+            [self.ids[i] for i in rows] + extra.ids,
+            np.vstack([self.codes[rows], extra_codes]),
+            np.concatenate([self.scales[rows], extra_scales]),
+            np.concatenate([self.sq_norms[rows], extra.sq_norms.astype(np.float32)]),
+            float_path,
+            self.rerank_candidates
+        )
+
+
+class OverlayStore:
+    """叠加层的追加写存储，同一基础快照上的各代视图共享
+
+    行只追加、不修改；删除或更新只在旧行上记下失效的日志序号。视图按自己的行数和序号读取，
+    之后的写入不会改变旧视图看到的内容，因此录入不需要复制叠加层；容量不足时复制到两倍大小的新存储
+    """
+
+    def __init__(self, capacity: int = 16):
+        self.features = np.empty((capacity, FEATURE_DIM), dtype=np.float32)
+        self.sq_norms = np.empty(capacity, dtype=np.float32)
+        self.dead_seq = np.full(capacity, ALIVE, dtype=np.int64)
+        self.ids: List[str] = []
+        # user_id -> 最新的行号（只由持有写锁的一方使用）
+        self.rows: Dict[str, int] = {}
+
+    @property
+    def capacity(self) -> int:
+        return len(self.features)
+
+    @property
+    def nbytes(self) -> int:
+        return self.features.nbytes + self.sq_norms.nbytes + self.dead_seq.nbytes + sum(len(i) for i in self.ids) * 2
+
+    def grown(self) -> 'OverlayStore':
+        """复制到两倍容量的新存储；引用旧存储的视图不受影响"""
+        count = len(self.ids)
+        store = OverlayStore(self.capacity * 2)
+        store.features[:count] = self.features[:count]
+        store.sq_norms[:count] = self.sq_norms[:count]
+        store.dead_seq[:count] = self.dead_seq[:count]
+        store.ids = list(self.ids)
+        store.rows = dict(self.rows)
+        return store
+
+
+class GalleryView:
+    """基础快照 + 增量日志叠加层在某个日志序号上的一致视图
+
+    同一基础快照上的各代视图共享叠加层存储和基础行的失效序号，每个视图只看到序号不超过自己的变更；
+    apply()返回包含新记录的下一代视图，旧视图内容不变，检索持有引用即可得到一致数据
+    """
+
+    def __init__(self, base: GallerySnapshot, seq: int, base_dead: Optional[np.ndarray] = None,
+                 store: Optional[OverlayStore] = None, count: int = 0, size: Optional[int] = None,
+                 masked: int = 0, changes: int = 0):
+        self.base = base
+        self.seq = seq              # 视图包含的最后一条日志序号
+        # 基础快照各行被删除/更新时的日志序号，第一次屏蔽基础行时才分配
+        self.base_dead = base_dead
+        self.store = store if store is not None else OverlayStore()
+        self.count = count          # 视图可见的叠加层行数
+        self.size = len(base) if size is None else size
+        self.masked = masked        # 视图中被屏蔽的基础行数
+        self.changes = changes      # 基础快照之后应用的日志记录数
+
+    @classmethod
+    def replay(cls, base: GallerySnapshot, base_seq: int, records: List[tuple]) -> 'GalleryView':
+        """在基础快照上依次应用日志记录"""
+        view = cls(base, base_seq)
+        for seq, user_id, feature in records:
+            view = view.apply(seq, user_id, feature)
+        return view
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.base.nbytes + self.store.nbytes + (self.base_dead.nbytes if self.base_dead is not None else 0)
+
+    def apply(self, seq: int, user_id: str, feature: Optional[np.ndarray]) -> 'GalleryView':
+        """应用一条录入/删除记录，返回下一代视图（调用方持有写锁，只能在最新视图上调用）"""
+        store = self.store
+        if self.count != len(store.ids):
+            raise RuntimeError("只能在最新视图上应用日志记录")
+
+        existed = self.contains(user_id)
+        base_dead, masked = self.base_dead, self.masked
+        row = store.rows.get(user_id)
+        if row is not None:
+            # 用户已在叠加层中（其基础行在第一次变更时已屏蔽）
+            if store.dead_seq[row] == ALIVE:
+                store.dead_seq[row] = seq
+        elif user_id in self.base.index:
+            if base_dead is None:
+                base_dead = np.full(len(self.base), ALIVE, dtype=np.int64)
+            base_dead[self.base.index[user_id]] = seq
+            masked += 1
+
+        count = self.count
+        if feature is not None:
+            # 先记失效序号再扩容，新存储复制到的是最新状态
+            if count == store.capacity:
+                store = store.grown()
+            store.features[count] = feature
+            store.sq_norms[count] = feature @ feature
+            store.ids.append(user_id)
+            store.rows[user_id] = count
+            count += 1
+
+        size = self.size + (feature is not None) - existed
+        return GalleryView(self.base, seq, base_dead, store, count, size, masked, self.changes + 1)
+
+    def _masked_rows(self) -> Optional[np.ndarray]:
+        if not self.masked:
+            return None
+        return np.flatnonzero(self.base_dead <= self.seq)
+
+    def _overlay_alive(self) -> np.ndarray:
+        return self.store.dead_seq[:self.count] > self.seq
+
+    def _alive(self) -> tuple:
+        """(基础快照中保留的行掩码, 叠加层中存活的行号)"""
+        keep = np.ones(len(self.base), dtype=bool)
+        masked_rows = self._masked_rows()
+        if masked_rows is not None:
+            keep[masked_rows] = False
+        return keep, np.flatnonzero(self._overlay_alive())
+
+    def materialize(self) -> GallerySnapshot:
+        """把叠加层折叠进基础快照，得到视图的完整内容"""
+        if isinstance(self.base, QuantizedSnapshot):
+            keep, rows = self._alive()
+            overlay = GallerySnapshot([self.store.ids[i] for i in rows], self.store.features[rows],
+                                      self.store.sq_norms[rows])
+            # 量化快照不把全部精确特征读入内存，直接写新的精确特征文件
+            return self.base.select(keep, overlay, new_float_path(self.base.float_path.rsplit('.', 3)[0]))
+        return GallerySnapshot(*self.export())
+
+    def export(self) -> tuple:
+        """视图的完整内容(user_id列表, float特征)；量化快照的特征从精确特征文件读出"""
+        keep, rows = self._alive()
+        ids = [user_id for user_id, kept in zip(self.base.ids, keep) if kept] + [self.store.ids[i] for i in rows]
+        features = np.vstack([np.asarray(self.base.features[keep], dtype=np.float32), self.store.features[rows]])
+        return ids, features
+
+    def contains(self, user_id: str) -> bool:
+        """用户在最新视图中是否存在（调用方持有写锁）"""
+        row = self.store.rows.get(user_id)
+        if row is not None:
+            return self.store.dead_seq[row] > self.seq
+        row = self.base.index.get(user_id)
+        if row is None:
+            return False
+        return self.base_dead is None or self.base_dead[row] > self.seq
+
+    def search(self, query: np.ndarray, top_k: int) -> List[tuple]:
+        """分别检索基础快照和叠加层，合并结果"""
+        results = self.base.search(query, top_k, self._masked_rows()) + self._search_overlay(query, top_k)
+        results.sort(key=lambda item: item[1])
+        return results[:top_k]
+
+    def _search_overlay(self, query: np.ndarray, top_k: int) -> List[tuple]:
+        if not self.count:
+            return []
+        alive = self._overlay_alive()
+        available = int(np.count_nonzero(alive))
+        if not available:
+            return []
+
+        query = query.astype(np.float32)
+        features = self.store.features[:self.count]
+        sq_dist = self.store.sq_norms[:self.count] + float(query @ query) - 2.0 * (features @ query)
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        sq_dist[~alive] = np.inf
+        return _nearest(sq_dist, self.store.ids, top_k, available)
+
+
+def validate_snapshot(snapshot: GallerySnapshot, sample_queries: int = 8, epsilon: float = 1e-2) -> int:
+    """用样本查询校验新建的快照：ID唯一、特征有限、抽样行能检索回自身，返回校验的样本数"""
+    if len(snapshot.features) != len(snapshot.ids):
+        raise ValueError(f"重建校验失败: 特征数 {len(snapshot.features)} 与ID数 {len(snapshot.ids)} 不一致")
+    if len(snapshot.index) != len(snapshot):
+        raise ValueError("重建校验失败: 存在重复的user_id")
+    if not np.isfinite(snapshot.features).all():
+        raise ValueError("重建校验失败: 特征包含NaN或Inf")
+    if not len(snapshot) or sample_queries <= 0:
+        return 0
+
+    # 均匀抽样，覆盖矩阵首尾，能发现ID与特征行错位
+    rows = np.unique(np.linspace(0, len(snapshot) - 1, min(sample_queries, len(snapshot))).astype(np.int64))
+    for row in rows:
+        expected = snapshot.ids[row]
+        results = snapshot.search(snapshot.features[row], min(4, len(snapshot)))
+        if not any(user_id == expected and distance <= epsilon for user_id, distance in results):
+            raise ValueError(f"重建校验失败: 样本 {expected} 未能检索回自身")
+    return len(rows)
+
+
+def read_base_file(path: str, quantize: bool = False,
+                   rerank_candidates: int = DEFAULT_RERANK_CANDIDATES) -> tuple:
+    """读取基础矩阵文件，返回(快照, 已合并的日志序号)
+
+    量化格式的文件（codes/scales/sq_norms + 精确特征文件）在quantize为True时返回QuantizedSnapshot，
+    否则读入精确特征返回普通快照；float格式的文件总是返回普通快照
+    """
+    if not os.path.exists(path):
+        return GallerySnapshot([], np.empty((0, FEATURE_DIM), dtype=np.float32)), 0
+
+    with np.load(path, allow_pickle=False) as data:
+        ids = [str(i) for i in data['ids']]
+        base_seq = int(data['seq']) if 'seq' in data.files else 0
+        if 'codes' not in data.files:
+            return GallerySnapshot(ids, data['features']), base_seq
+
+        float_path = os.path.join(os.path.dirname(path), str(data['float_file']))
+        if quantize:
+            return QuantizedSnapshot(ids, data['codes'], data['scales'], data['sq_norms'], float_path,
+                                     rerank_candidates), base_seq
+    return GallerySnapshot(ids, np.load(float_path) if ids else np.empty((0, FEATURE_DIM))), base_seq
+
+
+def read_engine(meta_path: str) -> Optional[str]:
+    """读取特征库元数据中的特征引擎"""
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('engine')
+
+
+def write_engine(meta_path: str, engine: str):
+    os.makedirs(os.path.dirname(meta_path) or '.', exist_ok=True)
+    temp_path = meta_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({"engine": engine}, f)
+    os.replace(temp_path, meta_path)
+
+
+def format_log_record(seq: int, user_id: str, feature: Optional[np.ndarray]) -> str:
+    """录入/删除记录 -> 一行JSON日志"""
+    record = {"seq": seq, "op": "enroll" if feature is not None else "delete", "user_id": user_id}
+    if feature is not None:
+        record["feature"] = base64.b64encode(feature.tobytes()).decode('utf-8')
+    return json.dumps(record) + '\n'
+
+
+def read_log_records(log_path: str, after_seq: int, offset: int = 0) -> tuple:
+    """从offset开始读取序号大于after_seq的完整日志行，返回(记录列表, 新的offset)"""
+    records = []
+    if not os.path.exists(log_path):
+        return records, 0
+
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            # 进程崩溃或其他进程正在写入时最后一行可能不完整，留到下次读取
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("跳过损坏的日志行: %s", log_path)
+                continue
+            if record['seq'] <= after_seq:
+                continue
+            feature = decode_feature(record['feature']) if record['op'] == 'enroll' else None
+            records.append((record['seq'], record['user_id'], feature))
+    return records, offset
+
+
+class TenantGallery:
+    """单个租户的特征库：基础特征矩阵(.npz) + 追加写的录入/删除日志(.log)
+
+    录入和删除只追加一行日志并更新叠加层，耗时与特征库大小无关；
+    后台合并把日志折叠进新的基础矩阵，完成后原子替换视图，检索始终看到一致的数据
+
+    多个worker进程可以各自加载同一租户：录入/删除持有文件锁(.lock)，先读取日志尾部追上其他进程的写入再分配序号；
+    合并/重建持有合并锁(.compact.lock)，同一时刻只有一个进程改写基础矩阵和日志。
+    检索前比较日志文件的inode和大小，有变化时读取尾部，日志被其他进程的合并改写时重新加载
+    """
+
+    def __init__(self, tenant_id: str, path: str, fsync: bool = False, quantize: bool = False,
+                 rerank_candidates: int = DEFAULT_RERANK_CANDIDATES):
+        self.tenant_id = tenant_id
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + '.log'
+        self.meta_path = os.path.splitext(path)[0] + '.meta.json'
+        self.lock_path = os.path.splitext(path)[0] + '.lock'
+        self.compact_lock_path = os.path.splitext(path)[0] + '.compact.lock'
+        self.fsync = fsync
+        # 基础矩阵以int8量化码保存在内存中，精确特征按需从磁盘映射
+        self.quantize = quantize
+        self.rerank_candidates = rerank_candidates
+        # 特征引擎，空特征库由第一次录入确定
+        self.engine: Optional[str] = None
+        self.view = GalleryView(GallerySnapshot([], np.empty((0, FEATURE_DIM), dtype=np.float32)), 0)
+        self.compacting = False
+        self.last_compaction = time.time()
+        # 合并/重建替换基础矩阵后的回调，参数为替换事件
+        self.swap_listener: Optional[Callable[[Dict], None]] = None
+
+        # 尚未合并进基础矩阵的日志记录：(seq, user_id, feature或None)
+        self._records = []
+        self._write_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        # 已读取到的日志位置；日志文件保持打开，其inode在本进程读完之前不会被重新分配
+        self._log_offset = 0
+        self._log_file = None
+        self._log_state = None
+
+    @classmethod
+    def load(cls, tenant_id: str, path: str, fsync: bool = False, quantize: bool = False,
+             rerank_candidates: int = DEFAULT_RERANK_CANDIDATES) -> 'TenantGallery':
+        """加载基础矩阵并重放其后的日志（文件不存在时为空库）"""
+        gallery = cls(tenant_id, path, fsync, quantize, rerank_candidates)
+        with FileLock(gallery.lock_path):
+            gallery._reload_locked()
+        return gallery
+
+    @property
+    def nbytes(self) -> int:
+        return self.view.nbytes
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._records)
+
+    def close(self):
+        """不再使用该租户（被淘汰或进程退出）；持有视图的检索仍可继续"""
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def refresh(self):
+        """其他进程追加或改写了日志时追上；日志未变化时只有一次stat"""
+        if self._log_identity() == self._log_state:
+            return
+
+        with self._write_lock, FileLock(self.lock_path):
+            self._catch_up_locked()
+
+    def check_engine(self, engine: str):
+        """录入/检索的特征必须与特征库来自同一引擎"""
+        # 其他进程的重建可能切换了引擎，先追上最新状态
+        self.refresh()
+        self._verify_engine(engine)
+
+    def _verify_engine(self, engine: str):
+        """比较引擎标签，不追日志、不加锁：录入时调用方持有写锁且已追上最新状态"""
+        if self.engine is None and len(self.view):
+            self.engine = self._read_engine()
+        if self.engine is not None and engine != self.engine:
+            raise ValueError(f"特征引擎不一致: 特征库为 {self.engine}, 请求为 {engine}")
+
+    def search(self, query: np.ndarray, top_k: int) -> List[tuple]:
+        self.refresh()
+        view = self.view
+        # 检索期间钉住基础快照，替换视图后等这些检索结束再退役旧快照
+        view.base.pin()
+        try:
+            return view.search(query, top_k)
+        finally:
+            view.base.unpin()
+
+    def export(self) -> tuple:
+        """当前的全部(user_id列表, float特征)，读取期间钉住基础快照"""
+        self.refresh()
+        view = self.view
+        view.base.pin()
+        try:
+            return view.export()
+        finally:
+            view.base.unpin()
+
+    def enroll(self, user_id: str, feature: np.ndarray, engine: str = DEFAULT_ENGINE):
+        """录入或更新用户特征（追加日志）"""
+        with self._write_lock, FileLock(self.lock_path):
+            self._catch_up_locked()
+            self._claim_engine(engine)
+            self._append_locked(user_id, feature)
+
+    def delete(self, user_id: str) -> bool:
+        """删除用户特征（追加日志）"""
+        with self._write_lock, FileLock(self.lock_path):
+            self._catch_up_locked()
+            if not self.view.contains(user_id):
+                return False
+            self._append_locked(user_id, None)
+            return True
+
+    def compact(self) -> bool:
+        """把日志折叠进新的基础矩阵；进行中的检索继续使用旧视图
+        只有拿到合并锁的进程执行合并，其他进程通过日志被改写看到结果
+        """
+        compact_lock = FileLock(self.compact_lock_path, blocking=False)
+        if not compact_lock.acquire():
+            return False
+
+        try:
+            with self._compact_lock:
+                self.refresh()
+                view = self.view
+                if not view.changes:
+                    return False
+
+                self.compacting = True
+                try:
+                    start_time = time.time()
+                    base = view.materialize()
+                    self._swap_base(base, view.seq, 'compact', start_time, merged_records=view.changes)
+                    return True
+                finally:
+                    self.compacting = False
+        finally:
+            compact_lock.release()
+
+    def rebuild(self, ids: List[str], features: np.ndarray, sample_queries: int = 8,
+                engine: str = DEFAULT_ENGINE) -> Dict:
+        """在旁路构建新的基础矩阵，样本查询校验通过后原子替换（批量导入、重新提取特征后使用）
+
+        构建和校验期间检索继续使用旧视图，校验失败时旧视图保持不变；
+        开始重建之后写入的日志保留下来，叠加到新的基础矩阵上。
+        重建可以切换特征引擎，此时构建期间写入的旧引擎日志被丢弃。
+        重建与其他进程的合并互斥，等待合并锁
+        """
+        with FileLock(self.compact_lock_path), self._compact_lock:
+            self.compacting = True
+            try:
+                start_time = time.time()
+                self.refresh()
+                seq = self.view.seq
+                base = GallerySnapshot(ids, features)
+                validated = validate_snapshot(base, sample_queries)
+                return self._swap_base(base, seq, 'rebuild', start_time, engine, validated_queries=validated)
+            finally:
+                self.compacting = False
+
+    def _swap_base(self, base: GallerySnapshot, seq: int, kind: str, start_time: float,
+                   engine: Optional[str] = None, **details) -> Dict:
+        """持久化新的基础矩阵并原子切换视图，等待旧快照上的检索结束后返回替换事件"""
+        engine = engine or self.engine or DEFAULT_ENGINE
+        base = self._write_base(base, seq)
+        old_base = self._install_base(base, seq, engine)
+        swapped_at = time.time()
+        self.last_compaction = swapped_at
+
+        # 旧快照不再被新检索引用，进行中的检索结束后由引用计数释放
+        drain_ms = self._wait_drained(old_base)
+        self._remove_float_file(old_base, base)
+        event = dict(details,
+                     tenant_id=self.tenant_id,
+                     kind=kind,
+                     success=True,
+                     engine=engine,
+                     size=len(base),
+                     replaced_size=len(old_base),
+                     build_ms=(swapped_at - start_time) * 1000,
+                     drain_ms=drain_ms,
+                     swapped_at=datetime.fromtimestamp(swapped_at).isoformat())
+        logger.info("租户 %s 特征库%s完成: %s 条, 构建 %.1fms, 等待旧快照检索结束 %.1fms",
+                    self.tenant_id, '合并' if kind == 'compact' else '重建', len(base), event['build_ms'], drain_ms)
+
+        if self.swap_listener is not None:
+            self.swap_listener(event)
+        return event
+
+    def _install_base(self, base: GallerySnapshot, seq: int, engine: str) -> GallerySnapshot:
+        """保留seq之后的日志并切换到新视图，返回被替换的基础快照"""
+        with self._write_lock, FileLock(self.lock_path):
+            old_view = self.view
+            # 构建期间新写入的日志（含其他进程写入的）保留下来，叠加到新的基础矩阵上；
+            # 引擎变化时这些日志来自旧引擎，丢弃
+            if self._switch_engine(engine):
+                remaining = []
+            else:
+                self._sync_log_locked()
+                remaining = [record for record in self._records if record[0] > seq]
+            self._rewrite_log(remaining)
+            self._records = remaining
+            # 与其他进程重新加载得到的视图一致：基础矩阵的序号 + 保留的日志
+            self.view = GalleryView.replay(base, seq, remaining)
+            self._track_log_locked(os.path.getsize(self.log_path))
+            return old_view.base
+
+    def _read_engine(self) -> Optional[str]:
+        """元数据中没有引擎标签的非空特征库是加标签之前创建的，均为默认引擎"""
+        engine = read_engine(self.meta_path)
+        if engine is None and len(self.view):
+            engine = DEFAULT_ENGINE
+        return engine
+
+    def _claim_engine(self, engine: str):
+        """空特征库由第一次录入确定引擎（调用方持有写锁）"""
+        if self.engine is None:
+            self.engine = self._read_engine()
+        if self.engine is None:
+            write_engine(self.meta_path, engine)
+            self.engine = engine
+        # _write_lock不可重入，这里不能调用会再次加锁的check_engine/refresh
+        self._verify_engine(engine)
+
+    def _switch_engine(self, engine: str) -> bool:
+        """重建后的特征库使用engine，返回引擎是否发生变化（调用方持有写锁）"""
+        previous = self.engine if self.engine is not None else self._read_engine()
+        if engine != read_engine(self.meta_path):
+            write_engine(self.meta_path, engine)
+        self.engine = engine
+        return previous is not None and previous != engine
+
+    @staticmethod
+    def _wait_drained(base: GallerySnapshot, timeout: float = 5.0) -> float:
+        """等待旧快照上的检索结束，返回等待时间(ms)"""
+        start_time = time.time()
+        while base.inflight > 0 and time.time() - start_time < timeout:
+            time.sleep(0.001)
+        if base.inflight > 0:
+            logger.warning("旧快照仍有 %s 个检索未结束，放弃等待", base.inflight)
+        return (time.time() - start_time) * 1000
+
+    def _reload_locked(self):
+        """重新读取基础矩阵并重放其后的全部日志（持有文件锁）"""
+        base, base_seq = read_base_file(self.path, self.quantize, self.rerank_candidates)
+        if self.quantize and len(base) and not isinstance(base, QuantizedSnapshot):
+            # 启用量化前保存的float基础矩阵，转换为量化格式
+            base = self._write_base(base, base_seq)
+        # 日志不存在时创建空文件，之后其他进程的追加和改写都能通过inode和大小发现
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        open(self.log_path, 'a', encoding='utf-8').close()
+
+        self._records, offset = read_log_records(self.log_path, base_seq)
+        self.view = GalleryView.replay(base, base_seq, self._records)
+        self._track_log_locked(offset)
+        # 其他进程的重建可能切换了特征引擎
+        self.engine = self._read_engine()
+
+    def _catch_up_locked(self):
+        """追上其他进程的写入：日志被改写则重新加载，否则读取日志尾部（持有文件锁）"""
+        identity = self._log_identity()
+        if identity == self._log_state:
+            return
+        if identity is None or self._log_state is None or identity[:2] != self._log_state[:2]:
+            self._reload_locked()
+        else:
+            self._sync_log_locked()
+
+    def _sync_log_locked(self):
+        """读取日志尾部的新记录并逐条应用到视图（持有文件锁）"""
+        records, self._log_offset = read_log_records(self.log_path, self.view.seq, self._log_offset)
+        self._log_state = self._log_identity()
+        if not records:
+            return
+
+        view = self.view
+        for seq, user_id, feature in records:
+            view = view.apply(seq, user_id, feature)
+        self._records.extend(records)
+        self.view = view
+
+    def _append_locked(self, user_id: str, feature: Optional[np.ndarray]):
+        """追加一条日志记录并应用到视图（持有文件锁，已追上其他进程的写入）"""
+        seq = self.view.seq + 1
+        if feature is not None:
+            feature = np.asarray(feature, dtype=np.float32).reshape(FEATURE_DIM)
+        self._write_log_record(seq, user_id, feature)
+
+        self._records.append((seq, user_id, feature))
+        self.view = self.view.apply(seq, user_id, feature)
+        self._log_offset = os.path.getsize(self.log_path)
+        self._log_state = self._log_identity()
+
+    def _write_log_record(self, seq: int, user_id: str, feature: Optional[np.ndarray]):
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(format_log_record(seq, user_id, feature))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _log_identity(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_size
+
+    def _track_log_locked(self, offset: int):
+        """记录已读到的日志文件和位置（持有文件锁）"""
+        if self._log_file is not None:
+            self._log_file.close()
+        self._log_file = open(self.log_path, 'rb')
+        self._log_offset = offset
+        self._log_state = self._log_identity()
+
+    def _write_base(self, base: GallerySnapshot, seq: int) -> GallerySnapshot:
+        """写入临时文件后原子替换基础矩阵，返回要安装的快照（启用量化时为QuantizedSnapshot）"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # 临时文件按进程区分：多个worker加载时可能同时转换量化格式
+        temp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        ids = np.array(base.ids, dtype=str)
+
+        if self.quantize and len(base):
+            if not isinstance(base, QuantizedSnapshot):
+                base = QuantizedSnapshot.from_features(base.ids, base.features,
+                                                       new_float_path(os.path.splitext(self.path)[0]),
+                                                       self.rerank_candidates)
+            # 精确特征文件先于基础矩阵写好，基础矩阵替换后引用的文件一定完整
+            np.savez(temp_path, ids=ids, codes=base.codes, scales=base.scales, sq_norms=base.sq_norms,
+                     float_file=os.path.basename(base.float_path), seq=np.int64(seq))
+        else:
+            np.savez(temp_path, ids=ids, features=base.features, seq=np.int64(seq))
+        os.replace(temp_path, self.path)
+        return base
+
+    @staticmethod
+    def _remove_float_file(old_base: GallerySnapshot, base: GallerySnapshot):
+        """删除已退役量化快照的精确特征文件（Windows下仍被映射时删除失败，留待下次）"""
+        if not isinstance(old_base, QuantizedSnapshot) or old_base.float_path == getattr(base, 'float_path', None):
+            return
+        try:
+            os.remove(old_base.float_path)
+        except OSError as e:
+            logger.debug("删除旧的精确特征文件失败: %s", e)
+
+    def _rewrite_log(self, records: List[tuple]):
+        """只保留尚未合并的日志记录"""
+        temp_path = self.log_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for seq, user_id, feature in records:
+                f.write(format_log_record(seq, user_id, feature))
+        os.replace(temp_path, self.log_path)
+
+
+class GalleryManager:
+    """租户特征库管理器：懒加载 + 内存预算内的LRU淘汰"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.directory = config.get('directory', 'galleries')
+        self.max_memory = parse_size(config.get('max_memory', '1GB'))
+        self.default_top_k = int(config.get('top_k', 5))
+        self.match_tolerance = float(config.get('match_tolerance', 0.6))
+        self.fsync = bool(config.get('fsync', False))
+        self.compact_threshold = int(config.get('compact_threshold', 1000))
+        self.compact_interval = float(config.get('compact_interval', 60))
+        # 多worker共享：基础矩阵放在共享内存，通过代数计数感知其他worker的更新
+        self.shared_memory = bool(config.get('shared_memory', False))
+        self.rebuild_sample_queries = int(config.get('rebuild_sample_queries', 8))
+        # int8量化存储：共享内存模式下节点内已只有一份float矩阵，不再量化
+        self.quantize = bool(config.get('quantize', False))
+        self.rerank_candidates = int(config.get('rerank_candidates', DEFAULT_RERANK_CANDIDATES))
+        if self.quantize and self.shared_memory:
+            logger.warning("gallery.shared_memory已启用，忽略gallery.quantize")
+            self.quantize = False
+
+        self._galleries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._compact_event = threading.Event()
+        self._compactor = None
+        self._rebuilding = set()
+        # 最近的基础矩阵替换事件（合并/重建），用于健康检查
+        self.swap_events = collections.deque(maxlen=20)
+        self.stats = {"loads": 0, "evictions": 0, "compactions": 0, "rebuilds": 0, "rebuild_failures": 0}
+        # 进程退出时释放各租户（共享内存模式下最后一个worker删除共享段）；fork出的子进程不执行
+        self._pid = os.getpid()
+        atexit.register(self.close)
+
+    def get(self, tenant_id: str) -> TenantGallery:
+        """获取租户特征库，未加载时从磁盘加载"""
+        validate_tenant_id(tenant_id)
+
+        with self._lock:
+            gallery = self._galleries.get(tenant_id)
+            if gallery is not None:
+                self._galleries.move_to_end(tenant_id)
+                return gallery
+
+            start_time = time.time()
+            path = os.path.join(self.directory, f"{tenant_id}.npz")
+            if self.shared_memory:
+                from gallery_shm import SharedTenantGallery
+                gallery = SharedTenantGallery.load(tenant_id, path, self.fsync)
+            else:
+                gallery = TenantGallery.load(tenant_id, path, self.fsync, self.quantize, self.rerank_candidates)
+            gallery.swap_listener = self._record_swap
+            self._galleries[tenant_id] = gallery
+            self.stats["loads"] += 1
+            logger.info("加载租户特征库 %s: %s 条（待合并日志 %s 条）, 耗时 %.1fms",
+                        tenant_id, len(gallery.view), gallery.pending_count, (time.time() - start_time) * 1000)
+
+            self._ensure_compactor()
+
+            self._evict(keep=tenant_id)
+            return gallery
+
+    def search(self, tenant_id: str, query: np.ndarray, top_k: Optional[int] = None,
+               tolerance: Optional[float] = None, engine: str = DEFAULT_ENGINE) -> Dict:
+        """在租户分片内检索"""
+        top_k = self.default_top_k if top_k is None else max(1, int(top_k))
+        tolerance = self.match_tolerance if tolerance is None else float(tolerance)
+
+        gallery = self.get(tenant_id)
+        gallery.check_engine(engine)
+        candidates = gallery.search(query, top_k)
+        matches = [
+            {"user_id": user_id, "distance": distance, "match": distance <= tolerance}
+            for user_id, distance in candidates
+        ]
+        return {
+            "matches": matches,
+            "best_match": matches[0] if matches and matches[0]["match"] else None,
+            "gallery_size": len(gallery.view),
+            "tolerance": tolerance,
+            "engine": engine
+        }
+
+    def enroll(self, tenant_id: str, user_id: str, feature: np.ndarray, engine: str = DEFAULT_ENGINE):
+        gallery = self.get(tenant_id)
+        gallery.enroll(user_id, feature, engine)
+        if gallery.pending_count >= self.compact_threshold:
+            self._compact_event.set()
+        with self._lock:
+            self._evict(keep=tenant_id)
+
+    def delete(self, tenant_id: str, user_id: str) -> bool:
+        gallery = self.get(tenant_id)
+        deleted = gallery.delete(user_id)
+        if gallery.pending_count >= self.compact_threshold:
+            self._compact_event.set()
+        return deleted
+
+    def export(self, tenant_id: str) -> tuple:
+        """导出租户的全部(user_id列表, float特征)"""
+        return self.get(tenant_id).export()
+
+    def compact(self, tenant_id: str) -> bool:
+        """立即合并指定租户的日志"""
+        return self.get(tenant_id).compact()
+
+    def rebuild(self, tenant_id: str, ids: List[str], features: np.ndarray, wait: bool = False,
+                engine: str = DEFAULT_ENGINE) -> Optional[Dict]:
+        """用新的特征集合重建租户特征库，默认在后台线程执行；wait为True时同步执行并返回替换事件"""
+        gallery = self.get(tenant_id)
+        with self._lock:
+            if tenant_id in self._rebuilding:
+                raise ValueError(f"租户 {tenant_id} 正在重建")
+            self._rebuilding.add(tenant_id)
+
+        if wait:
+            return self._run_rebuild(gallery, ids, features, engine, raise_errors=True)
+
+        threading.Thread(target=self._run_rebuild, args=(gallery, ids, features, engine),
+                         name=f'gallery-rebuild-{tenant_id}', daemon=True).start()
+        return None
+
+    def close(self):
+        """释放全部已加载的租户"""
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            galleries = list(self._galleries.values())
+            self._galleries.clear()
+        for gallery in galleries:
+            try:
+                gallery.close()
+            except Exception as e:
+                logger.warning("释放租户特征库 %s 失败: %s", gallery.tenant_id, e)
+
+    def memory_usage(self) -> int:
+        return sum(g.nbytes for g in self._galleries.values())
+
+    def get_status(self) -> Dict:
+        """返回管理器状态，用于健康检查"""
+        with self._lock:
+            return dict(self.stats,
+                        loaded_tenants=len(self._galleries),
+                        pending_records=sum(g.pending_count for g in self._galleries.values()),
+                        memory_usage=self.memory_usage(),
+                        max_memory=self.max_memory,
+                        shared_memory=self.shared_memory,
+                        quantize=self.quantize,
+                        rebuilding=sorted(self._rebuilding),
+                        swap_events=list(self.swap_events))
+
+    def _run_rebuild(self, gallery: TenantGallery, ids: List[str], features: np.ndarray, engine: str,
+                     raise_errors: bool = False) -> Optional[Dict]:
+        try:
+            return gallery.rebuild(ids, features, self.rebuild_sample_queries, engine)
+        except Exception as e:
+            self.stats["rebuild_failures"] += 1
+            self.swap_events.append({
+                "tenant_id": gallery.tenant_id,
+                "kind": "rebuild",
+                "success": False,
+                "message": str(e),
+                "failed_at": datetime.now().isoformat()
+            })
+            logger.error("租户 %s 特征库重建失败，继续使用旧版本: %s", gallery.tenant_id, e)
+            if raise_errors:
+                raise
+            return None
+        finally:
+            with self._lock:
+                self._rebuilding.discard(gallery.tenant_id)
+
+    def _record_swap(self, event: Dict):
+        """记录基础矩阵替换事件（由租户特征库回调）"""
+        self.swap_events.append(event)
+        self.stats["compactions" if event["kind"] == "compact" else "rebuilds"] += 1
+
+    def _evict(self, keep: str):
+        """超出内存预算时淘汰最久未使用的租户（调用方持有锁）"""
+        while self.memory_usage() > self.max_memory:
+            # 正在合并/重建的租户不淘汰，避免同一租户出现两个实例同时改写日志
+            candidates = [tenant_id for tenant_id, gallery in self._galleries.items()
+                          if tenant_id != keep and not gallery.compacting and tenant_id not in self._rebuilding]
+            if not candidates:
+                break
+            self._galleries.pop(candidates[0]).close()
+            self.stats["evictions"] += 1
+            logger.info("淘汰租户特征库 %s", candidates[0])
+
+    def _ensure_compactor(self):
+        """启动后台合并线程（调用方持有锁）"""
+        if self._compactor is None:
+            self._compactor = threading.Thread(target=self._compact_loop, name='gallery-compactor', daemon=True)
+            self._compactor.start()
+
+    def _compact_loop(self):
+        """日志条数达到阈值或距上次合并超过间隔时合并"""
+        while True:
+            self._compact_event.wait(self.compact_interval)
+            self._compact_event.clear()
+
+            with self._lock:
+                galleries = list(self._galleries.values())
+
+            now = time.time()
+            for gallery in galleries:
+                due = gallery.pending_count >= self.compact_threshold or \
+                    (gallery.pending_count > 0 and now - gallery.last_compaction >= self.compact_interval)
+                if not due:
+                    continue
+                try:
+                    gallery.compact()
+                except Exception as e:
+                    logger.error("租户 %s 特征库合并失败: %s", gallery.tenant_id, e)
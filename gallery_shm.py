@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+特征库跨进程共享 - 同一节点的多个gunicorn worker共用一份特征矩阵
+每个租户有一个代数计数段（基础矩阵代数 + 最新日志序号），基础矩阵按代数发布为独立的共享内存段；
+worker发现代数变化时重新映射新段，发现日志序号变化时只读取日志尾部，
+旧段由发布者unlink，已映射的进程可继续使用到检索结束；
+计数段中记录映射该租户的进程PID，最后一个进程淘汰该租户或退出时删除当前代数的段和计数段
+
+仅支持Linux（依赖fcntl文件锁和POSIX共享内存）
+"""
+
+import logging
+import os
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+import numpy as np
+
+from gallery import (FEATURE_DIM, FileLock, GallerySnapshot, GalleryView, TenantGallery, fcntl, read_base_file,
+                     read_log_records)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'face_gallery'
+
+# 代数计数段：基础矩阵代数、最新日志序号，之后是映射该租户的进程PID表
+_COUNTER_FIELDS = 2
+_MAX_ATTACHED = 256
+_COUNTER_BYTES = (_COUNTER_FIELDS + _MAX_ATTACHED) * 8
+
+# 基础矩阵段头部：条数、ID字节宽度、已合并的日志序号、保留
+_HEADER_FIELDS = 4
+_HEADER_BYTES = _HEADER_FIELDS * 8
+
+
+def _segment_name(tenant_id: str, suffix) -> str:
+    return f"{SEGMENT_PREFIX}_{tenant_id}_{suffix}"
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """不让resource_tracker在worker退出时unlink共享段，段的生命周期由代数计数管理"""
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class GenerationCounter:
+    """租户的代数计数段：[基础矩阵代数, 最新日志序号, 映射该租户的进程PID...]（调用方持有文件锁）"""
+
+    def __init__(self, tenant_id: str):
+        name = _segment_name(tenant_id, 'gen')
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=_COUNTER_BYTES)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            if self._shm.size < _COUNTER_BYTES:
+                # 旧版本留下的计数段（没有PID表），重新创建，基础矩阵随后从磁盘重新发布
+                logger.warning("租户 %s 的共享计数段格式过旧，重新创建", tenant_id)
+                self._shm.close()
+                self._shm.unlink()
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=_COUNTER_BYTES)
+        _untrack(self._shm)
+        self._values = np.ndarray((_COUNTER_FIELDS,), dtype=np.int64, buffer=self._shm.buf)
+        self._pids = np.ndarray((_MAX_ATTACHED,), dtype=np.int64, buffer=self._shm.buf,
+                                offset=_COUNTER_FIELDS * 8)
+
+    @property
+    def base_generation(self) -> int:
+        return int(self._values[0])
+
+    @property
+    def log_seq(self) -> int:
+        return int(self._values[1])
+
+    def set_base_generation(self, generation: int):
+        self._values[0] = generation
+
+    def set_log_seq(self, seq: int):
+        self._values[1] = seq
+
+    def attach(self, pid: int):
+        """登记映射该租户的进程；已退出（被杀死）的进程留下的记录在此时清理"""
+        self._prune()
+        if (self._pids == pid).any():
+            return
+        free = np.flatnonzero(self._pids == 0)
+        if not len(free):
+            logger.warning("映射同一租户的进程超过 %s 个，进程 %s 未登记", _MAX_ATTACHED, pid)
+            return
+        self._pids[free[0]] = pid
+
+    def detach(self, pid: int) -> bool:
+        """注销进程，返回是否已没有进程映射该租户"""
+        self._pids[self._pids == pid] = 0
+        self._prune()
+        return not self._pids.any()
+
+    def unlink(self):
+        _unlink_segment(self._shm.name)
+
+    def _prune(self):
+        for i in np.flatnonzero(self._pids):
+            if not _pid_alive(int(self._pids[i])):
+                self._pids[i] = 0
+
+
+def publish_snapshot(tenant_id: str, generation: int, snapshot: GallerySnapshot, base_seq: int):
+    """把快照写入新的共享内存段"""
+    count = len(snapshot)
+    encoded_ids = np.array([user_id.encode('utf-8') for user_id in snapshot.ids], dtype=bytes)
+    id_width = max(1, encoded_ids.dtype.itemsize if count else 1)
+
+    size = _HEADER_BYTES + count * FEATURE_DIM * 4 + count * 4 + count * id_width
+    name = _segment_name(tenant_id, generation)
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    except FileExistsError:
+        # 计数段重新创建后代数从1开始，同名的段是进程被杀死时遗留的
+        unlink_snapshot(tenant_id, generation)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    _untrack(shm)
+    try:
+        header, features, sq_norms, ids = _segment_arrays(shm, count, id_width)
+        header[:] = (count, id_width, base_seq, 0)
+        features[:] = snapshot.features
+        sq_norms[:] = snapshot.sq_norms
+        if count:
+            ids[:] = encoded_ids.astype(f'S{id_width}')
+        del header, features, sq_norms, ids
+    finally:
+        shm.close()
+
+
+def attach_snapshot(tenant_id: str, generation: int) -> tuple:
+    """映射指定代数的共享段，返回(快照, 已合并的日志序号)，特征数据不做拷贝"""
+    shm = shared_memory.SharedMemory(name=_segment_name(tenant_id, generation))
+    _untrack(shm)
+
+    count, id_width, base_seq, _ = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+    _, features, sq_norms, ids = _segment_arrays(shm, int(count), int(id_width))
+    snapshot = GallerySnapshot([i.decode('utf-8') for i in ids], features, sq_norms, owner=shm)
+    return snapshot, int(base_seq)
+
+
+def unlink_snapshot(tenant_id: str, generation: int):
+    """删除旧代数的段名；已映射的进程不受影响"""
+    _unlink_segment(_segment_name(tenant_id, generation))
+
+
+def _unlink_segment(name: str):
+    try:
+        # 映射时注册到resource_tracker，unlink时会自动注销，这里不需要_untrack
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _segment_arrays(shm: shared_memory.SharedMemory, count: int, id_width: int) -> tuple:
+    offset = _HEADER_BYTES
+    header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+    features = np.ndarray((count, FEATURE_DIM), dtype=np.float32, buffer=shm.buf, offset=offset)
+    offset += count * FEATURE_DIM * 4
+    sq_norms = np.ndarray((count,), dtype=np.float32, buffer=shm.buf, offset=offset)
+    offset += count * 4
+    ids = np.ndarray((count,), dtype=f'S{id_width}', buffer=shm.buf, offset=offset)
+    return header, features, sq_norms, ids
+
+
+class SharedTenantGallery(TenantGallery):
+    """共享内存版租户特征库
+
+    - 基础矩阵：共享内存段，节点内只有一份
+    - 录入/删除：持文件锁追加日志并递增共享的日志序号，其他worker检索前读取日志尾部
+    - 合并：同一时刻只有一个worker执行，发布新代数的段后递增代数计数
+    """
+
+    def __init__(self, tenant_id: str, path: str, fsync: bool = False):
+        if fcntl is None:
+            raise RuntimeError("共享内存特征库需要Linux环境")
+        super().__init__(tenant_id, path, fsync)
+        # 在文件锁内打开，避免映射到最后一个进程正在删除的计数段
+        self.counter: Optional[GenerationCounter] = None
+        self.generation = 0
+        self._closed = False
+
+    @classmethod
+    def load(cls, tenant_id: str, path: str, fsync: bool = False) -> 'SharedTenantGallery':
+        gallery = cls(tenant_id, path, fsync)
+        with FileLock(gallery.lock_path):
+            gallery.counter = GenerationCounter(tenant_id)
+            gallery.counter.attach(os.getpid())
+            if gallery.counter.base_generation == 0:
+                # 本节点第一个使用该租户的worker：从磁盘读取并发布第1代
+                base, base_seq = read_base_file(path)
+                records, _ = read_log_records(gallery.log_path, base_seq)
+                publish_snapshot(tenant_id, 1, base, base_seq)
+                gallery.counter.set_log_seq(records[-1][0] if records else base_seq)
+                gallery.counter.set_base_generation(1)
+                logger.info("发布租户 %s 共享特征库: %s 条", tenant_id, len(base))
+            gallery._remap_locked(gallery.counter.base_generation)
+        return gallery
+
+    def close(self):
+        """本进程不再使用该租户（淘汰或退出）：注销PID，最后一个进程删除当前代数的段和计数段
+        本进程中仍持有旧视图的检索继续使用已映射的内存
+        """
+        if self._closed or self.counter is None:
+            return
+        self._closed = True
+        super().close()
+        with FileLock(self.lock_path):
+            if self.counter.detach(os.getpid()):
+                unlink_snapshot(self.tenant_id, self.counter.base_generation)
+                self.counter.unlink()
+                logger.info("租户 %s 已没有worker使用，删除共享内存段", self.tenant_id)
+
+    def refresh(self):
+        """检查代数计数：基础矩阵换代则重新映射，日志有新记录则读取尾部"""
+        if self.counter.base_generation == self.generation and self.counter.log_seq <= self.view.seq:
+            return
+
+        with self._write_lock, FileLock(self.lock_path):
+            self._catch_up_locked()
+
+    def _install_base(self, base: GallerySnapshot, seq: int, engine: str) -> GallerySnapshot:
+        """发布新代数的段并递增代数计数，旧段名随后删除（已映射的进程不受影响）"""
+        with self._write_lock, FileLock(self.lock_path):
+            old_base = self.view.base
+            old_generation = self.counter.base_generation
+            new_generation = old_generation + 1
+
+            if self._switch_engine(engine):
+                # 引擎变化：丢弃旧引擎的日志，新段从最新日志序号开始，避免其他worker反复读取日志尾部
+                seq = max(seq, self.counter.log_seq)
+                remaining = []
+            else:
+                remaining, _ = read_log_records(self.log_path, seq)
+            publish_snapshot(self.tenant_id, new_generation, base, seq)
+            self._rewrite_log(remaining)
+            self.counter.set_base_generation(new_generation)
+            self._remap_locked(new_generation)
+
+        unlink_snapshot(self.tenant_id, old_generation)
+        logger.info("租户 %s 共享特征库切换到第%s代", self.tenant_id, new_generation)
+        return old_base
+
+    def _remap_locked(self, generation: int):
+        """映射新代数的基础矩阵并重放其后的全部日志（持有文件锁）"""
+        base, base_seq = attach_snapshot(self.tenant_id, generation)
+        self._records, self._log_offset = read_log_records(self.log_path, base_seq)
+        self.view = GalleryView.replay(base, base_seq, self._records)
+        self.generation = generation
+        # 其他worker的重建可能切换了特征引擎
+        self.engine = self._read_engine()
+
+    def _catch_up_locked(self):
+        """追上其他worker的写入：基础矩阵换代则重新映射，否则读取日志尾部（持有文件锁）"""
+        if self.counter.base_generation != self.generation:
+            self._remap_locked(self.counter.base_generation)
+        else:
+            self._sync_log_locked()
+
+    def _append_locked(self, user_id: str, feature: Optional[np.ndarray]):
+        """以共享日志序号追加记录，再同步本进程视图（持有文件锁）"""
+        if self.counter.base_generation != self.generation:
+            self._remap_locked(self.counter.base_generation)
+
+        seq = self.counter.log_seq + 1
+        if feature is not None:
+            feature = np.asarray(feature, dtype=np.float32).reshape(FEATURE_DIM)
+
+        self._write_log_record(seq, user_id, feature)
+        self.counter.set_log_seq(seq)
+        self._sync_log_locked()
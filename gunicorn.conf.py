@@ -0,0 +1,26 @@
+"""
+gunicorn配置 - 给每个worker分配固定序号，供线程预算划分CPU核心
+gunicorn -c gunicorn.conf.py --workers 4 face_service:app
+
+不要开启preload_app：BLAS线程数要在worker进程导入numpy之前设置
+"""
+
+import os
+
+from thread_budget import WORKER_COUNT_ENV, WORKER_INDEX_ENV, WORKER_THREADS_ENV
+
+bind = "0.0.0.0:8081"
+timeout = 30
+
+
+def pre_fork(server, worker):
+    """在master中为新worker选择空闲序号（重启的worker沿用退出worker的序号）"""
+    used = {getattr(w, 'slot', None) for w in server.WORKERS.values()}
+    worker.slot = min(i for i in range(server.cfg.workers + len(used) + 1) if i not in used)
+
+
+def post_fork(server, worker):
+    """worker进程内、加载应用之前执行"""
+    os.environ[WORKER_INDEX_ENV] = str(worker.slot)
+    os.environ[WORKER_COUNT_ENV] = str(server.cfg.workers)
+    os.environ[WORKER_THREADS_ENV] = str(server.cfg.threads)
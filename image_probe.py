@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+图像头部探测 - 解码前只读取文件头（格式、尺寸、颜色模式），拦截解压炸弹和不支持的图像
+PIL的Image.open是惰性的：只解析文件头，不解码像素，几十字节就能知道解码后的大小。
+超过像素预算的JPEG可按1/2、1/4、1/8缩小解码（libjpeg的DCT缩放，解码过程中就不产生整幅图像），
+其他格式缩小解码仍要先解出整幅图像，直接拒绝
+"""
+
+import io
+import math
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import cv2
+from PIL import Image
+
+# 可转换为8位RGB的颜色模式；16位灰度、32位整数/浮点图像转换时会截断，默认拒绝
+DEFAULT_MODES = ('1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr')
+OVER_BUDGET_ACTIONS = ('reduce', 'reject')
+# 支持缩小解码的格式（MPO为多张JPEG组成）
+REDUCIBLE_FORMATS = ('JPEG', 'MPO')
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class ImageRejected(ValueError):
+    """图像在解码前被拒绝（格式无法识别、颜色模式不支持、超过像素预算）"""
+
+
+class ImageInfo(NamedTuple):
+    format: Optional[str]
+    width: int
+    height: int
+    mode: str
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+def probe_image(image_data: bytes) -> ImageInfo:
+    """只读取文件头，返回格式、尺寸、颜色模式；无法识别时抛出ImageRejected"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            return ImageInfo(image.format, image.width, image.height, image.mode)
+    except Image.DecompressionBombError as e:
+        # PIL自身的上限（默认约1.8亿像素），超过时连文件头都不返回尺寸
+        raise ImageRejected(f"图像像素数超过上限: {e}")
+    except (OSError, SyntaxError, ValueError) as e:
+        raise ImageRejected(f"无法识别的图像格式: {e}")
+
+
+class ImagePolicy:
+    """face_extraction.image_limits：像素预算和允许的颜色模式"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.max_pixels = int(config.get('max_pixels', 16000000))
+        self.over_budget = config.get('over_budget', 'reduce')
+        if self.over_budget not in OVER_BUDGET_ACTIONS:
+            raise ValueError(f"image_limits.over_budget必须是{'/'.join(OVER_BUDGET_ACTIONS)}之一")
+        self.allowed_modes = frozenset(config.get('allowed_modes', DEFAULT_MODES))
+
+    def check(self, image_data: bytes, max_pixels: Optional[int] = None,
+              allow_reduce: bool = True) -> Tuple[ImageInfo, int]:
+        """探测文件头并按策略检查，返回(图像信息, 缩小倍数)；倍数为1表示按原尺寸解码
+
+        max_pixels覆盖配置的预算（0为不限制）；不通过时抛出ImageRejected
+        """
+        info = probe_image(image_data)
+        if info.mode not in self.allowed_modes:
+            raise ImageRejected(f"不支持的图像颜色模式: {info.mode}（{info.format}）")
+
+        budget = self.max_pixels if max_pixels is None else max_pixels
+        if not budget or info.pixels <= budget:
+            return info, 1
+
+        if allow_reduce and self.over_budget == 'reduce' and info.format in REDUCIBLE_FORMATS:
+            for factor in (2, 4, 8):
+                if math.ceil(info.width / factor) * math.ceil(info.height / factor) <= budget:
+                    return info, factor
+
+        raise ImageRejected(f"图像像素数超过上限: {info.width}x{info.height}（{info.pixels}像素，上限{budget}）")
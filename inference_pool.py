@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+推理进程池 - 把检测和编码放到独立进程中执行，绕开GIL
+HTTP线程把图像直接解码到预分配的共享内存环形缓冲区（multiprocessing.shared_memory），
+只把槽位号和数组形状发给工作进程，图像数组不经过pickle；
+工作进程处理max_tasks_per_child个任务后由新进程替换，限制内存增长
+
+InferencePool提供与SimpleFaceExtractor相同的extract_*_from_bytes/base64方法，
+服务按配置选择其一；图像超过槽位大小或解码失败时在本进程用原提取器处理
+"""
+
+import atexit
+import base64
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+import inference_worker
+from config_loader import parse_size
+from image_probe import REDUCED_COLOR_FLAGS
+from inference_worker import POOL_THREADS_ENV
+from memory_trace import current_rss
+
+logger = logging.getLogger(__name__)
+
+# 与SimpleFaceExtractor._load_image_array一致：更小的图像由原提取器放大处理
+MIN_SIDE = 80
+
+
+class ImageRing:
+    """共享内存环形缓冲区：slots个固定大小的槽位，空闲槽位号放在队列中"""
+
+    def __init__(self, slots: int, slot_size: int):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+
+    def acquire(self, timeout: Optional[float]) -> Optional[int]:
+        try:
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int):
+        self._free.put(slot)
+
+    def free_count(self) -> int:
+        return self._free.qsize()
+
+    def array(self, slot: int, shape: tuple) -> Optional[np.ndarray]:
+        """槽位上的uint8数组视图；超过槽位大小时返回None"""
+        if int(np.prod(shape)) > self.slot_size:
+            return None
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_size)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有数组视图引用（进程退出时），只删除段名
+            pass
+        self.shm.unlink()
+
+
+class InferencePool:
+    """推理进程池（首次使用时启动）"""
+
+    def __init__(self, config: Optional[Dict], extractor):
+        config = config or {}
+        self.enabled = bool(config.get('enabled', False))
+        self.processes = max(1, int(config.get('processes', 2)))
+        self.slots = max(self.processes, int(config.get('slots', self.processes * 2)))
+        self.slot_size = parse_size(config.get('slot_size', '32MB'))
+        self.max_tasks_per_child = int(config.get('max_tasks_per_child', 500)) or None
+        self.threads_per_process = max(1, int(config.get('threads_per_process', 1)))
+        self.task_timeout = float(config.get('task_timeout', 30))
+
+        # 本进程内的提取器：负责槽位放不下或解码失败的图像，保证结果格式一致
+        self.extractor = extractor
+
+        self._pool = None
+        self._ring = None
+        self._lock = threading.Lock()
+        # 统计和计数由各HTTP线程及进程池结果线程同时更新
+        self._stats_lock = threading.Lock()
+        self._inflight = 0
+        # 已超时但仍在工作进程中执行的任务数（其槽位在任务结束时才归还）
+        self._abandoned = 0
+        # 工作进程启动时经队列报告pid
+        self._pid_queue = None
+        self._worker_pids = set()
+        self.stats = {
+            "tasks": 0,
+            "inline": 0,
+            "busy": 0,
+            "timeouts": 0,
+            "errors": 0
+        }
+
+    def extract_feature_from_bytes(self, image_data: bytes, deadline=None) -> Dict:
+        return self._run('extract_feature_from_array', self._decode_bytes, image_data, (), deadline,
+                         lambda: self.extractor.extract_feature_from_bytes(image_data, deadline))
+
+    def extract_faces_from_bytes(self, image_data: bytes, max_faces: Optional[int] = None, deadline=None) -> Dict:
+        return self._run('extract_faces_from_array', self._decode_bytes, image_data, (max_faces,), deadline,
+                         lambda: self.extractor.extract_faces_from_bytes(image_data, max_faces, deadline))
+
+    def extract_feature_from_base64(self, base64_image: str, deadline=None) -> Dict:
+        return self._run('extract_normalized_feature_from_array', self._decode_base64, base64_image, (), deadline,
+                         lambda: self.extractor.extract_feature_from_base64(base64_image, deadline))
+
+    def extract_faces_from_base64(self, base64_image: str, max_faces: Optional[int] = None, deadline=None) -> Dict:
+        return self._run('extract_faces_from_array', self._decode_base64_bytes, base64_image, (max_faces,), deadline,
+                         lambda: self.extractor.extract_faces_from_base64(base64_image, max_faces, deadline))
+
+    def get_status(self) -> Dict:
+        """返回进程池状态，用于健康检查"""
+        with self._stats_lock:
+            status = dict(self.stats, inflight=self._inflight, abandoned=self._abandoned)
+        status.update(enabled=self.enabled,
+                      started=self._pool is not None,
+                      processes=self.processes,
+                      slots=self.slots,
+                      slot_size=self.slot_size,
+                      max_tasks_per_child=self.max_tasks_per_child)
+        if self._ring is not None:
+            status["free_slots"] = self._ring.free_count()
+        return status
+
+    def load(self) -> Dict:
+        """当前负载（就绪检查用）：进行中的任务数、累计繁忙拒绝数、超时未结束的任务数、空闲槽位数"""
+        with self._stats_lock:
+            load = {
+                "enabled": self.enabled,
+                "inflight": self._inflight,
+                "busy": self.stats["busy"],
+                "abandoned": self._abandoned
+            }
+        ring = self._ring
+        if ring is not None:
+            load["free_slots"] = ring.free_count()
+        return load
+
+    def worker_memory(self) -> List[Dict]:
+        """各工作进程的pid和当前RSS（进程池未启动时为空）
+        pid由工作进程启动时报告；有/proc的平台上已退出（按max_tasks_per_child替换）的进程被剔除"""
+        with self._lock:
+            if self._pid_queue is None:
+                return []
+            while True:
+                try:
+                    self._worker_pids.add(self._pid_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            workers = []
+            for pid in sorted(self._worker_pids):
+                rss = current_rss(pid)
+                if rss is None and os.path.isdir('/proc'):
+                    self._worker_pids.discard(pid)
+                    continue
+                workers.append({"pid": pid, "rss_bytes": rss})
+            return workers
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+            if self._pid_queue is not None:
+                self._pid_queue.close()
+                self._pid_queue = None
+                self._worker_pids.clear()
+
+    def _ensure_started(self):
+        """首次使用时创建共享内存和工作进程（spawn方式，避免fork多线程进程）"""
+        if self._pool is not None:
+            return
+
+        with self._lock:
+            if self._pool is not None:
+                return
+            # 工作进程导入numpy之前读取，由inference_worker设置BLAS线程数
+            os.environ[POOL_THREADS_ENV] = str(self.threads_per_process)
+            self._ring = ImageRing(self.slots, self.slot_size)
+            context = multiprocessing.get_context('spawn')
+            self._pid_queue = context.Queue()
+            self._pool = context.Pool(self.processes, initializer=inference_worker.init_worker,
+                                      initargs=(self._ring.shm.name, self.slot_size, self._pid_queue),
+                                      maxtasksperchild=self.max_tasks_per_child)
+            atexit.register(self.close)
+            logger.info("推理进程池已启动: %s 个进程, %s 个槽位 x %s 字节", self.processes, self.slots,
+                        self.slot_size)
+
+    def _run(self, method: str, decode: Callable, payload, args: tuple, deadline,
+             inline: Callable[[], Dict]) -> Dict:
+        start_time = time.time()
+        if deadline is not None and deadline.expired():
+            # 原提取器入口即检查截止时间，返回对应格式的结果
+            return inline()
+
+        self._ensure_started()
+        wait = self.task_timeout if deadline is None else max(0.0, min(self.task_timeout,
+                                                                       deadline.remaining_ms() / 1000.0))
+        slot = self._ring.acquire(timeout=wait)
+        if slot is None:
+            self._count("busy")
+            return self._failure(start_time, "推理进程池繁忙，没有空闲的图像槽位", busy=True)
+
+        try:
+            image_array = decode(payload, lambda shape: self._ring.array(slot, shape))
+        except Exception as e:
+            logger.debug("图像解码到共享内存失败，由本进程处理: %s", e)
+            image_array = None
+        if image_array is None:
+            self._ring.release(slot)
+            self._count("inline")
+            return inline()
+
+        # 槽位只在任务结束时（结果回调中）归还：超时的任务仍可能在工作进程中读取槽位，
+        # 提前归还会让下一个请求覆盖正在处理的图像
+        task = {"finished": False, "abandoned": False}
+
+        def finished(_=None):
+            with self._stats_lock:
+                task["finished"] = True
+                if task["abandoned"]:
+                    self._abandoned -= 1
+            self._ring.release(slot)
+
+        with self._stats_lock:
+            self.stats["tasks"] += 1
+            self._inflight += 1
+        try:
+            try:
+                async_result = self._pool.apply_async(
+                    inference_worker.run_task, (slot, image_array.shape, method, args, deadline, start_time),
+                    callback=finished, error_callback=finished)
+            except Exception:
+                # 任务未提交（进程池已关闭），不会有回调
+                finished()
+                raise
+            return async_result.get(timeout=self.task_timeout)
+        except multiprocessing.TimeoutError:
+            with self._stats_lock:
+                self.stats["timeouts"] += 1
+                if not task["finished"]:
+                    task["abandoned"] = True
+                    self._abandoned += 1
+            logger.warning("推理任务超时（%ss），槽位 %s 在任务结束后归还", self.task_timeout, slot)
+            return self._failure(start_time, f"推理超时（{self.task_timeout}s）")
+        except Exception as e:
+            self._count("errors")
+            logger.error("推理进程任务失败: %s", e)
+            return self._failure(start_time, f"特征提取失败: {str(e)}")
+        finally:
+            with self._stats_lock:
+                self._inflight -= 1
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _failure(start_time: float, message: str, **extra) -> Dict:
+        return dict({
+            "success": False,
+            "feature_code": "",
+            "quality": 0.0,
+            "process_time": (time.time() - start_time) * 1000,
+            "message": message
+        }, **extra)
+
+    def _decode_bytes(self, image_data: bytes, allocate: Callable) -> Optional[np.ndarray]:
+        """OpenCV解码后颜色转换直接写入槽位；其他情况（需要PIL或放大的图像）返回None交给本进程处理
+        文件头检查不通过时抛出ImageRejected，由本进程的提取器返回拒绝结果"""
+        _, reduce = self.extractor.image_policy.check(image_data)
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), REDUCED_COLOR_FLAGS[reduce])
+        if image is None or min(image.shape[:2]) < MIN_SIDE:
+            return None
+        target = allocate(image.shape)
+        if target is None:
+            return None
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=target)
+        return target
+
+    def _decode_base64(self, base64_image: str, allocate: Callable) -> Optional[np.ndarray]:
+        """与SimpleFaceExtractor.extract_feature_from_base64相同的PIL解码，结果拷入槽位"""
+        image_array = self.extractor._load_base64_image_array(base64_image)
+        target = allocate(image_array.shape)
+        if target is None:
+            return None
+        target[...] = image_array
+        return target
+
+    def _decode_base64_bytes(self, base64_image: str, allocate: Callable) -> Optional[np.ndarray]:
+        return self._decode_bytes(base64.b64decode(base64_image), allocate)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+推理进程池的工作进程入口
+模块顶部在导入numpy之前按POOL_THREADS_ENV设置BLAS线程数（spawn启动的子进程重新导入numpy，
+环境变量才能生效）；图像从父进程创建的共享内存槽中直接读取，不经过pickle
+"""
+
+import os
+
+from thread_budget import BLAS_ENV_VARS
+
+POOL_THREADS_ENV = 'FACE_SERVICE_POOL_THREADS'
+
+_threads = os.environ.get(POOL_THREADS_ENV, '1')
+for _name in BLAS_ENV_VARS:
+    os.environ[_name] = _threads
+
+import numpy as np
+from multiprocessing import shared_memory, util
+
+# 工作进程的全局状态（由initializer设置）
+_extractor = None
+_shm = None
+_slot_size = 0
+
+
+def init_worker(shm_name: str, slot_size: int, pid_queue=None):
+    """映射共享内存、加载模型（每个工作进程只执行一次），并向父进程报告pid"""
+    global _extractor, _shm, _slot_size
+    if pid_queue is not None:
+        pid_queue.put(os.getpid())
+    import cv2
+    cv2.setNumThreads(int(_threads))
+
+    # spawn启动的子进程与父进程共用resource_tracker，映射时的重复登记不影响父进程删除共享内存
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _slot_size = slot_size
+
+    from face_extractor import SimpleFaceExtractor
+    _extractor = SimpleFaceExtractor()
+    # 槽位在任务返回后会被父进程复用，异步保存的调试图像必须先拷贝
+    _extractor.debug_writer.copy_images = True
+
+    # 工作进程按max_tasks_per_child退出时不执行atexit，在这里刷新后台写入队列
+    util.Finalize(None, _extractor.debug_writer.flush, exitpriority=10)
+    util.Finalize(None, _extractor.chip_archive.flush, exitpriority=10)
+
+
+def run_task(slot: int, shape: tuple, method: str, args: tuple, deadline, start_time: float) -> dict:
+    """在槽位中的图像上调用SimpleFaceExtractor的*_from_array方法"""
+    image_array = np.ndarray(shape, dtype=np.uint8, buffer=_shm.buf, offset=slot * _slot_size)
+    return getattr(_extractor, method)(image_array, *args, deadline=deadline, start_time=start_time)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+日志配置 - 基于队列的异步日志
+请求线程只把日志记录放入有界队列，格式化和文件写入由后台监听线程完成；
+高频的请求日志可以按采样率记录
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Dict, Optional
+
+from config_loader import parse_size
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 每个请求都会产生的高频日志使用该logger，受采样率控制
+REQUEST_LOGGER_NAME = 'face_service.requests'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+# shutdown_logging只向atexit登记一次（重复调用setup_logging时不重复登记）
+_atexit_registered = False
+
+
+class SamplingFilter(logging.Filter):
+    """按采样率保留低于WARNING级别的日志，警告和错误全部保留"""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1.0:
+            return True
+        return random.random() < self.sample_rate
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """不在调用线程格式化消息的QueueHandler，队列满时丢弃并计数"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 同进程内的队列无需序列化，消息格式化留给监听线程；
+        # 异常信息需要在当前线程渲染，否则traceback可能已失效
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(config: Optional[Dict] = None) -> logging.Logger:
+    """根据config.json的logging节配置根logger，返回请求日志logger"""
+    global _listener, _atexit_registered
+
+    shutdown_logging()
+
+    config = config or {}
+    level = getattr(logging, str(config.get('level', 'INFO')).upper(), logging.INFO)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    log_file = config.get('file')
+    if log_file:
+        log_dir = os.path.dirname(log_file)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=parse_size(config.get('max_file_size', '10MB')),
+            backupCount=int(config.get('backup_count', 5)),
+            encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if config.get('async', True):
+        log_queue = queue.Queue(maxsize=int(config.get('queue_size', 10000)))
+        root.addHandler(AsyncQueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        if not _atexit_registered:
+            atexit.register(shutdown_logging)
+            _atexit_registered = True
+    else:
+        for handler in handlers:
+            root.addHandler(handler)
+
+    request_logger = logging.getLogger(REQUEST_LOGGER_NAME)
+    for existing in [f for f in request_logger.filters if isinstance(f, SamplingFilter)]:
+        request_logger.removeFilter(existing)
+    request_logger.addFilter(SamplingFilter(float(config.get('request_sample_rate', 1.0))))
+    return request_logger
+
+
+def shutdown_logging():
+    """停止监听线程并写出队列中剩余的日志"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
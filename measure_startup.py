@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+冷启动耗时测量 - 比较onefile/onedir打包和源码运行的启动开销
+命令行提取器：计时到进程退出（--version会完成全部导入和模型加载）；
+HTTP服务：计时到--url返回200（/ready需要启动自检完成，/health只需要开始监听）
+
+--import-baseline额外测量当前Python环境中导入face_extractor的耗时，作为打包后冷启动的下限参考
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+# 源码环境下的导入基线：与提取器启动时的导入相同（face_recognition导入时加载dlib模型）
+IMPORT_BASELINE = "import face_extractor"
+
+
+def time_until_exit(command: List[str], timeout: float) -> float:
+    """运行命令直到退出，返回耗时（秒）"""
+    start_time = time.perf_counter()
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    elapsed = time.perf_counter() - start_time
+    if completed.returncode != 0:
+        raise RuntimeError(f"命令退出码 {completed.returncode}: {completed.stderr.decode(errors='replace')[-500:]}")
+    return elapsed
+
+
+def time_until_ready(command: List[str], url: str, timeout: float, interval: float = 0.05) -> float:
+    """启动服务并轮询url直到返回200，返回耗时（秒）；结束后终止服务进程"""
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start_time < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"服务进程提前退出，退出码 {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start_time
+            except (urllib.error.URLError, ConnectionError, OSError):
+                pass
+            time.sleep(interval)
+        raise RuntimeError(f"{timeout}s内{url}未返回200")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def summarize(samples: List[float]) -> Dict:
+    return {
+        "runs": len(samples),
+        "min_ms": min(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "samples_ms": [round(s * 1000, 1) for s in samples]
+    }
+
+
+def measure(command: List[str], runs: int, url: Optional[str], timeout: float) -> Dict:
+    samples = []
+    for run in range(runs):
+        samples.append(time_until_ready(command, url, timeout) if url else time_until_exit(command, timeout))
+        print(f"第{run + 1}次: {samples[-1] * 1000:.1f}ms", file=sys.stderr)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="测量可执行文件/服务的冷启动耗时",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  {sys.argv[0]} --runs 5 -- release/linux/face-extractor/face-extractor --version
+  {sys.argv[0]} --runs 5 -- release/linux/face-extractor --version
+  {sys.argv[0]} --runs 3 --url http://127.0.0.1:8081/ready -- release/linux/face_http_service/face_http_service
+  {sys.argv[0]} --runs 5 --import-baseline
+        """
+    )
+    parser.add_argument('--runs', type=int, default=5, help='测量次数（默认5）')
+    parser.add_argument('--url', help='服务模式：轮询该地址直到返回200')
+    parser.add_argument('--timeout', type=float, default=300, help='单次测量超时秒数（默认300）')
+    parser.add_argument('--import-baseline', action='store_true',
+                        help='同时测量当前Python环境导入face_extractor的耗时')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='要测量的命令（放在--之后）')
+
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command and not args.import_baseline:
+        parser.error("需要要测量的命令或--import-baseline")
+
+    report = {"success": True}
+    try:
+        if command:
+            report["command"] = " ".join(command)
+            report["startup"] = measure(command, args.runs, args.url, args.timeout)
+        if args.import_baseline:
+            source_dir = os.path.dirname(os.path.abspath(__file__))
+            report["import_baseline"] = measure([sys.executable, '-c', f"import sys; sys.path.insert(0, {source_dir!r}); "
+                                                 f"{IMPORT_BASELINE}"], args.runs, None, args.timeout)
+    except Exception as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+内存插桩 - 可选的tracemalloc追踪，定位大图上传时的整帧拷贝和worker内存增长
+memory.enabled为true时服务启动即开始追踪（分配会变慢，只用于排查和容量评估），记录：
+    - 每个提取请求的峰值追踪内存（相对请求开始时的增量）和请求前后的进程RSS
+    - 每个流水线阶段（decode/prescreen/detect/encode）的峰值
+/admin/memory返回这些统计、当前RSS和分配最多的代码位置
+未启用时stage()返回空上下文，提取路径上没有额外开销
+
+tracemalloc的峰值是进程级的：请求重叠时，峰值包含同时进行的其他请求的分配（记录中overlapped为true），
+需要精确数据时单并发压测。numpy数组（含OpenCV返回的数组）计入追踪，dlib内部的分配只体现在RSS中
+"""
+
+import collections
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+GROUP_BY = ('lineno', 'traceback', 'filename')
+
+# 不计入分配位置统计的内部帧
+_SITE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def current_rss(pid: Optional[int] = None) -> Optional[int]:
+    """进程当前RSS（字节），读取/proc/<pid>/statm；不支持的平台返回None"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """本进程RSS历史峰值（字节）"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class _Scope:
+    """一个请求或阶段：start为开始时的追踪内存，peak为存续期间观察到的最大追踪内存"""
+
+    __slots__ = ('name', 'start', 'peak', 'overlapped', 'stages')
+
+    def __init__(self, name: str, start: int):
+        self.name = name
+        self.start = start
+        self.peak = start
+        self.overlapped = False
+        self.stages: Dict[str, int] = {}
+
+    @property
+    def peak_bytes(self) -> int:
+        return max(0, self.peak - self.start)
+
+
+class MemoryTracker:
+    """请求/阶段峰值统计
+
+    tracemalloc只有一个全局峰值：每次打开或关闭作用域时读取峰值、分给所有进行中的作用域并重置，
+    因此每个作用域得到的是其存续期间的最大追踪内存，互相嵌套或重叠的作用域不会干扰
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.enabled = bool(config.get('enabled', False))
+        self.frames = max(1, int(config.get('frames', 1)))
+        self.top_sites = max(1, int(config.get('top_sites', 20)))
+
+        self.requests = collections.deque(maxlen=max(1, int(config.get('history', 200))))
+        # 阶段名 -> {"count", "max_peak_bytes", "total_peak_bytes"}
+        self.stages: Dict[str, Dict] = {}
+        self.max_rss = 0
+
+        self._lock = threading.Lock()
+        self._active = set()
+        self._active_requests = set()
+        self._local = threading.local()
+        self._baseline = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def _checkpoint(self) -> int:
+        """调用方持有锁：把上次重置以来的峰值计入所有进行中的作用域，重置峰值，返回当前追踪内存"""
+        current, peak = tracemalloc.get_traced_memory()
+        for scope in self._active:
+            if peak > scope.peak:
+                scope.peak = peak
+        tracemalloc.reset_peak()
+        return current
+
+    def _open(self, name: str, is_request: bool = False) -> _Scope:
+        with self._lock:
+            scope = _Scope(name, self._checkpoint())
+            self._active.add(scope)
+            if is_request:
+                if self._active_requests:
+                    scope.overlapped = True
+                    for other in self._active_requests:
+                        other.overlapped = True
+                self._active_requests.add(scope)
+        return scope
+
+    def _close(self, scope: _Scope):
+        with self._lock:
+            self._checkpoint()
+            self._active.discard(scope)
+            self._active_requests.discard(scope)
+
+    def request_started(self, path: str):
+        """在请求线程中调用，返回交给request_finished的令牌"""
+        scope = self._open(path, is_request=True)
+        self._local.request = scope
+        return scope, current_rss(), time.time()
+
+    def request_finished(self, token):
+        scope, rss_before, start_time = token
+        self._local.request = None
+        self._close(scope)
+        rss_after = current_rss()
+        record = {
+            "path": scope.name,
+            "peak_bytes": scope.peak_bytes,
+            "stages": scope.stages,
+            "overlapped": scope.overlapped,
+            "rss_before": rss_before,
+            "rss_after": rss_after,
+            "elapsed_ms": (time.time() - start_time) * 1000,
+            "finished_at": time.time()
+        }
+        with self._lock:
+            self.requests.append(record)
+            if rss_after and rss_after > self.max_rss:
+                self.max_rss = rss_after
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """统计一个流水线阶段的峰值；在请求线程中时同时记入该请求的stages"""
+        scope = self._open(name)
+        try:
+            yield
+        finally:
+            self._close(scope)
+            peak = scope.peak_bytes
+            request_scope = getattr(self._local, 'request', None)
+            if request_scope is not None:
+                request_scope.stages[name] = max(peak, request_scope.stages.get(name, 0))
+            with self._lock:
+                stats = self.stages.setdefault(name, {"count": 0, "max_peak_bytes": 0, "total_peak_bytes": 0})
+                stats["count"] += 1
+                stats["total_peak_bytes"] += peak
+                stats["max_peak_bytes"] = max(stats["max_peak_bytes"], peak)
+
+    def allocation_sites(self, limit: Optional[int] = None, group_by: str = 'lineno',
+                         diff: bool = False) -> List[Dict]:
+        """当前存活分配最多的代码位置；diff为True时与set_baseline()时的快照比较，按增长量排序"""
+        if group_by not in GROUP_BY:
+            raise ValueError(f"不支持的分组方式: {group_by}（可选 {', '.join(GROUP_BY)}）")
+        if diff and self._baseline is None:
+            raise ValueError("尚未设置基线快照")
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SITE_FILTERS)
+        if diff:
+            statistics = snapshot.compare_to(self._baseline, group_by)
+        else:
+            statistics = snapshot.statistics(group_by)
+
+        sites = []
+        for stat in statistics[:limit or self.top_sites]:
+            site = {
+                "size_bytes": stat.size,
+                "count": stat.count,
+                "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+            }
+            if diff:
+                site.update(size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+            sites.append(site)
+        return sites
+
+    def set_baseline(self):
+        """保存当前快照，之后allocation_sites(diff=True)显示相对它的增长"""
+        self._baseline = tracemalloc.take_snapshot().filter_traces(_SITE_FILTERS)
+
+    def get_status(self) -> Dict:
+        current = tracemalloc.get_traced_memory()[0]
+        rss = current_rss()
+        with self._lock:
+            requests = list(self.requests)
+            stages = {name: dict(stats, mean_peak_bytes=stats["total_peak_bytes"] / stats["count"])
+                      for name, stats in self.stages.items()}
+            if rss and rss > self.max_rss:
+                self.max_rss = rss
+        return {
+            "enabled": self.enabled,
+            "tracing": tracemalloc.is_tracing(),
+            "pid": os.getpid(),
+            "traced_bytes": current,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "rss_bytes": rss,
+            "max_rss_bytes": self.max_rss,
+            "peak_rss_bytes": peak_rss(),
+            "stages": stages,
+            "largest_requests": sorted(requests, key=lambda r: r["peak_bytes"], reverse=True)[:10],
+            "recent_requests": requests[-20:],
+            "has_baseline": self._baseline is not None
+        }
+
+
+# 服务进程安装的追踪器；未安装（含推理工作进程、命令行）时stage()为空操作
+_tracker: Optional[MemoryTracker] = None
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def install(config: Optional[Dict]) -> MemoryTracker:
+    """按配置创建追踪器，启用时开始tracemalloc追踪并让stage()生效"""
+    global _tracker
+    tracker = MemoryTracker(config)
+    if tracker.enabled:
+        tracker.start()
+        _tracker = tracker
+    return tracker
+
+
+def stage(name: str):
+    tracker = _tracker
+    if tracker is None:
+        return _NULL_CONTEXT
+    return tracker.stage(name)
+
+
+def traced_stage(name: str):
+    """方法装饰器：整个调用计为一个阶段"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+按需性能剖析 - 管理接口触发，对提取请求剖析N秒或N个请求
+剖析在后台进行：开始剖析的请求立即返回剖析ID，结果写入剖析目录，之后按ID取回
+（gunicorn sync worker同一时刻只处理一个请求，阻塞等待会占住worker直到被超时杀掉；
+结果放在文件中，取回请求落在其他worker上也能读到）
+两种方式：
+    sample   （默认）后台线程每interval_ms毫秒采样一次正在处理提取请求的线程的调用栈，
+             输出折叠栈（"a;b;c 次数"，可直接用flamegraph.pl/speedscope生成火焰图），
+             阻塞在dlib等C扩展中的时间也会计入调用它的Python函数
+    cprofile 每个提取请求在自己的线程里用cProfile剖析，结束后合并为pstats
+没有进行中的剖析时，请求钩子只检查一次ProfileManager.session是否为None，没有其他开销
+"""
+
+import cProfile
+import collections
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sample', 'cprofile')
+MAX_SECONDS = 300
+PROFILE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class ProfileSession:
+    """一次剖析：持续seconds秒，或在max_requests个提取请求完成后提前结束"""
+
+    def __init__(self, mode: str = 'sample', seconds: float = 10, max_requests: int = 0,
+                 interval_ms: float = 5):
+        if mode not in MODES:
+            raise ValueError(f"不支持的剖析方式: {mode}（可选 {', '.join(MODES)}）")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"seconds必须在0到{MAX_SECONDS}之间")
+        self.mode = mode
+        self.seconds = float(seconds)
+        self.max_requests = max(0, int(max_requests))
+        self.interval = max(1.0, float(interval_ms)) / 1000.0
+
+        self.id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.requests = 0
+        # cProfile一次只能有一个剖析器生效（Python 3.12起），冲突的请求不剖析
+        self.skipped = 0
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self.stats: Optional[pstats.Stats] = None
+
+        # 正在处理提取请求的线程id
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._sampler = None
+        if mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    def request_started(self):
+        """在请求线程中调用，返回交给request_finished的令牌"""
+        thread_id = threading.get_ident()
+        profile = None
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                profile = None
+                with self._lock:
+                    self.skipped += 1
+        with self._lock:
+            self._threads.add(thread_id)
+        return thread_id, profile
+
+    def request_finished(self, token, count: bool = True):
+        """count=False用于批量请求中的单项：剖析其处理线程，但只有整个请求计入请求数"""
+        thread_id, profile = token
+        if profile is not None:
+            profile.disable()
+        with self._lock:
+            self._threads.discard(thread_id)
+            if profile is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+            if not count:
+                return
+            self.requests += 1
+            if self.max_requests and self.requests >= self.max_requests:
+                self._done.set()
+
+    def wait(self):
+        """等待剖析结束（时间到或请求数达到上限）"""
+        self._done.wait(self.seconds)
+        self.stop()
+
+    def stop(self):
+        """立即结束剖析"""
+        self._done.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._done.wait(self.interval):
+            with self._lock:
+                threads = set(self._threads)
+            if not threads:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in threads or thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def summary(self) -> Dict:
+        return {
+            "profile_id": self.id,
+            "pid": os.getpid(),
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "max_requests": self.max_requests,
+            "elapsed_seconds": time.time() - self.started_at,
+            "requests": self.requests,
+            "skipped_requests": self.skipped,
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000
+        }
+
+    def collapsed(self) -> str:
+        """折叠栈文本（sample方式）"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def pstats_dump(self) -> bytes:
+        """pstats二进制（与cProfile -o输出相同，可用snakeviz、pstats.Stats加载）"""
+        if self.stats is None:
+            return marshal.dumps({})
+        return marshal.dumps(self.stats.stats)
+
+
+class ProfileManager:
+    """同一时刻最多一次剖析；请求钩子只读取session属性
+    剖析目录中每次剖析一个<ID>.json（状态和摘要），结束后sample方式另有<ID>.collapsed，cprofile方式另有<ID>.pstats"""
+
+    def __init__(self, directory: str = './logs/profiles'):
+        self.directory = os.path.abspath(directory)
+        self.session: Optional[ProfileSession] = None
+        self._lock = threading.Lock()
+
+    def start(self, **options) -> ProfileSession:
+        """开始剖析并立即返回会话，后台线程在结束后写出结果；已有剖析在进行时抛出RuntimeError"""
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("已有剖析正在进行")
+            session = ProfileSession(**options)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._write_summary(session.id, dict(session.summary(), status="running"))
+            except Exception:
+                session.stop()
+                raise
+            self.session = session
+        threading.Thread(target=self._finish, args=(session,), name='profile-session', daemon=True).start()
+        return session
+
+    def _finish(self, session: ProfileSession):
+        try:
+            session.wait()
+            if session.mode == 'sample':
+                self._write_file(self._path(session.id, '.collapsed'), session.collapsed().encode('utf-8'))
+            else:
+                self._write_file(self._path(session.id, '.pstats'), session.pstats_dump())
+            summary = dict(session.summary(), status="finished")
+            logger.info("剖析完成: %s", summary)
+        except Exception as e:
+            logger.exception("保存剖析结果失败: %s", e)
+            summary = dict(session.summary(), status="failed", message=str(e))
+        finally:
+            with self._lock:
+                self.session = None
+        try:
+            self._write_summary(session.id, summary)
+        except OSError as e:
+            logger.error("保存剖析摘要失败: %s", e)
+
+    def load(self, profile_id: str) -> Optional[Dict]:
+        """读取剖析摘要（status为running/finished/failed），不存在时返回None；ID格式无效时抛出ValueError"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            raise ValueError(f"无效的剖析ID: {profile_id}")
+        try:
+            with open(self._path(profile_id, '.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def collapsed(self, profile_id: str) -> str:
+        with open(self._path(profile_id, '.collapsed'), encoding='utf-8') as f:
+            return f.read()
+
+    def top_stacks(self, profile_id: str, limit: int = 50) -> List[Tuple[str, int]]:
+        """折叠栈按采样数从多到少（文件中已按此顺序写出）"""
+        stacks = []
+        for line in self.collapsed(profile_id).splitlines()[:limit]:
+            stack, _, count = line.rpartition(' ')
+            stacks.append((stack, int(count)))
+        return stacks
+
+    def pstats_path(self, profile_id: str) -> str:
+        return self._path(profile_id, '.pstats')
+
+    def pstats_text(self, profile_id: str, sort: str = 'cumulative', limit: int = 50) -> str:
+        with open(self.pstats_path(profile_id), 'rb') as f:
+            if not marshal.load(f):
+                return "没有剖析到请求\n"
+        output = io.StringIO()
+        pstats.Stats(self.pstats_path(profile_id), stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def _write_summary(self, profile_id: str, summary: Dict):
+        self._write_file(self._path(profile_id, '.json'), json.dumps(summary, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        """先写临时文件再替换，其他worker不会读到写了一半的文件"""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+就绪检查 - 告诉负载均衡器这个worker现在是否应该接收流量
+/health只说明进程还活着；/ready在以下情况返回503：
+    - 启动自检（对test-pictures/admin.jpg做一次完整提取）尚未完成或失败
+    - 排队的提取请求超过上限（同时处理的请求数超出处理能力的部分）
+    - 最近一段时间的提取耗时p95超过上限
+自检只在启动时运行一次，结果缓存，/ready本身不运行任何模型
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from config_loader import resolve_path
+from gallery import decode_feature
+from thread_budget import WORKER_THREADS_ENV
+
+logger = logging.getLogger(__name__)
+
+
+def request_capacity(config: Optional[Dict] = None, pool=None) -> int:
+    """本进程能同时处理的提取请求数
+    readiness.capacity大于0时直接使用；启用推理进程池时为池的进程数；
+    否则为本进程处理请求的线程数（gunicorn sync worker为1，gthread为--threads，非gunicorn启动为1）"""
+    configured = int((config or {}).get('capacity', 0))
+    if configured > 0:
+        return configured
+    if pool is not None and pool.enabled:
+        return pool.processes
+    return max(1, int(os.environ.get(WORKER_THREADS_ENV, 1)))
+
+
+class ReadinessMonitor:
+    """启动自检结果 + 进行中的请求数 + 最近耗时分布"""
+
+    def __init__(self, config: Optional[Dict] = None, capacity: int = 1):
+        config = config or {}
+        self.self_test_image = config.get('self_test_image', 'test-pictures/admin.jpg')
+        self.self_test_max_distance = float(config.get('self_test_max_distance', 0.2))
+        self.max_queue_depth = int(config.get('max_queue_depth', 8))
+        self.max_p95_ms = float(config.get('max_p95_ms', 0))
+        self.latency_window_seconds = float(config.get('latency_window_seconds', 60))
+        # 能同时处理的提取请求数，超出的部分视为排队
+        self.capacity = max(1, capacity)
+
+        self.self_test: Dict = {"status": "pending"}
+        self._inflight = 0
+        self._lock = threading.Lock()
+        # (完成时刻, 耗时ms)
+        self._latencies = collections.deque(maxlen=max(1, int(config.get('latency_window', 200))))
+
+    def start_self_test(self, extractor):
+        """后台线程运行启动自检，不阻塞服务启动"""
+        threading.Thread(target=self.run_self_test, args=(extractor,), name='readiness-self-test',
+                         daemon=True).start()
+
+    def run_self_test(self, extractor) -> Dict:
+        """对自检图像做一次完整提取；同目录下有<图像名>_dlib_features.npy时还检查特征与参考值的距离"""
+        self.self_test = {"status": "running"}
+        start_time = time.time()
+        result = {"status": "failed"}
+        try:
+            if not self.self_test_image:
+                result = {"status": "skipped", "message": "未配置自检图像"}
+                return result
+
+            image_path = resolve_path(self.self_test_image)
+            with open(image_path, 'rb') as f:
+                extracted = extractor.extract_feature_from_bytes(f.read())
+            result["message"] = extracted.get("message", "")
+            if not extracted.get("success"):
+                return result
+
+            reference_path = os.path.splitext(image_path)[0] + '_dlib_features.npy'
+            if os.path.exists(reference_path):
+                feature = decode_feature(extracted["feature_code"])
+                distance = float(np.linalg.norm(feature - np.load(reference_path).astype(np.float32)))
+                result["reference_distance"] = distance
+                if distance > self.self_test_max_distance:
+                    result["message"] = f"自检特征与参考特征距离{distance:.3f}超过{self.self_test_max_distance}"
+                    return result
+
+            result["status"] = "passed"
+            return result
+
+        except Exception as e:
+            result["message"] = f"自检异常: {e}"
+            return result
+
+        finally:
+            result["elapsed_ms"] = (time.time() - start_time) * 1000
+            result["finished_at"] = time.time()
+            self.self_test = result
+            log = logger.info if result["status"] != "failed" else logger.error
+            log("启动自检%s: %s（%.1fms）", result["status"], result.get("message", ""), result["elapsed_ms"])
+
+    def request_started(self):
+        with self._lock:
+            self._inflight += 1
+
+    def request_finished(self, elapsed_ms: float, record: bool = True):
+        with self._lock:
+            self._inflight -= 1
+            if record:
+                self._latencies.append((time.monotonic(), elapsed_ms))
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def queue_depth(self) -> int:
+        return max(0, self._inflight - self.capacity)
+
+    def recent_p95_ms(self) -> Optional[float]:
+        """最近latency_window_seconds秒内完成的提取请求耗时p95，没有样本时返回None"""
+        horizon = time.monotonic() - self.latency_window_seconds
+        with self._lock:
+            samples = [elapsed for finished, elapsed in self._latencies if finished >= horizon]
+        if not samples:
+            return None
+        return float(np.percentile(samples, 95))
+
+    def check(self) -> tuple:
+        """返回(是否就绪, 状态详情)"""
+        p95 = self.recent_p95_ms()
+        queue_depth = self.queue_depth()
+        reasons = []
+
+        status = self.self_test.get("status")
+        if status in ("pending", "running"):
+            reasons.append("启动自检未完成")
+        elif status == "failed":
+            reasons.append(f"启动自检失败: {self.self_test.get('message', '')}")
+        if self.max_queue_depth > 0 and queue_depth > self.max_queue_depth:
+            reasons.append(f"排队请求数{queue_depth}超过{self.max_queue_depth}")
+        if self.max_p95_ms > 0 and p95 is not None and p95 > self.max_p95_ms:
+            reasons.append(f"最近p95耗时{p95:.0f}ms超过{self.max_p95_ms:.0f}ms")
+
+        return not reasons, {
+            "models_loaded": status in ("passed", "skipped"),
+            "self_test": self.self_test,
+            "inflight": self._inflight,
+            "capacity": self.capacity,
+            "queue_depth": queue_depth,
+            "recent_p95_ms": p95,
+            "recent_samples": len(self._latencies),
+            "reasons": reasons
+        }
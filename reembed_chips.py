@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+人脸图重新编码 - 更换编码模型或参数后，只对存档的对齐人脸图运行编码器
+不再解码原图、检测人脸和定位关键点；每个进程处理一个存档块，块内按batch_size批量编码
+
+输出.npz：ids（chip_id）、features（新特征）、old_features（存档时返回给调用方的原特征）、
+normalized（原特征是否L2归一化，新特征按同样方式归一化）、engine（新引擎标识）
+
+特征库只保存user_id和特征，不保存chip_id：把输出放到特征库目录后，
+POST /api/gallery/<tenant_id>/rebuild（{"reembedded": "v2.npz"}）按原特征逐字节匹配已录入的特征，
+替换为对应人脸图的新特征（见match_reembedded）
+"""
+
+import argparse
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chip_archive import decode_chip, l2_normalize, list_chunks, read_chunk
+from config_loader import get_section, resolve_path
+from thread_budget import BLAS_ENV_VARS
+
+logger = logging.getLogger('reembed_chips')
+
+DEFAULT_BATCH_SIZE = 256
+
+# 工作进程的编码器（由initializer创建，每个进程只加载一次模型）
+_encoder = None
+_batch_size = DEFAULT_BATCH_SIZE
+
+
+def _init_worker(model_path: str, batch_size: int):
+    global _encoder, _batch_size
+    import dlib
+    _encoder = dlib.face_recognition_model_v1(model_path)
+    _batch_size = batch_size
+
+
+def _encode_chunk(chunk: str) -> Tuple[list, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """编码一个存档块，返回(chip_id列表, 新特征, 原特征, 是否归一化, 与原特征的距离)"""
+    ids, features, old_features, normalized = [], [], [], []
+    chips, batch_normalized = [], []
+
+    def encode_batch():
+        descriptors = np.array(_encoder.compute_face_descriptor(chips), dtype=np.float32).reshape(-1, 128)
+        for i in np.flatnonzero(batch_normalized):
+            descriptors[i] = l2_normalize(descriptors[i])
+        features.append(descriptors)
+        chips.clear()
+        batch_normalized.clear()
+
+    for record, data in read_chunk(chunk):
+        try:
+            chips.append(decode_chip(data))
+        except ValueError:
+            logger.warning("跳过无法解码的人脸图: %s", record['chip_id'])
+            continue
+        ids.append(record['chip_id'])
+        old_features.append(np.frombuffer(base64.b64decode(record['feature_code']), dtype=np.float32))
+        # 旧版本存档的Base64接口记录保存的是归一化前的特征，没有normalized字段
+        batch_normalized.append(bool(record.get('normalized', False)))
+        normalized.append(batch_normalized[-1])
+        if len(chips) >= _batch_size:
+            encode_batch()
+    if chips:
+        encode_batch()
+
+    if not ids:
+        empty = np.zeros((0, 128), dtype=np.float32)
+        return [], empty, empty, np.zeros(0, dtype=bool), np.zeros(0, dtype=np.float32)
+    features = np.concatenate(features)
+    old_features = np.array(old_features, dtype=np.float32)
+    return (ids, features, old_features, np.array(normalized, dtype=bool),
+            np.linalg.norm(features - old_features, axis=1))
+
+
+def default_model_path() -> str:
+    """face_recognition自带的dlib ResNet编码模型"""
+    import face_recognition_models
+    return face_recognition_models.face_recognition_model_location()
+
+
+def reembed(archive_dir: str, model_path: str, workers: Optional[int] = None,
+            batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """对存档中的全部人脸图重新编码，返回(输出数组: ids/features/old_features/normalized, 统计)"""
+    start_time = time.time()
+    chunks = list_chunks(archive_dir)
+    if not chunks:
+        raise ValueError(f"存档目录中没有人脸图块: {archive_dir}")
+
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    all_ids, all_features, all_old, all_normalized, all_distances = [], [], [], [], []
+
+    def collect(results):
+        for done, (ids, features, old_features, normalized, distances) in enumerate(results, 1):
+            all_ids.extend(ids)
+            all_features.append(features)
+            all_old.append(old_features)
+            all_normalized.append(normalized)
+            all_distances.append(distances)
+            logger.info("存档块 %s/%s, 已编码 %s 个, 耗时 %.1fs", done, len(chunks), len(all_ids),
+                        time.time() - start_time)
+
+    if workers <= 1:
+        _init_worker(model_path, batch_size)
+        collect(map(_encode_chunk, chunks))
+    else:
+        saved_env = {name: os.environ.get(name) for name in BLAS_ENV_VARS}
+        try:
+            # 每个进程单线程BLAS，避免 进程数 x BLAS线程数 超额占用CPU
+            for name in BLAS_ENV_VARS:
+                os.environ[name] = '1'
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(model_path, batch_size)) as executor:
+                collect(executor.map(_encode_chunk, chunks))
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    features = np.concatenate(all_features) if all_features else np.zeros((0, 128), dtype=np.float32)
+    old_features = np.concatenate(all_old) if all_old else np.zeros((0, 128), dtype=np.float32)
+    normalized = np.concatenate(all_normalized) if all_normalized else np.zeros(0, dtype=bool)
+    distances = np.concatenate(all_distances) if all_distances else np.zeros(0, dtype=np.float32)
+    elapsed = time.time() - start_time
+    stats = {
+        "chunks": len(chunks),
+        "chip_count": len(all_ids),
+        "workers": workers,
+        "elapsed_seconds": elapsed,
+        "chips_per_second": len(all_ids) / elapsed if elapsed > 0 else 0.0,
+        # 与存档时特征的距离：同一模型应为0，可用于确认新模型的变化幅度
+        "mean_distance": float(distances.mean()) if len(distances) else 0.0,
+        "max_distance": float(distances.max()) if len(distances) else 0.0
+    }
+    arrays = {
+        "ids": np.array(all_ids, dtype=str),
+        "features": features,
+        "old_features": old_features,
+        "normalized": normalized
+    }
+    return arrays, stats
+
+
+def match_reembedded(ids: List[str], features: np.ndarray, path: str) -> Tuple[List[str], np.ndarray, List[str]]:
+    """把特征库中的特征替换为重新编码的新特征，返回(user_id列表, 新特征, 未找到人脸图的user_id列表)
+
+    按原特征逐字节匹配：录入的特征就是提取接口返回的特征，与存档记录的原特征完全相同。
+    旧版本存档中Base64接口的记录保存的是归一化前的特征，按Base64接口同样的步骤归一化后再匹配，
+    匹配上的新特征也做归一化
+    """
+    with np.load(path, allow_pickle=False) as data:
+        if 'old_features' not in data.files:
+            raise ValueError(f"不是重新编码的输出（缺少old_features）: {os.path.basename(path)}")
+        new_features = np.asarray(data['features'], dtype=np.float32)
+        old_features = np.asarray(data['old_features'], dtype=np.float32)
+        normalized = np.asarray(data['normalized'], dtype=bool)
+
+    # 原特征 -> (行号, 新特征是否需要归一化)；同一特征多次存档时取最后一次
+    rows = {}
+    for i, old in enumerate(old_features):
+        rows[old.tobytes()] = (i, False)
+    for i in np.flatnonzero(~normalized):
+        rows.setdefault(l2_normalize(old_features[i]).tobytes(), (i, True))
+
+    matched_ids, matched, missing = [], [], []
+    for user_id, feature in zip(ids, np.asarray(features, dtype=np.float32)):
+        row = rows.get(feature.tobytes())
+        if row is None:
+            missing.append(user_id)
+            continue
+        i, normalize = row
+        matched_ids.append(user_id)
+        matched.append(l2_normalize(new_features[i]) if normalize else new_features[i])
+
+    matched = np.array(matched, dtype=np.float32).reshape(-1, new_features.shape[1])
+    return matched_ids, matched, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="对存档的对齐人脸图重新编码",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  {sys.argv[0]} --output reembedded.npz
+  {sys.argv[0]} --archive chip_archive/ --model new_resnet.dat --engine dlib-resnet-v2 --workers 16 --output v2.npz
+        """
+    )
+    parser.add_argument('--archive', help='存档目录（默认config.json的chip_archive.directory）')
+    parser.add_argument('--model', help='dlib编码模型文件（默认face_recognition自带模型）')
+    parser.add_argument('--engine', default='dlib-resnet-v1', help='新特征的引擎标识（默认dlib-resnet-v1）')
+    parser.add_argument('--output', required=True, help='输出路径(.npz: ids, features, old_features, normalized, engine)')
+    parser.add_argument('--workers', type=int, help='进程数（默认CPU核心数）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'每次送入编码器的人脸图数（默认{DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--debug', action='store_true', help='在stderr输出调试日志')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format='%(levelname)s: %(message)s',
+        stream=sys.stderr
+    )
+
+    archive_dir = args.archive or resolve_path(get_section('chip_archive').get('directory', 'chip_archive'))
+    try:
+        arrays, stats = reembed(archive_dir, args.model or default_model_path(), args.workers, args.batch_size)
+        np.savez(args.output, engine=np.array(args.engine), **arrays)
+    except Exception as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    print(json.dumps(dict(stats, success=True, output=args.output, engine=args.engine), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,9 @@
 """
 简化的人脸特征提取器 - 直接使用dlib
 不依赖face_recognition_models，适用于快速部署
+
+这是快速层（fast tier）：HOG检测 + HOG描述子，特征与ResNet编码器的特征不可比较，
+输出带engine标签；face_extractor用它在ResNet编码前预筛上传图像
 """
 
 import argparse
@@ -26,6 +29,9 @@ except ImportError as e:
 __version__ = "1.0.0-simple"
 __platform__ = platform.system()
 
+# 特征引擎标签：HOG描述子，不能与ResNet特征（dlib-resnet-v1）混入同一特征库
+FEATURE_ENGINE = "hog-v1"
+
 class SimpleFaceExtractor:
     """简化的人脸特征提取器 - 使用dlib内置检测器"""
     
@@ -63,14 +69,10 @@ class SimpleFaceExtractor:
                 }
             
             # 选择最大的人脸
-            if len(faces) > 1:
-                largest_face = max(faces, key=lambda face: face.area())
-                faces = [largest_face]
-            
-            face = faces[0]
+            face = max(faces, key=lambda face: face.area())
             
             # 提取人脸区域
-            face_region = gray[face.top():face.bottom(), face.left():face.right()]
+            face_region = self._face_region(gray, face)
             
             # 生成简化的特征向量（使用HOG特征）
             feature_vector = self._extract_hog_features(face_region)
@@ -90,6 +92,7 @@ class SimpleFaceExtractor:
                 "quality": quality,
                 "process_time": process_time,
                 "message": "特征提取成功",
+                "engine": FEATURE_ENGINE,
                 "face_location": {
                     "left": face.left(),
                     "top": face.top(),
@@ -107,6 +110,50 @@ class SimpleFaceExtractor:
                 "message": f"特征提取异常: {str(e)}"
             }
     
+    def prescreen(self, image_array: np.ndarray, max_side: int = 320, min_quality: float = 0.0,
+                  reject_multiple: bool = False) -> Dict:
+        """快速预筛：在缩小的灰度图上做HOG检测，判断是否有人脸、是否单人、质量是否达标
+
+        不计算特征，耗时通常只有完整提取的一小部分，用于在ResNet编码前拒绝明显无效的上传
+        """
+        start_time = time.time()
+        gray = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY) if image_array.ndim == 3 else image_array
+        
+        scale = min(1.0, float(max_side) / max(gray.shape[:2]))
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        # 缩小后的图上1次上采样，兼顾小人脸
+        faces = self.detector(gray, 1)
+        result = {
+            "passed": False,
+            "engine": FEATURE_ENGINE,
+            "face_count": len(faces),
+            "quality": 0.0
+        }
+        
+        if len(faces) == 0:
+            result["message"] = "未检测到人脸"
+        elif reject_multiple and len(faces) > 1:
+            result["message"] = f"检测到{len(faces)}个人脸"
+        else:
+            face = max(faces, key=lambda face: face.area())
+            # 面积按原图尺寸计算，与完整提取的尺寸评分一致
+            result["quality"] = self._calculate_quality(self._face_region(gray, face), face.area() / (scale * scale))
+            if result["quality"] < min_quality:
+                result["message"] = f"人脸质量过低: {result['quality']:.3f}"
+            else:
+                result["passed"] = True
+                result["message"] = "预筛通过"
+        
+        result["process_time"] = (time.time() - start_time) * 1000
+        return result
+    
+    @staticmethod
+    def _face_region(gray: np.ndarray, face) -> np.ndarray:
+        """截取人脸区域（检测框可能超出图像边界）"""
+        return gray[max(face.top(), 0):max(face.bottom(), 0), max(face.left(), 0):max(face.right(), 0)]
+    
     def _extract_hog_features(self, face_image: np.ndarray) -> np.ndarray:
         """提取HOG特征作为人脸特征向量"""
         # 调整人脸图像尺寸
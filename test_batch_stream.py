@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+测试批量请求流式解析：JSON数组逐项解析、multipart图像部分逐个接收、并发处理数有上限
+请求体按很小的块读取，覆盖值/字符串/转义序列跨块的情况
+"""
+import io
+import json
+import sys
+import threading
+import time
+
+sys.path.insert(0, '.')
+
+from batch_stream import JsonArrayStream, MultipartBatchStream, run_bounded
+
+
+def parse_json(body, chunk_size=64 * 1024, max_item_bytes=0):
+    reader = JsonArrayStream(io.BytesIO(body.encode('utf-8')), chunk_size=chunk_size,
+                             max_item_bytes=max_item_bytes)
+    return list(reader.items()), reader
+
+
+def expect_error(func, text):
+    """func应抛出ValueError且消息包含text"""
+    try:
+        func()
+    except ValueError as e:
+        assert text in str(e), str(e)
+        return
+    raise AssertionError(f"应当抛出ValueError: {text}")
+
+
+def test_json_items_across_chunks():
+    """任意块大小下逐项结果与json.loads一致"""
+    document = {
+        "timeout_ms": 500,
+        "images": ["aGVsbG8=", "a\"b\\\\", "\\\"]},[{", {"image": "x", "user_id": "u中"},
+                   [1, [2, {"a": "]"}]], 12.5e-3, -7, True, False, None, ""],
+        "concurrency": 2,
+        "note": "结尾字段"
+    }
+    body = json.dumps(document, ensure_ascii=False, indent=1)
+    for chunk_size in (1, 2, 3, 7, 64, 64 * 1024):
+        items, reader = parse_json(body, chunk_size)
+        assert items == document["images"], chunk_size
+        assert reader.found_array
+        assert reader.fields == {"timeout_ms": 500, "concurrency": 2, "note": "结尾字段"}
+    print("✅ JSON数组逐项解析（块大小1~64KB）")
+
+
+def test_json_streams_items():
+    """第一项在读完整个请求体之前产出，缓冲区只保留当前项"""
+    image = 'A' * 100000
+    body = json.dumps({"images": [image] * 20}).encode('utf-8')
+    reader = JsonArrayStream(io.BytesIO(body), chunk_size=4096)
+    max_buffer = 0
+    for i, item in enumerate(reader.items()):
+        assert item == image
+        if i == 0:
+            assert reader.bytes_read < len(body) / 10, reader.bytes_read
+        max_buffer = max(max_buffer, len(reader._buf))
+    assert reader.bytes_read == len(body)
+    assert max_buffer < 2 * len(image), max_buffer
+    print(f"✅ JSON逐项产出，缓冲区峰值 {max_buffer} 字节（请求体 {len(body)} 字节）")
+
+
+def test_json_edge_cases():
+    assert parse_json('{}')[0] == []
+    items, reader = parse_json('{"images": [], "x": 1}')
+    assert items == [] and reader.found_array and reader.fields == {"x": 1}
+    items, reader = parse_json(' {"other": [1, 2]} ')
+    assert items == [] and not reader.found_array and reader.fields == {"other": [1, 2]}
+    print("✅ 空数组、缺少数组")
+
+
+def test_json_errors():
+    expect_error(lambda: parse_json('[1, 2]'), "需要JSON对象")
+    expect_error(lambda: parse_json('{"images": "abc"}'), "必须是数组格式")
+    expect_error(lambda: parse_json('{"images": ["a" "b"]}'), "缺少逗号")
+    expect_error(lambda: parse_json('{"images": ["a", "b"'), "不完整")
+    expect_error(lambda: parse_json('{"images": ["abc'), "字符串未结束")
+    expect_error(lambda: parse_json('{"images": []} x'), "多余数据")
+    expect_error(lambda: parse_json('{"images": [tru]}'), "JSON解析失败")
+    expect_error(lambda: parse_json('{"images": ["' + 'A' * 5000 + '"]}', 256, max_item_bytes=1000), "超过上限")
+    print("✅ JSON格式错误和单项大小上限")
+
+
+BOUNDARY = 'batchBoundary7MA4YWxkTrZu0gW'
+
+
+def multipart_body(parts, close=True):
+    """parts: (字段名, 文件名或None, 内容bytes)"""
+    lines = []
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+        header = f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n'
+        if filename:
+            header += 'Content-Type: application/octet-stream\r\n'
+        lines.append(header.encode('utf-8') + b'\r\n' + content + b'\r\n')
+    body = b''.join(lines)
+    return body + f'--{BOUNDARY}--\r\n'.encode('utf-8') if close else body
+
+
+def parse_multipart(body, chunk_size=64 * 1024, **kwargs):
+    reader = MultipartBatchStream(io.BytesIO(body), BOUNDARY, chunk_size=chunk_size, **kwargs)
+    parts = []
+    for part in reader.items():
+        parts.append((part.filename, part.user_id, part.timeout_ms, part.size, part.read()))
+    return parts, reader
+
+
+def test_multipart_parts():
+    """图像部分逐个产出；user_id/timeout_ms作用于下一个图像部分；其他字段放入fields"""
+    images = [bytes(range(256)) * 40, b'\r\n--not-a-boundary\r\n' * 100, b'x']
+    body = multipart_body([
+        ('concurrency', None, b'2'),
+        ('user_id', None, '用户1'.encode('utf-8')),
+        ('timeout_ms', None, b'300'),
+        ('image', 'a.jpg', images[0]),
+        ('image', 'b.jpg', images[1]),
+        ('user_id', None, b'u3'),
+        ('image', 'c.png', images[2]),
+        ('note', None, b'end'),
+    ])
+    for chunk_size in (1, 5, 100, 64 * 1024):
+        parts, reader = parse_multipart(body, chunk_size)
+        assert parts == [('a.jpg', '用户1', '300', len(images[0]), images[0]),
+                         ('b.jpg', None, None, len(images[1]), images[1]),
+                         ('c.png', 'u3', None, 1, images[2])], chunk_size
+        assert reader.fields == {"concurrency": "2", "note": "end"} and reader.part_count == 3
+    print("✅ multipart图像部分逐个接收（块大小1~64KB）")
+
+
+def test_multipart_spool_and_limits():
+    image = b'\x89PNG' + b'\0' * 20000
+    reader = MultipartBatchStream(io.BytesIO(multipart_body([('image', 'big.png', image)])), BOUNDARY,
+                                  chunk_size=1024, spool_memory=4096)
+    part = next(reader.items())
+    assert part.file._rolled, "超过spool_memory的部分应转存临时文件"
+    assert part.read() == image
+
+    body = multipart_body([('image', 'a.jpg', b'1' * 500), ('image', 'b.jpg', b'2' * 5000)])
+    expect_error(lambda: parse_multipart(body, 256, max_item_bytes=1000), "超过上限")
+    # 缺少结束分隔符：由werkzeug报告格式错误
+    expect_error(lambda: parse_multipart(multipart_body([('image', 'a.jpg', b'123')], close=False)), "")
+    expect_error(lambda: parse_multipart(multipart_body([('note', None, b'n' * 5000)]), max_field_bytes=1000),
+                 "multipart数据解析失败")
+    print("✅ multipart转存临时文件、单项大小和字段大小上限")
+
+
+def test_item_count_limit():
+    """项数超过max_items时在读取多出的一项之前报错"""
+    body = json.dumps({"images": [f"img{i}" for i in range(5)]})
+    items, reader = parse_json(body, 7)
+    assert len(items) == 5 and reader.item_count == 5
+    reader = JsonArrayStream(io.BytesIO(body.encode('utf-8')), chunk_size=7, max_items=3)
+    received = []
+    expect_error(lambda: received.extend(reader.items()), "批量项数超过上限3")
+    assert received == ["img0", "img1", "img2"]
+    assert parse_json('{"images": ["a", "b", "c"]}')[0] == ["a", "b", "c"]
+
+    parts = [('image', f'{i}.jpg', b'x' * 10) for i in range(5)]
+    reader = MultipartBatchStream(io.BytesIO(multipart_body(parts)), BOUNDARY, chunk_size=16, max_items=3)
+    received = []
+    expect_error(lambda: received.extend(part.read() for part in reader.items()), "批量项数超过上限3")
+    assert len(received) == 3
+    parsed, _ = parse_multipart(multipart_body(parts[:3]), max_items=3)
+    assert len(parsed) == 3
+    print("✅ 批量项数上限")
+
+
+def test_batch_endpoint_limit():
+    """/api/face/batch按performance.batch_size_limit拒绝超出的JSON和multipart请求"""
+    import face_service
+    from config_loader import get_section
+
+    limit = int(get_section('performance').get('batch_size_limit', 10))
+    client = face_service.app.test_client()
+    items = [{"image": "aGVsbG8="}] * limit
+    response = client.post('/api/face/batch', json={"images": items})
+    assert response.status_code == 200 and response.get_json()["total_count"] == limit
+
+    response = client.post('/api/face/batch', json={"images": items + [{"image": "aGVsbG8="}]})
+    assert response.status_code == 400 and "批量项数超过上限" in response.get_json()["message"]
+
+    parts = [('image', f'{i}.jpg', b'hello') for i in range(limit + 1)]
+    response = client.post('/api/face/batch', data=multipart_body(parts),
+                           content_type=f'multipart/form-data; boundary={BOUNDARY}')
+    assert response.status_code == 400 and "批量项数超过上限" in response.get_json()["message"]
+    print(f"✅ 批量接口项数上限{limit}")
+
+
+def test_run_bounded():
+    """结果按输入顺序返回；同时处理的项数不超过并发数，读取在槽位占满时暂停"""
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0, "taken": 0, "done": 0, "ahead": 0}
+
+    def items():
+        for i in range(30):
+            with lock:
+                state["taken"] += 1
+                state["ahead"] = max(state["ahead"], state["taken"] - state["done"])
+            yield i
+
+    def worker(index, item):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01 * (3 - item % 3))
+        with lock:
+            state["running"] -= 1
+            state["done"] += 1
+        return {"index": index, "item": item}
+
+    results = run_bounded(items(), worker, 4)
+    assert [result["item"] for result in results] == list(range(30))
+    assert [result["index"] for result in results] == list(range(30))
+    assert state["peak"] <= 4 and state["ahead"] <= 4, state
+    print(f"✅ 有界并发处理（峰值并发 {state['peak']}）")
+
+
+if __name__ == "__main__":
+    print("开始测试批量请求流式解析...")
+    test_json_items_across_chunks()
+    test_json_streams_items()
+    test_json_edge_cases()
+    test_json_errors()
+    test_multipart_parts()
+    test_multipart_spool_and_limits()
+    test_item_count_limit()
+    test_batch_endpoint_limit()
+    test_run_bounded()
+    print("🎉 全部通过")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试分块距离计算与阈值标定：分块结果与一次性计算的全部两两距离一致（块大小不整除样本数时也一致），
+单进程与多进程累加的直方图相同
+"""
+import sys
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+from blocked_distance import iter_block_origins, threshold_pairs
+from calibrate_threshold import accumulate_histograms, calibrate, compute_curves
+
+BIN_WIDTH = 0.01
+
+
+def labeled_features(identities=8, per_identity=5, seed=0):
+    """每人若干张：身份中心加小扰动，同人距离明显小于异人距离"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(identities, 128))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = np.repeat(np.arange(identities), per_identity)
+    features = centers[labels] + rng.normal(scale=0.02, size=(len(labels), 128))
+    return features.astype(np.float32), labels
+
+
+def brute_force_distances(features):
+    features = features.astype(np.float64)
+    return np.linalg.norm(features[:, None, :] - features[None, :, :], axis=2)
+
+
+def test_block_origins():
+    assert list(iter_block_origins(5, 2)) == [(0, 0), (0, 2), (0, 4), (2, 2), (2, 4), (4, 4)]
+    assert list(iter_block_origins(0, 2)) == []
+    print("✅ 上三角分块")
+
+
+def test_threshold_pairs_match_brute_force():
+    features, _ = labeled_features()
+    distances = brute_force_distances(features)
+    threshold = 0.5
+    expected = {(i, j) for i, j in zip(*np.nonzero(distances <= threshold)) if i < j}
+
+    for block_size in (7, 16, 40, 4096):
+        rows, cols, found = threshold_pairs(features, threshold, block_size)
+        assert set(zip(rows.tolist(), cols.tolist())) == expected, block_size
+        assert len(rows) == len(expected) and np.all(rows < cols)
+        assert np.allclose(found, distances[rows, cols], atol=1e-4)
+    # 8人x5张：每人10个同人对
+    assert len(expected) == 80
+
+    rows, cols, found = threshold_pairs(np.empty((0, 128), np.float32), threshold)
+    assert len(rows) == len(cols) == len(found) == 0
+    print(f"✅ 分块结果与逐对计算一致（{len(expected)}对）")
+
+
+def test_histograms_match_brute_force():
+    features, labels = labeled_features(seed=1)
+    distances = brute_force_distances(features)
+    upper = np.triu_indices(len(features), k=1)
+    bins = np.minimum((distances[upper] / BIN_WIDTH).astype(np.int64), int(2.0 / BIN_WIDTH) - 1)
+    same = labels[upper[0]] == labels[upper[1]]
+    expected_genuine = np.bincount(bins[same], minlength=int(2.0 / BIN_WIDTH))
+    expected_impostor = np.bincount(bins[~same], minlength=int(2.0 / BIN_WIDTH))
+
+    genuine, impostor = accumulate_histograms(features, labels, block_size=9, bin_width=BIN_WIDTH, workers=1)
+    assert genuine.sum() == 80 and impostor.sum() == len(upper[0]) - 80
+    # 边界附近的浮点误差最多让个别距离落到相邻的直方图格
+    assert np.abs(np.cumsum(genuine - expected_genuine)).max() <= 1
+    assert np.abs(np.cumsum(impostor - expected_impostor)).max() <= 1
+
+    spawned = accumulate_histograms(features, labels, block_size=9, bin_width=BIN_WIDTH, workers=2)
+    assert np.array_equal(spawned[0], genuine) and np.array_equal(spawned[1], impostor)
+
+    curves = compute_curves(genuine, impostor, BIN_WIDTH)
+    assert np.all(np.diff(curves["far"]) >= 0) and np.all(np.diff(curves["frr"]) <= 1e-12)
+    print("✅ 单进程/多进程直方图与逐对计算一致")
+
+
+def test_calibrate_separates_identities():
+    features, labels = labeled_features(seed=2)
+    result = calibrate(features, labels, block_size=16, bin_width=BIN_WIDTH, workers=1)
+    assert result["success"] and result["identity_count"] == 8
+    assert result["genuine_pairs"] == 80 and result["impostor_pairs"] == 40 * 39 // 2 - 80
+    # 同人距离约0.32，异人距离约1.4，等错误率点落在两者之间且没有错误
+    eer = result["recommended"]["eer"]
+    assert 0.3 < eer["threshold"] < 1.3 and eer["far"] == 0 and eer["frr"] == 0, eer
+    assert result["recommended"]["current"]["loose_0.6"] == {"threshold": 0.6, "far": 0.0, "frr": 0.0}
+    print(f"✅ 阈值标定，EER阈值 {eer['threshold']}")
+
+
+if __name__ == "__main__":
+    print("开始测试分块距离计算...")
+    test_block_origins()
+    test_threshold_pairs_match_brute_force()
+    test_histograms_match_brute_force()
+    test_calibrate_separates_identities()
+    print("🎉 全部通过")
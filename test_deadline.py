@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试请求截止时间：预算解析、批量项取较早的截止时间、剩余预算不足时跳过兜底检测后端、
+已过期的请求不再运行检测并返回504
+"""
+import base64
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import cv2
+import numpy as np
+
+from deadline import TIMEOUT_HEADER, Deadline, expired_result, parse_deadline
+from face_detectors import CascadeDetector
+
+IMAGE = os.path.join('test-pictures', 'admin.jpg')
+
+
+class StubBackend:
+    def __init__(self, name, faces):
+        self.name = name
+        self.faces = faces
+        self.calls = 0
+
+    def detect(self, image_array):
+        self.calls += 1
+        return self.faces
+
+
+def small_jpeg():
+    image = cv2.resize(cv2.imread(IMAGE), None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def test_parse_deadline():
+    assert parse_deadline(None) is None and parse_deadline('') is None and parse_deadline(None, 0) is None
+    default = parse_deadline(None, 5000)
+    assert 4900 < default.remaining_ms() <= 5000 and not default.expired()
+    assert 1900 < parse_deadline('2000', 5000).remaining_ms() <= 2000
+    assert parse_deadline(0).expired() and parse_deadline('-5').expired()
+    for value in ('abc', [1], {}):
+        try:
+            parse_deadline(value)
+        except ValueError as e:
+            assert "timeout_ms必须是毫秒数" in str(e)
+        else:
+            raise AssertionError(f"{value!r}应被拒绝")
+    print("✅ 预算解析")
+
+
+def test_earlier():
+    short, long = Deadline(100), Deadline(10000)
+    assert short.earlier(long) is short and long.earlier(short) is short
+    assert long.earlier(None) is long
+
+    result = expired_result(time.time() - 0.05, "特征编码", feature_code="")
+    assert result["deadline_exceeded"] and not result["success"] and result["feature_code"] == ""
+    assert "跳过特征编码" in result["message"] and result["process_time"] >= 50
+    print("✅ 取较早的截止时间")
+
+
+def test_fallback_skipped_when_budget_low():
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    primary, fallback = StubBackend('primary', []), StubBackend('fallback', [(1, 5, 5, 1)])
+    detector = CascadeDetector([primary, fallback], fallback_min_ms=1000)
+
+    assert detector.detect(image, deadline=Deadline(500)) == [] and fallback.calls == 0
+    assert detector.detect(image, deadline=Deadline(5000)) == [(1, 5, 5, 1)] and fallback.calls == 1
+    assert detector.detect(image) == [(1, 5, 5, 1)] and fallback.calls == 2
+    # 第一个后端总会运行
+    assert primary.calls == 3
+    print("✅ 剩余预算不足时跳过兜底后端")
+
+
+def test_expired_request_returns_504():
+    import face_service
+
+    client = face_service.app.test_client()
+    image = small_jpeg()
+    extractor = face_service.face_extractor
+    with mock.patch.object(extractor, '_detect_faces', wraps=extractor._detect_faces) as detect:
+        response = client.post('/api/face/extract', data=image, content_type='application/octet-stream',
+                               headers={TIMEOUT_HEADER: '0'})
+        body = response.get_json()
+        assert response.status_code == 504 and body["deadline_exceeded"], body
+        response = client.post('/api/face/extract', json={'image': base64.b64encode(image).decode('ascii'),
+                                                           'timeout_ms': 'soon'})
+        assert response.status_code == 400 and "timeout_ms" in response.get_json()["message"]
+        assert detect.call_count == 0
+
+        response = client.post('/api/face/extract', data=image, content_type='application/octet-stream',
+                               headers={TIMEOUT_HEADER: '60000'})
+        assert response.status_code == 200 and response.get_json()["success"]
+        assert detect.call_count == 1
+    print("✅ 已过期的请求返回504且不运行检测")
+
+
+def test_batch_item_deadline():
+    import face_service
+
+    encoded = base64.b64encode(small_jpeg()).decode('ascii')
+    client = face_service.app.test_client()
+    response = client.post('/api/face/batch', json={'images': [
+        {'user_id': 'late', 'image': encoded, 'timeout_ms': 0},
+        {'user_id': 'ok', 'image': encoded}
+    ]})
+    body = response.get_json()
+    assert response.status_code == 200 and body["deadline_exceeded_count"] == 1, body
+    results = {result["user_id"]: result for result in body["results"]}
+    assert results["late"]["deadline_exceeded"] and not results["late"]["success"]
+    assert results["ok"]["success"] and not results["ok"].get("deadline_exceeded")
+    print("✅ 批量项的截止时间只影响该项")
+
+
+if __name__ == "__main__":
+    print("开始测试请求截止时间...")
+    test_parse_deadline()
+    test_earlier()
+    test_fallback_skipped_when_budget_low()
+    test_expired_request_returns_504()
+    test_batch_item_deadline()
+    print("🎉 全部通过")
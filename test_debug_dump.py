@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+测试调试图像转储：默认关闭、后台线程写盘和配额淘汰、已有文件由后台线程统计
+"""
+import os
+import sys
+import tempfile
+import threading
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+import debug_dump
+from config_loader import DEFAULT_CONFIG
+from debug_dump import DebugImageWriter
+
+
+def noise_image(seed, size=64):
+    return np.random.default_rng(seed).integers(0, 256, (size, size, 3), dtype=np.uint8)
+
+
+def test_disabled_by_default():
+    assert not DebugImageWriter().enabled
+    assert not DebugImageWriter(DEFAULT_CONFIG['debug_dump']).enabled
+    assert not DebugImageWriter().submit(noise_image(0))
+    print("✅ 默认不保存调试图像")
+
+
+def test_write_and_evict():
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'failed_1_0.jpg'), 'wb') as f:
+            f.write(b'\0' * 20000)
+
+        listdir_threads = []
+        real_listdir = os.listdir
+
+        def listdir(path):
+            listdir_threads.append(threading.current_thread().name)
+            return real_listdir(path)
+
+        writer = DebugImageWriter({'enabled': True, 'directory': directory, 'sample_rate': 1.0,
+                                   'max_disk_usage': '40KB', 'queue_size': 64})
+        with mock.patch.object(debug_dump.os, 'listdir', listdir):
+            for i in range(8):
+                assert writer.submit(noise_image(i))
+            writer.flush()
+
+        # 目录扫描在后台线程中执行，请求线程不做磁盘IO
+        assert listdir_threads == ['debug-image-writer'], listdir_threads
+        status = writer.get_status()
+        assert status["submitted"] == status["written"] == 8
+        assert status["evicted"] >= 1 and status["disk_usage"] <= 40 * 1024
+        assert not os.path.exists(os.path.join(directory, 'failed_1_0.jpg')), "旧文件应最先被淘汰"
+        names = [name for name in os.listdir(directory) if name.endswith('.jpg')]
+        assert sum(os.path.getsize(os.path.join(directory, name)) for name in names) == status["disk_usage"]
+    print("✅ 后台写盘与配额淘汰")
+
+
+def test_concurrent_stats():
+    """多个请求线程同时提交：计数不丢失"""
+    with tempfile.TemporaryDirectory() as directory:
+        writer = DebugImageWriter({'enabled': True, 'directory': directory, 'sample_rate': 0.5,
+                                   'queue_size': 1})
+        image = noise_image(1, 16)
+        threads = [threading.Thread(target=lambda: [writer.submit(image) for _ in range(500)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.flush()
+        status = writer.get_status()
+        assert status["submitted"] == 4000
+        assert status["sampled_out"] + status["dropped"] + status["written"] + status["errors"] == 4000, status
+    print("✅ 并发提交的计数")
+
+
+if __name__ == "__main__":
+    print("开始测试调试图像转储...")
+    test_disabled_by_default()
+    test_write_and_evict()
+    test_concurrent_stats()
+    print("🎉 全部通过")
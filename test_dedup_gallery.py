@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+测试特征库重复身份聚类：两种聚类方法在链状连接上的差异、重复报告中保留的账号、
+去重后的特征库可以重新加载
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+from dedup_gallery import cluster_pairs, find_duplicates, load_gallery, write_merged_gallery
+from gallery import GallerySnapshot, TenantGallery
+
+
+def random_features(count, seed):
+    features = np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def edges(pairs):
+    return np.array([a for a, _ in pairs], dtype=np.int64), np.array([b for _, b in pairs], dtype=np.int64)
+
+
+def test_cluster_methods():
+    # 两个4人团只靠一条边(3,4)相连：连通分量合成一个簇，chinese_whispers拆成两个
+    pairs = [pair for group in (range(0, 4), range(4, 8)) for pair in itertools.combinations(group, 2)]
+    rows, cols = edges(pairs + [(3, 4)])
+    assert [c.tolist() for c in cluster_pairs(rows, cols, 'components')] == [list(range(8))]
+    assert sorted(c.tolist() for c in cluster_pairs(rows, cols)) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+    # 节点编号不连续时返回原编号
+    rows, cols = edges([(10, 20), (30, 40)])
+    for method in ('chinese_whispers', 'components'):
+        assert sorted(c.tolist() for c in cluster_pairs(rows, cols, method)) == [[10, 20], [30, 40]]
+        assert cluster_pairs(np.empty(0, np.int64), np.empty(0, np.int64), method) == []
+
+    try:
+        cluster_pairs(rows, cols, 'kmeans')
+    except ValueError as e:
+        assert "未知的聚类方法" in str(e)
+    else:
+        raise AssertionError("未知聚类方法应抛出ValueError")
+    print("✅ 两种聚类方法")
+
+
+def duplicate_snapshot():
+    """u0..u9互不相同；u3录入了两个重复账号，u7录入了一个"""
+    rng = np.random.default_rng(2)
+    base = random_features(10, 1)
+    ids = [f"u{i}" for i in range(10)]
+    features = [base]
+    for user_id, source in (("u3_dup1", 3), ("u3_dup2", 3), ("u7_dup", 7)):
+        feature = base[source] + rng.normal(scale=0.01, size=128).astype(np.float32)
+        ids.append(user_id)
+        features.append(feature[None, :])
+    return GallerySnapshot(ids, np.concatenate(features))
+
+
+def test_find_duplicates():
+    snapshot = duplicate_snapshot()
+    report = find_duplicates(snapshot, threshold=0.4, block_size=4)
+    assert report["success"] and report["gallery_size"] == 13
+    assert report["candidate_pairs"] == 4 and report["duplicate_clusters"] == 2 and report["duplicate_users"] == 3
+
+    first, second = report["clusters"]
+    assert first["size"] == 3 and sorted([first["keep"]] + first["duplicates"]) == ["u3", "u3_dup1", "u3_dup2"]
+    # 簇内度数相同时保留编号最小的（最早录入的）账号
+    assert first["keep"] == "u3" and first["duplicates"] == ["u3_dup1", "u3_dup2"]
+    assert (second["size"], second["keep"], second["duplicates"]) == (2, "u7", ["u7_dup"])
+    assert 0 < first["max_distance"] <= 0.4
+
+    # 阈值很小时没有重复
+    report = find_duplicates(snapshot, threshold=0.001, block_size=4, method='components')
+    assert report["candidate_pairs"] == 0 and report["clusters"] == []
+    print("✅ 重复报告")
+
+
+def test_write_merged_gallery():
+    snapshot = duplicate_snapshot()
+    report = find_duplicates(snapshot, threshold=0.4)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'merged', 't1.npz')
+        assert write_merged_gallery(snapshot, report, path) == 10
+
+        merged = load_gallery(path)
+        assert merged.ids == [f"u{i}" for i in range(10)]
+        assert np.array_equal(merged.features, snapshot.features[:10])
+        gallery = TenantGallery.load('t1', path)
+        assert gallery.search(snapshot.features[11], 1)[0][0] == "u3"
+        gallery.close()
+    print("✅ 去重后的特征库")
+
+
+if __name__ == "__main__":
+    print("开始测试重复身份聚类...")
+    test_cluster_methods()
+    test_find_duplicates()
+    test_write_merged_gallery()
+    print("🎉 全部通过")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+测试命令行仅编码模式（--crop/--aligned）：参数格式错误时写入失败结果文件，而不是抛出异常
+"""
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+import cv2
+
+IMAGE = os.path.join('test-pictures', 'admin.jpg')
+
+
+def run_extract(*args):
+    """运行face_extractor.py extract，返回(退出码, 结果文件内容, stderr)"""
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'result.json')
+        process = subprocess.run([sys.executable, 'face_extractor.py', 'extract', '--output', output, *args],
+                                 capture_output=True, text=True, timeout=300)
+        result = None
+        if os.path.exists(output):
+            with open(output, encoding='utf-8') as f:
+                result = json.load(f)
+        return process.returncode, result, process.stderr
+
+
+def image_base64():
+    """缩小后的测试图片（命令行参数长度有限）"""
+    image = cv2.imread(IMAGE)
+    scale = 320 / max(image.shape[:2])
+    image = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)))
+    return base64.b64encode(cv2.imencode('.jpg', image)[1].tobytes()).decode('ascii')
+
+
+def test_malformed_base64():
+    code, result, stderr = run_extract('--base64', 'not-base64!', '--crop')
+    assert code == 1 and 'Traceback' not in stderr, stderr
+    assert result["success"] is False and "解析输入参数失败" in result["message"]
+    print("✅ Base64格式错误写入失败结果")
+
+
+def test_malformed_box():
+    for args in (('--base64', image_base64(), '--crop', '--box', '1,2,x,4'),
+                 ('--input', IMAGE, '--crop', '--box', '1,2,x,4')):
+        code, result, stderr = run_extract(*args)
+        assert code == 1 and 'Traceback' not in stderr, stderr
+        assert result["success"] is False, result
+    print("✅ 人脸框格式错误写入失败结果（--base64与--input一致）")
+
+
+def test_crop_success():
+    code, result, stderr = run_extract('--base64', image_base64(), '--crop')
+    assert code == 0, (result, stderr)
+    assert result["success"] and len(base64.b64decode(result["feature_code"])) == 128 * 4
+    print("✅ Base64输入的仅编码模式")
+
+
+if __name__ == "__main__":
+    print("开始测试命令行仅编码模式...")
+    test_malformed_base64()
+    test_malformed_box()
+    test_crop_success()
+    print("🎉 全部通过")
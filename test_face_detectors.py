@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+测试人脸检测后端：按配置选择每个可用后端并在测试图片上检出人脸；
+YuNet模型缺失时该后端被跳过，不影响其他后端
+"""
+import logging
+import os
+import sys
+import threading
+
+sys.path.insert(0, '.')
+
+import cv2
+
+from config_loader import get_section
+from face_detectors import DETECTOR_BACKENDS, HogDetector, YuNetDetector, create_detector
+
+IMAGE = os.path.join('test-pictures', 'admin.jpg')
+
+
+def load_image(max_side=480):
+    """缩小后的测试图片（RGB），CNN后端在CPU上处理原图太慢"""
+    image = cv2.imread(IMAGE)
+    scale = min(1.0, max_side / max(image.shape[:2]))
+    image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def detector_config(**overrides):
+    config = dict(get_section('face_extraction').get('detector', {}))
+    config.update(overrides)
+    return config
+
+
+def test_select_each_backend():
+    image = load_image()
+    height, width = image.shape[:2]
+    tested = []
+    for name, backend_class in DETECTOR_BACKENDS.items():
+        try:
+            backend_class(detector_config())
+        except RuntimeError as e:
+            # 只有依赖外部模型的后端允许不可用
+            assert name == 'yunet', (name, e)
+            print(f"⏭️  {name} 不可用，跳过: {e}")
+            continue
+
+        detector = create_detector(detector_config(backends=[name]))
+        assert [backend.name for backend in detector.backends] == [name]
+        face_locations = detector.detect(image)
+        assert len(face_locations) >= 1, name
+        for top, right, bottom, left in face_locations:
+            assert 0 <= top < bottom <= height and 0 <= left < right <= width, (name, face_locations)
+        tested.append(name)
+    assert {'hog', 'cnn', 'haar'} <= set(tested), tested
+    print(f"✅ 各后端均检出人脸: {', '.join(tested)}")
+
+
+def test_hog_concurrent_image_sizes():
+    """多个线程同时检测不同尺寸的图像（共用face_recognition全局检测器时进程会崩溃），结果与face_locations一致"""
+    import face_recognition
+
+    detector = HogDetector(detector_config(upsample=1))
+    images = [load_image(480), load_image(240)]
+    expected = [face_recognition.face_locations(image, 1) for image in images]
+    results = [[] for _ in images]
+
+    def run(index):
+        for _ in range(6 if index == 0 else 20):
+            results[index].append(detector.detect(images[index]))
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for index, locations in enumerate(results):
+        assert locations and all(found == expected[index] for found in locations), (locations, expected[index])
+    print("✅ 多线程HOG检测")
+
+
+def test_missing_yunet_model_skipped():
+    config = detector_config(backends=['yunet', 'haar'], yunet_model='models/does_not_exist.onnx')
+    try:
+        YuNetDetector(config)
+    except RuntimeError as e:
+        assert "模型文件不存在" in str(e), str(e)
+    else:
+        raise AssertionError("模型缺失时YuNet后端应无法初始化")
+
+    logging.disable(logging.WARNING)
+    try:
+        detector = create_detector(config)
+        assert [backend.name for backend in detector.backends] == ['haar']
+        # 全部不可用时退回hog
+        detector = create_detector(detector_config(backends=['yunet'], yunet_model='models/does_not_exist.onnx'))
+        assert len(detector.backends) == 1 and isinstance(detector.backends[0], HogDetector)
+    finally:
+        logging.disable(logging.NOTSET)
+    print("✅ YuNet模型缺失时跳过该后端")
+
+
+if __name__ == "__main__":
+    print("开始测试人脸检测后端...")
+    test_select_each_backend()
+    test_hog_concurrent_image_sizes()
+    test_missing_yunet_model_skipped()
+    print("🎉 全部通过")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+测试租户特征库：叠加层视图、合并后重新加载、多个worker进程同时写入同一租户
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+from gallery import FileLock, GalleryManager, TenantGallery
+
+
+def random_features(count, seed):
+    features = np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def top_user(gallery, feature):
+    return gallery.search(feature, 1)[0][0]
+
+
+def test_view_isolation():
+    """之后的录入/删除不改变旧视图看到的内容"""
+    with tempfile.TemporaryDirectory() as directory:
+        features = random_features(3, 1)
+        gallery = TenantGallery.load('t1', os.path.join(directory, 't1.npz'))
+        gallery.enroll('alice', features[0])
+        gallery.enroll('bob', features[1])
+        gallery.compact()
+        gallery.enroll('carol', features[2])
+        old_view = gallery.view
+
+        gallery.delete('alice')
+        gallery.enroll('carol', features[0])
+        gallery.delete('bob')
+
+        assert len(old_view) == 3
+        assert [user for user, _ in old_view.search(features[0], 3)][0] == 'alice'
+        assert {user for user, _ in old_view.search(features[1], 3)} == {'alice', 'bob', 'carol'}
+        assert len(gallery.view) == 1
+        assert gallery.search(features[0], 3) == [('carol', gallery.search(features[0], 1)[0][1])]
+        assert not gallery.view.contains('alice') and gallery.view.contains('carol')
+    print("✅ 旧视图不受后续写入影响")
+
+
+def test_overlay_growth_and_compact():
+    """叠加层扩容后检索正确，合并、重新加载后内容一致"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 't2.npz')
+        features = random_features(300, 2)
+        gallery = TenantGallery.load('t2', path)
+        for i in range(200):
+            gallery.enroll(f'u{i}', features[i])
+        for i in range(0, 200, 10):
+            gallery.delete(f'u{i}')
+        assert len(gallery.view) == 180
+        assert gallery.view.store.capacity >= 200
+        assert top_user(gallery, features[5]) == 'u5'
+
+        assert gallery.compact()
+        assert gallery.pending_count == 0 and len(gallery.view) == 180
+        for i in range(200, 300):
+            gallery.enroll(f'u{i}', features[i])
+        gallery.delete('u5')
+
+        reloaded = TenantGallery.load('t2', path)
+        assert len(reloaded.view) == len(gallery.view) == 279
+        for i in (1, 151, 299):
+            assert top_user(reloaded, features[i]) == f'u{i}'
+        assert top_user(reloaded, features[5]) != 'u5'
+    print("✅ 叠加层扩容、合并与重新加载")
+
+
+def test_quantized_compact():
+    """量化存储合并后检索结果不变"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 't3.npz')
+        features = random_features(100, 3)
+        gallery = TenantGallery.load('t3', path, quantize=True)
+        for i in range(100):
+            gallery.enroll(f'u{i}', features[i])
+        gallery.compact()
+        gallery.delete('u7')
+        gallery.compact()
+
+        reloaded = TenantGallery.load('t3', path, quantize=True)
+        assert len(reloaded.view) == 99
+        assert top_user(reloaded, features[8]) == 'u8'
+        assert top_user(reloaded, features[7]) != 'u7'
+    print("✅ 量化存储合并")
+
+
+def test_enroll_does_not_reenter_write_lock():
+    """录入持有写锁时检查引擎：即使每次都判定日志有变化，也不能再次获取写锁"""
+    with tempfile.TemporaryDirectory() as directory:
+        features = random_features(2, 6)
+        gallery = TenantGallery.load('t4', os.path.join(directory, 't4.npz'))
+        gallery.enroll('alice', features[0])
+        # refresh不再提前返回，每次都进入加锁的分支
+        def refresh():
+            with gallery._write_lock, FileLock(gallery.lock_path):
+                gallery._catch_up_locked()
+        gallery.refresh = refresh
+
+        done = threading.Event()
+        thread = threading.Thread(target=lambda: (gallery.enroll('bob', features[1]), done.set()), daemon=True)
+        thread.start()
+        assert done.wait(10), "录入在写锁上死锁"
+        assert top_user(gallery, features[1]) == 'bob'
+        try:
+            gallery.enroll('carol', features[0], engine='hog-fast')
+        except ValueError as e:
+            assert "特征引擎不一致" in str(e)
+        else:
+            raise AssertionError("引擎不一致的录入应被拒绝")
+    print("✅ 录入时的引擎检查不重复获取写锁")
+
+
+def _worker(directory, tenant_id, shared_memory, worker, count, barrier, results):
+    """一个worker进程：交替录入和合并，最后检索另一个进程录入的用户"""
+    manager = GalleryManager({'directory': directory, 'shared_memory': shared_memory,
+                              'compact_threshold': 10 ** 6, 'compact_interval': 3600})
+    features = random_features(2 * count, 4)
+    barrier.wait()
+    for i in range(count):
+        row = worker * count + i
+        manager.enroll(tenant_id, f'w{worker}-{i}', features[row])
+        if i % 25 == 24:
+            manager.compact(tenant_id)
+    barrier.wait()
+
+    other = 1 - worker
+    gallery = manager.get(tenant_id)
+    found = sum(top_user(gallery, features[other * count + i]) == f'w{other}-{i}' for i in range(count))
+    results[worker] = (len(gallery.view), found)
+    # 两个进程都检索完再释放，multiprocessing子进程退出时不执行atexit
+    barrier.wait()
+    manager.close()
+
+
+def run_two_workers(directory, tenant_id, shared_memory, count):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(2, timeout=60)
+    results = context.Manager().dict()
+    processes = [context.Process(target=_worker,
+                                 args=(directory, tenant_id, shared_memory, worker, count, barrier, results))
+                 for worker in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0, f"worker退出码 {process.exitcode}"
+    assert results[0] == results[1] == (2 * count, count), dict(results)
+
+
+def shm_segments(tenant_id):
+    if not os.path.isdir('/dev/shm'):
+        return []
+    return [name for name in os.listdir('/dev/shm') if name.startswith(f'face_gallery_{tenant_id}_')]
+
+
+def test_two_process_enroll():
+    """两个worker进程同时录入并合并同一租户，不丢记录、互相可见"""
+    count = 150
+    with tempfile.TemporaryDirectory() as directory:
+        run_two_workers(directory, 'shared', False, count)
+
+        reloaded = TenantGallery.load('shared', os.path.join(directory, 'shared.npz'))
+        assert len(reloaded.view) == 2 * count
+        seqs = [record[0] for record in reloaded._records]
+        assert len(seqs) == len(set(seqs)), "日志序号重复"
+        reloaded.compact()
+        assert len(TenantGallery.load('shared', os.path.join(directory, 'shared.npz')).view) == 2 * count
+    print("✅ 两个进程同时录入/合并")
+
+
+def test_two_process_shared_memory():
+    """共享内存模式：两个worker同时录入/合并，最后一个退出的worker删除共享段"""
+    if sys.platform != 'linux':
+        print("⚠️ 共享内存特征库仅支持Linux，跳过")
+        return
+    count = 100
+    tenant_id = f'shm{os.getpid()}'
+    with tempfile.TemporaryDirectory() as directory:
+        run_two_workers(directory, tenant_id, True, count)
+        assert not shm_segments(tenant_id), shm_segments(tenant_id)
+
+        reloaded = TenantGallery.load(tenant_id, os.path.join(directory, f'{tenant_id}.npz'))
+        assert len(reloaded.view) == 2 * count
+    print("✅ 共享内存模式两个进程录入/合并，退出后删除共享段")
+
+
+def test_shared_memory_eviction():
+    """共享内存模式：淘汰租户时删除其共享段"""
+    if sys.platform != 'linux':
+        print("⚠️ 共享内存特征库仅支持Linux，跳过")
+        return
+    first, second = f'evicta{os.getpid()}', f'evictb{os.getpid()}'
+    features = random_features(2, 5)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = GalleryManager({'directory': directory, 'shared_memory': True, 'max_memory': '1KB'})
+        manager.enroll(first, 'alice', features[0])
+        manager.compact(first)
+        assert len(shm_segments(first)) == 2
+
+        manager.enroll(second, 'bob', features[1])
+        assert first not in manager._galleries and not shm_segments(first)
+        assert shm_segments(second)
+        assert manager.search(first, features[0])['best_match']['user_id'] == 'alice'
+
+        manager.close()
+        assert not shm_segments(first) and not shm_segments(second)
+    print("✅ 共享内存模式淘汰租户时删除共享段")
+
+
+if __name__ == "__main__":
+    print("开始测试租户特征库...")
+    test_view_isolation()
+    test_overlay_growth_and_compact()
+    test_quantized_compact()
+    test_enroll_does_not_reenter_write_lock()
+    test_two_process_enroll()
+    test_two_process_shared_memory()
+    test_shared_memory_eviction()
+    print("🎉 全部通过")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试特征引擎标签：ResNet特征库拒绝HOG快速层的特征，特征库接口必须带engine
+"""
+import base64
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+from gallery import DEFAULT_ENGINE, GalleryManager, TenantGallery
+
+HOG_ENGINE = 'hog-v1'
+
+
+def random_feature(seed):
+    feature = np.random.default_rng(seed).normal(size=128).astype(np.float32)
+    return feature / np.linalg.norm(feature)
+
+
+def feature_code(feature):
+    return base64.b64encode(feature.astype(np.float32).tobytes()).decode('ascii')
+
+
+def expect_engine_error(func):
+    try:
+        func()
+    except ValueError as e:
+        assert "特征引擎不一致" in str(e), str(e)
+        return
+    raise AssertionError("不同引擎的特征应被拒绝")
+
+
+def test_resnet_gallery_rejects_hog_feature():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 't1.npz')
+        gallery = TenantGallery.load('t1', path)
+        gallery.enroll('alice', random_feature(1), DEFAULT_ENGINE)
+        expect_engine_error(lambda: gallery.enroll('bob', random_feature(2), HOG_ENGINE))
+        expect_engine_error(lambda: gallery.check_engine(HOG_ENGINE))
+        assert len(gallery.view) == 1
+
+        # 重新加载（其他worker）同样按元数据中的引擎拒绝
+        reloaded = TenantGallery.load('t1', path)
+        expect_engine_error(lambda: reloaded.enroll('bob', random_feature(2), HOG_ENGINE))
+
+        manager = GalleryManager({'directory': directory})
+        expect_engine_error(lambda: manager.search('t1', random_feature(1), engine=HOG_ENGINE))
+        assert manager.search('t1', random_feature(1), engine=DEFAULT_ENGINE)['best_match']['user_id'] == 'alice'
+    print("✅ ResNet特征库拒绝HOG特征")
+
+
+def test_service_requires_engine():
+    """接口缺少engine时返回400，不按默认引擎把特征混入特征库"""
+    import face_service
+
+    with tempfile.TemporaryDirectory() as directory:
+        saved = face_service.gallery_manager
+        face_service.gallery_manager = GalleryManager({'directory': directory})
+        try:
+            client = face_service.app.test_client()
+            code = feature_code(random_feature(3))
+
+            response = client.post('/api/gallery/t2/enroll', json={'user_id': 'alice', 'feature_code': code})
+            assert response.status_code == 400 and 'engine' in response.get_json()['message']
+            assert not os.path.exists(os.path.join(directory, 't2.log'))
+
+            response = client.post('/api/gallery/t2/enroll',
+                                   json={'user_id': 'alice', 'feature_code': code, 'engine': DEFAULT_ENGINE})
+            assert response.status_code == 200
+
+            response = client.post('/api/gallery/t2/enroll',
+                                   json={'user_id': 'bob', 'feature_code': code, 'engine': HOG_ENGINE})
+            assert response.status_code == 400 and "特征引擎不一致" in response.get_json()['message']
+
+            assert client.post('/api/gallery/t2/search', json={'feature_code': code}).status_code == 400
+            response = client.post('/api/gallery/t2/search', json={'feature_code': code, 'engine': HOG_ENGINE})
+            assert response.status_code == 400
+            response = client.post('/api/gallery/t2/search', json={'feature_code': code, 'engine': DEFAULT_ENGINE})
+            assert response.get_json()['best_match']['user_id'] == 'alice'
+
+            response = client.post('/api/gallery/t2/rebuild',
+                                   json={'users': [{'user_id': 'bob', 'feature_code': code}], 'wait': True})
+            assert response.status_code == 400 and 'engine' in response.get_json()['message']
+        finally:
+            face_service.gallery_manager.close()
+            face_service.gallery_manager = saved
+    print("✅ 特征库接口缺少engine时返回400")
+
+
+if __name__ == "__main__":
+    print("开始测试特征引擎标签...")
+    test_resnet_gallery_rejects_hog_feature()
+    test_service_requires_engine()
+    print("🎉 全部通过")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+验证int8量化特征库与float32特征库的检索结果一致：同一批查询的top-1用户和距离
+特征按身份聚类生成（同人特征围绕身份中心、异人距离较远），与真实人脸特征的分布接近
+
+用法: python test_gallery_quantize.py [特征库大小] [查询数]
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+from gallery import GallerySnapshot, QuantizedSnapshot
+
+
+def make_gallery(size, seed, normalized=True):
+    """size个身份的录入特征；normalized为False时模拟未归一化的原始特征（范数不一）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(size, 128)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    if not normalized:
+        centers *= rng.uniform(0.3, 0.6, size=(size, 1)).astype(np.float32)
+    return [f'u{i}' for i in range(size)], centers
+
+
+def make_queries(features, count, seed, noise):
+    """对随机抽取的身份加噪声生成查询（同人距离约为noise * sqrt(128)），返回(查询, 对应行号)"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(features), count, replace=False)
+    queries = features[rows] + rng.normal(scale=noise, size=(count, 128)).astype(np.float32)
+    return queries.astype(np.float32), rows
+
+
+def make_impostors(count, seed, scale=1.0):
+    """库外人员的查询：与库中各身份距离相近，top-1的差距很小，最能暴露量化误差"""
+    queries = np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True) * scale
+
+
+def compare(ids, features, queries, top_k=1, rerank_candidates=64, masked_rows=None):
+    """返回(top_k列表完全一致的查询比例, 最大距离偏差, float快照内存, 量化快照内存)"""
+    exact = GallerySnapshot(ids, features)
+    with tempfile.TemporaryDirectory() as directory:
+        quantized = QuantizedSnapshot.from_features(ids, features, os.path.join(directory, 'q.f32.npy'),
+                                                    rerank_candidates)
+        agree, max_error = 0, 0.0
+        for query in queries:
+            expected = exact.search(query, top_k, masked_rows)
+            actual = quantized.search(query, top_k, masked_rows)
+            agree += [user for user, _ in expected] == [user for user, _ in actual]
+            max_error = max([max_error] + [abs(a[1] - e[1]) for a, e in zip(actual, expected)])
+        nbytes = quantized.nbytes
+        del quantized
+    return agree / len(queries), max_error, exact.nbytes, nbytes
+
+
+def test_top1_matches_float(size=20000, count=500):
+    """默认重排序候选数下，量化检索的top-1用户和距离与float检索完全一致（库内、库外人员各一半）"""
+    for normalized in (True, False):
+        ids, features = make_gallery(size, 1, normalized)
+        queries, _ = make_queries(features, count // 2, 2, noise=0.03 if normalized else 0.015)
+        queries = np.vstack([queries, make_impostors(count - count // 2, 7, 1.0 if normalized else 0.45)])
+        rate, error, float_bytes, int8_bytes = compare(ids, features, queries)
+        assert rate == 1.0, f"top-1一致率 {rate:.4f}"
+        assert error < 1e-5, f"距离偏差 {error}"
+        assert int8_bytes * 3 < float_bytes, (int8_bytes, float_bytes)
+        print(f"✅ {'归一化' if normalized else '未归一化'}特征 {size}条 x {count}次查询: top-1一致率 {rate:.2%}, "
+              f"最大距离偏差 {error:.2e}, 内存 {float_bytes / 2 ** 20:.1f}MB -> {int8_bytes / 2 ** 20:.1f}MB")
+
+
+def test_topk_and_masked_rows(size=5000, count=200):
+    """top-5列表一致，被删除（屏蔽）的行不出现在结果中"""
+    ids, features = make_gallery(size, 3)
+    queries, rows = make_queries(features, count, 4, noise=0.03)
+    masked = np.unique(rows[::2])
+    rate, error, _, _ = compare(ids, features, queries, top_k=5, masked_rows=masked)
+    assert rate == 1.0 and error < 1e-5, (rate, error)
+    print(f"✅ top-5列表与屏蔽行一致率 {rate:.2%}")
+
+
+def test_coarse_ranking_without_rerank(size=20000, count=500):
+    """只用int8粗排（不重排序）时的top-1一致率：库内人员应基本一致，库外人员的差异由重排序消除"""
+    ids, features = make_gallery(size, 5)
+    queries, _ = make_queries(features, count, 6, noise=0.03)
+    genuine, _, _, _ = compare(ids, features, queries, rerank_candidates=1)
+    impostor, _, _, _ = compare(ids, features, make_impostors(count, 8), rerank_candidates=1)
+    assert genuine >= 0.99, f"粗排top-1一致率 {genuine:.4f}"
+    print(f"✅ 仅int8粗排的top-1一致率: 库内人员 {genuine:.2%}, 库外人员 {impostor:.2%}")
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    print("开始验证int8量化特征库...")
+    test_top1_matches_float(size, count)
+    test_topk_and_masked_rows()
+    test_coarse_ranking_without_rerank(size, count)
+    print("🎉 全部通过")
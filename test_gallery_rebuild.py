@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+测试特征库重建：旁路构建、样本查询校验、校验失败保留旧版本、构建期间的录入保留、
+旧快照上的检索结束后才退役
+"""
+import base64
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+import gallery as gallery_module
+from gallery import DEFAULT_ENGINE, GalleryManager, GallerySnapshot, TenantGallery, validate_snapshot
+
+
+def random_features(count, seed):
+    features = np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def top_user(gallery, feature):
+    return gallery.search(feature, 1)[0][0]
+
+
+def expect_error(func, text):
+    try:
+        func()
+    except ValueError as e:
+        assert text in str(e), str(e)
+        return
+    raise AssertionError(f"应当抛出ValueError: {text}")
+
+
+def test_validate_snapshot():
+    features = random_features(20, 1)
+    ids = [f"u{i}" for i in range(20)]
+    assert validate_snapshot(GallerySnapshot(ids, features), sample_queries=8) == 8
+    assert validate_snapshot(GallerySnapshot(ids[:3], features[:3]), sample_queries=8) == 3
+    assert validate_snapshot(GallerySnapshot([], np.empty((0, 128))), sample_queries=8) == 0
+
+    expect_error(lambda: validate_snapshot(GallerySnapshot(ids[:19] + ["u0"], features)), "重复的user_id")
+    broken = features.copy()
+    broken[5, 3] = np.nan
+    expect_error(lambda: validate_snapshot(GallerySnapshot(ids, broken)), "NaN或Inf")
+
+    # 检索结果与ID错位（例如特征行顺序错了）时样本检索不回自身
+    snapshot = GallerySnapshot(ids, features)
+    with mock.patch.object(snapshot, 'search', lambda query, top_k: [("u19", 0.0)]):
+        expect_error(lambda: validate_snapshot(snapshot), "未能检索回自身")
+    print("✅ 快照校验")
+
+
+def test_failed_rebuild_keeps_old_version():
+    with tempfile.TemporaryDirectory() as directory:
+        manager = GalleryManager({'directory': directory})
+        try:
+            old = random_features(5, 2)
+            for i, feature in enumerate(old):
+                manager.enroll('t1', f"old{i}", feature, engine=DEFAULT_ENGINE)
+
+            new = random_features(4, 3)
+            expect_error(lambda: manager.rebuild('t1', ["a", "b", "a", "c"], new, wait=True), "重复的user_id")
+            assert manager.get_status()["rebuild_failures"] == 1
+            failure = manager.get_status()["swap_events"][-1]
+            assert failure["kind"] == "rebuild" and not failure["success"]
+
+            gallery = manager.get('t1')
+            assert len(gallery.view) == 5 and top_user(gallery, old[2]) == "old2"
+            reloaded = TenantGallery.load('t1', os.path.join(directory, 't1.npz'))
+            assert len(reloaded.view) == 5
+            reloaded.close()
+        finally:
+            manager.close()
+    print("✅ 校验失败时保留旧版本")
+
+
+def test_rebuild_keeps_concurrent_enrolls():
+    """构建期间写入的日志叠加到新基础矩阵上，重新加载得到相同结果"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 't1.npz')
+        gallery = TenantGallery.load('t1', path)
+        old = random_features(3, 4)
+        for i, feature in enumerate(old):
+            gallery.enroll(f"old{i}", feature)
+
+        new = random_features(6, 5)
+        late = random_features(1, 6)[0]
+        real_validate = gallery_module.validate_snapshot
+
+        def validate_with_enroll(snapshot, sample_queries):
+            # 校验期间另一个请求录入：检索仍使用旧视图
+            gallery.enroll("late", late)
+            assert top_user(gallery, old[0]) == "old0"
+            return real_validate(snapshot, sample_queries)
+
+        with mock.patch.object(gallery_module, 'validate_snapshot', validate_with_enroll):
+            event = gallery.rebuild([f"new{i}" for i in range(6)], new)
+        assert event["success"] and event["size"] == 6
+        assert event["validated_queries"] == 6
+
+        assert len(gallery.view) == 7 and top_user(gallery, late) == "late"
+        assert top_user(gallery, new[4]) == "new4"
+        assert top_user(gallery, old[0]) != "old0"
+        reloaded = TenantGallery.load('t1', path)
+        assert sorted(reloaded.view.export()[0]) == sorted(gallery.view.export()[0])
+        reloaded.close()
+        gallery.close()
+    print("✅ 构建期间的录入保留到新版本")
+
+
+def test_swap_waits_for_inflight_searches():
+    with tempfile.TemporaryDirectory() as directory:
+        gallery = TenantGallery.load('t1', os.path.join(directory, 't1.npz'))
+        old = random_features(4, 7)
+        gallery.rebuild([f"old{i}" for i in range(4)], old)
+        old_base = gallery.view.base
+
+        # 模拟进行中的检索钉住旧快照
+        old_base.pin()
+        seen = {}
+
+        def finish_search():
+            time.sleep(0.3)
+            # 旧快照还在使用时新检索已经看到新版本
+            seen["base_swapped"] = gallery.view.base is not old_base
+            seen["new_result"] = top_user(gallery, new[1])
+            old_base.unpin()
+
+        new = random_features(5, 8)
+        thread = threading.Thread(target=finish_search)
+        thread.start()
+        event = gallery.rebuild([f"new{i}" for i in range(5)], new)
+        thread.join()
+        assert seen == {"base_swapped": True, "new_result": "new1"}, seen
+        assert event["drain_ms"] >= 200 and old_base.inflight == 0, event
+        gallery.close()
+    print(f"✅ 旧快照上的检索结束后才退役（等待 {event['drain_ms']:.0f}ms）")
+
+
+def test_rebuild_endpoint():
+    import face_service
+
+    def user(user_id, feature):
+        return {"user_id": user_id, "feature_code": base64.b64encode(feature.tobytes()).decode('ascii')}
+
+    with tempfile.TemporaryDirectory() as directory:
+        saved = face_service.gallery_manager
+        face_service.gallery_manager = GalleryManager({'directory': directory})
+        try:
+            client = face_service.app.test_client()
+            features = random_features(3, 9)
+            users = [user(f"u{i}", feature) for i, feature in enumerate(features)]
+            response = client.post('/api/gallery/t3/rebuild',
+                                   json={'users': users, 'engine': DEFAULT_ENGINE, 'wait': True})
+            body = response.get_json()
+            assert response.status_code == 200 and body["event"]["size"] == 3, body
+
+            response = client.post('/api/gallery/t3/rebuild',
+                                   json={'users': users + [users[0]], 'engine': DEFAULT_ENGINE, 'wait': True})
+            assert response.status_code == 400 and "重复的user_id" in response.get_json()["message"]
+            response = client.post('/api/gallery/t3/search',
+                                   json={'feature_code': users[1]["feature_code"], 'engine': DEFAULT_ENGINE})
+            assert response.get_json()["best_match"]["user_id"] == "u1"
+        finally:
+            face_service.gallery_manager.close()
+            face_service.gallery_manager = saved
+    print("✅ 重建接口")
+
+
+if __name__ == "__main__":
+    print("开始测试特征库重建...")
+    test_validate_snapshot()
+    test_failed_rebuild_keeps_old_version()
+    test_rebuild_keeps_concurrent_enrolls()
+    test_swap_waits_for_inflight_searches()
+    test_rebuild_endpoint()
+    print("🎉 全部通过")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+测试解码前的图像头部检查：格式识别、颜色模式、像素预算和JPEG缩小解码倍数
+解压炸弹只需要文件头：构造的图像头声明巨大尺寸，像素数据几乎为空
+"""
+import io
+import struct
+import sys
+import zlib
+
+sys.path.insert(0, '.')
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_probe import REDUCED_COLOR_FLAGS, ImagePolicy, ImageRejected, probe_image
+
+
+def encode(mode, size, image_format, **params):
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def png_header(width, height, bit_depth=8, color_type=2):
+    """文件头声明width x height、像素数据为空的PNG（PIL读到第一个IDAT块为止）"""
+    ihdr = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', ihdr) + png_chunk(b'IDAT', b'') + png_chunk(b'IEND', b'')
+
+
+def expect_rejected(func, text):
+    try:
+        func()
+    except ImageRejected as e:
+        assert text in str(e), str(e)
+        return
+    raise AssertionError(f"应当拒绝: {text}")
+
+
+def test_probe_reads_header_only():
+    info = probe_image(encode('RGB', (640, 480), 'JPEG'))
+    assert (info.format, info.width, info.height, info.mode, info.pixels) == ('JPEG', 640, 480, 'RGB', 307200)
+
+    # 声明40000x40000（16亿像素）的PNG：只有几十字节，探测不分配像素内存
+    bomb = png_header(40000, 40000)
+    assert len(bomb) < 64
+    expect_rejected(lambda: probe_image(bomb), "像素数超过上限")
+    header = probe_image(png_header(9000, 8000))
+    assert (header.width, header.height) == (9000, 8000)
+
+    expect_rejected(lambda: probe_image(b'not an image'), "无法识别的图像格式")
+    expect_rejected(lambda: probe_image(b''), "无法识别的图像格式")
+    print("✅ 只读取文件头，解压炸弹和无法识别的数据被拒绝")
+
+
+def test_modes():
+    policy = ImagePolicy()
+    for mode in ('L', 'RGB', 'RGBA', 'P'):
+        assert policy.check(encode(mode, (32, 32), 'PNG'))[1] == 1, mode
+    assert policy.check(encode('CMYK', (32, 32), 'JPEG'))[0].mode == 'CMYK'
+    # 16位灰度转换为8位时会截断
+    expect_rejected(lambda: policy.check(encode('I;16', (32, 32), 'PNG')), "不支持的图像颜色模式")
+    expect_rejected(lambda: ImagePolicy({'allowed_modes': ['RGB']}).check(encode('L', (8, 8), 'PNG')),
+                    "不支持的图像颜色模式")
+    print("✅ 颜色模式检查")
+
+
+def test_pixel_budget():
+    policy = ImagePolicy({'max_pixels': 1000000})
+    jpeg = encode('RGB', (2000, 1500), 'JPEG')
+    png = png_header(2000, 1500)
+
+    # JPEG按能落入预算的最小倍数缩小解码：3000000 -> 1/2为750000
+    assert policy.check(jpeg) == (probe_image(jpeg), 2)
+    assert policy.check(jpeg, max_pixels=200000) == (probe_image(jpeg), 4)
+    assert policy.check(jpeg, max_pixels=50000)[1] == 8
+    expect_rejected(lambda: policy.check(jpeg, max_pixels=40000), "像素数超过上限")
+    expect_rejected(lambda: policy.check(jpeg, allow_reduce=False), "上限1000000")
+
+    # 其他格式缩小解码仍要先解出整幅图像：直接拒绝
+    expect_rejected(lambda: policy.check(png), "像素数超过上限")
+    expect_rejected(lambda: ImagePolicy({'max_pixels': 1000000, 'over_budget': 'reject'}).check(jpeg),
+                    "像素数超过上限")
+
+    # 0为不限制；预算内按原尺寸解码
+    assert policy.check(png, max_pixels=0)[1] == 1
+    assert policy.check(encode('RGB', (1000, 1000), 'JPEG'))[1] == 1
+    print("✅ 像素预算与JPEG缩小解码倍数")
+
+
+def test_reduced_decode_size():
+    """按检查返回的倍数缩小解码，结果不超过预算"""
+    policy = ImagePolicy({'max_pixels': 500000})
+    jpeg = encode('RGB', (1999, 1501), 'JPEG', quality=90)
+    info, factor = policy.check(jpeg)
+    image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), REDUCED_COLOR_FLAGS[factor])
+    assert factor == 4 and image.shape[0] * image.shape[1] <= 500000, (factor, image.shape)
+    print(f"✅ {info.width}x{info.height}按1/{factor}解码为{image.shape[1]}x{image.shape[0]}")
+
+
+def test_invalid_config():
+    try:
+        ImagePolicy({'over_budget': 'shrink'})
+    except ValueError as e:
+        assert 'over_budget' in str(e)
+    else:
+        raise AssertionError("over_budget取值无效时应抛出ValueError")
+    print("✅ 无效的over_budget配置")
+
+
+if __name__ == "__main__":
+    print("开始测试图像头部检查...")
+    test_probe_reads_header_only()
+    test_modes()
+    test_pixel_budget()
+    test_reduced_decode_size()
+    test_invalid_config()
+    print("🎉 全部通过")
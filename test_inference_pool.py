@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试推理进程池的超时处理：超时任务的槽位在任务真正结束后才归还
+进程池用线程模拟（不加载模型），槽位使用真实的共享内存环形缓冲区
+"""
+import multiprocessing
+import sys
+import threading
+import time
+
+sys.path.insert(0, '.')
+
+import cv2
+import numpy as np
+
+from image_probe import ImagePolicy
+from inference_pool import ImageRing, InferencePool
+
+
+class FakeExtractor:
+    """本进程提取器：只提供文件头检查和回退路径"""
+
+    image_policy = ImagePolicy()
+
+    def extract_feature_from_bytes(self, image_data, deadline=None):
+        return {"success": True, "inline": True}
+
+
+class FakeAsyncResult:
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise multiprocessing.TimeoutError
+        return self._value
+
+
+class FakePool:
+    """按delay延迟完成任务的进程池；任务结束时读取槽位，检查图像未被覆盖"""
+
+    def __init__(self, ring, delay):
+        self.ring = ring
+        self.delay = delay
+        self.corrupted = 0
+        self.completed = 0
+
+    def apply_async(self, func, args, callback=None, error_callback=None):
+        slot, shape = args[0], args[1]
+        expected = int(self.ring.array(slot, shape).sum())
+        result = FakeAsyncResult()
+
+        def finish():
+            if int(self.ring.array(slot, shape).sum()) != expected:
+                self.corrupted += 1
+            self.completed += 1
+            result._value = {"success": True, "slot": slot}
+            result._done.set()
+            callback(result._value)
+
+        threading.Timer(self.delay, finish).start()
+        return result
+
+
+def make_pool(slots, task_timeout, delay):
+    pool = InferencePool({'enabled': True, 'processes': 1, 'slots': slots, 'slot_size': '1MB',
+                          'task_timeout': task_timeout}, FakeExtractor())
+    pool._ring = ImageRing(pool.slots, pool.slot_size)
+    pool._pool = FakePool(pool._ring, delay)
+    return pool
+
+
+def jpeg(value):
+    image = np.full((120, 120, 3), value, dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def close(pool):
+    pool._pool = None
+    pool._ring.close()
+
+
+def test_success_releases_slot():
+    pool = make_pool(slots=1, task_timeout=2, delay=0.05)
+    try:
+        for _ in range(3):
+            assert pool.extract_feature_from_bytes(jpeg(100))["success"]
+        time.sleep(0.05)
+        status = pool.get_status()
+        assert status["tasks"] == 3 and status["free_slots"] == 1 and status["inflight"] == 0
+    finally:
+        close(pool)
+    print("✅ 正常完成的任务归还槽位")
+
+
+def test_timeout_keeps_slot_until_task_finishes():
+    pool = make_pool(slots=1, task_timeout=0.1, delay=0.5)
+    try:
+        result = pool.extract_feature_from_bytes(jpeg(50))
+        assert not result["success"] and "超时" in result["message"]
+        status = pool.get_status()
+        # 任务仍在执行：槽位未归还，下一个请求不能覆盖它
+        assert status["timeouts"] == 1 and status["abandoned"] == 1 and status["free_slots"] == 0
+
+        busy = pool.extract_feature_from_bytes(jpeg(200))
+        assert busy.get("busy") and pool.get_status()["busy"] == 1
+        assert pool.load() == {"enabled": True, "inflight": 0, "busy": 1, "abandoned": 1, "free_slots": 0}
+
+        time.sleep(0.6)
+        status = pool.get_status()
+        assert status["abandoned"] == 0 and status["free_slots"] == 1 and status["inflight"] == 0
+        assert pool._pool.completed == 1 and pool._pool.corrupted == 0
+    finally:
+        close(pool)
+    print("✅ 超时任务的槽位在任务结束后归还")
+
+
+def test_concurrent_timeouts():
+    """多个线程同时超时：计数准确，任务结束后全部槽位归还，图像未被覆盖"""
+    pool = make_pool(slots=4, task_timeout=0.05, delay=0.2)
+    try:
+        threads = [threading.Thread(target=pool.extract_feature_from_bytes, args=(jpeg(10 * i),))
+                   for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(0.5)
+
+        status = pool.get_status()
+        assert status["timeouts"] + status["busy"] == 16, status
+        assert status["tasks"] == status["timeouts"]
+        assert status["abandoned"] == 0 and status["inflight"] == 0 and status["free_slots"] == 4
+        assert pool._pool.corrupted == 0
+    finally:
+        close(pool)
+    print("✅ 并发超时的计数与槽位归还")
+
+
+if __name__ == "__main__":
+    print("开始测试推理进程池超时处理...")
+    test_success_releases_slot()
+    test_timeout_keeps_slot_until_task_finishes()
+    test_concurrent_timeouts()
+    print("🎉 全部通过")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试内存插桩：未启用时traced_stage不追踪也不记录，启用后阶段峰值计入进行中的请求，
+提取请求经/admin/memory返回各阶段峰值
+"""
+import contextlib
+import sys
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+import memory_trace
+from memory_trace import traced_stage
+
+IMAGE = 'test-pictures/admin.jpg'
+MB = 1024 * 1024
+
+
+@traced_stage('allocate')
+def allocate(size):
+    """分配size字节后释放，返回数组长度"""
+    return len(np.ones(size, dtype=np.uint8))
+
+
+@contextlib.contextmanager
+def installed_tracker(**config):
+    """安装启用的追踪器，结束后停止追踪并恢复未安装状态"""
+    saved = memory_trace._tracker
+    tracker = memory_trace.install(dict(config, enabled=True))
+    try:
+        yield tracker
+    finally:
+        memory_trace._tracker = saved
+        tracemalloc.stop()
+
+
+def test_disabled_stage_is_noop():
+    assert memory_trace._tracker is None
+    tracker = memory_trace.install({'enabled': False})
+    assert not tracker.enabled and memory_trace._tracker is None and not tracemalloc.is_tracing()
+    assert memory_trace.stage('allocate') is memory_trace.stage('other')
+    assert allocate(MB) == MB and allocate.__name__ == 'allocate'
+    assert tracker.stages == {} and not tracemalloc.is_tracing()
+    print("✅ 未启用时阶段为空操作")
+
+
+def test_stage_peaks_recorded_in_request():
+    with installed_tracker() as tracker:
+        assert tracemalloc.is_tracing()
+        token = tracker.request_started('/api/face/extract')
+        allocate(4 * MB)
+        allocate(MB)
+        with tracker.stage('outer'):
+            allocate(2 * MB)
+        tracker.request_finished(token)
+
+        stages = tracker.stages
+        assert stages['allocate']['count'] == 3
+        assert 4 * MB <= stages['allocate']['max_peak_bytes'] < 5 * MB
+        # 外层阶段包含嵌套阶段的峰值
+        assert 2 * MB <= stages['outer']['max_peak_bytes'] < 3 * MB
+
+        record = tracker.requests[-1]
+        assert record["path"] == '/api/face/extract' and not record["overlapped"]
+        assert record["stages"]["allocate"] == stages['allocate']['max_peak_bytes']
+        assert record["peak_bytes"] >= 4 * MB and record["rss_after"] > 0
+    assert not tracemalloc.is_tracing() and memory_trace._tracker is None
+    print(f"✅ 阶段峰值计入请求（{record['peak_bytes'] / MB:.1f}MB）")
+
+
+def test_overlapping_requests_flagged():
+    with installed_tracker() as tracker:
+        first = tracker.request_started('/a')
+        second = tracker.request_started('/b')
+        tracker.request_finished(second)
+        tracker.request_finished(first)
+        third = tracker.request_started('/c')
+        tracker.request_finished(third)
+    assert [(r["path"], r["overlapped"]) for r in tracker.requests] == [('/b', True), ('/a', True), ('/c', False)]
+    print("✅ 重叠请求标记overlapped")
+
+
+def test_extract_request_stages():
+    import face_service
+
+    with open(IMAGE, 'rb') as f:
+        image = f.read()
+
+    get_section = face_service.get_section
+
+    def patched_section(section):
+        return {'enabled': True, 'token': ''} if section == 'admin' else get_section(section)
+
+    saved = face_service.memory_tracker
+    with installed_tracker() as tracker, mock.patch.object(face_service, 'get_section', patched_section):
+        face_service.memory_tracker = tracker
+        try:
+            client = face_service.app.test_client()
+            response = client.post('/api/face/extract', data=image, content_type='application/octet-stream')
+            assert response.status_code == 200 and response.get_json()["success"]
+
+            response = client.get('/admin/memory', query_string={'limit': 5})
+            body = response.get_json()
+            assert response.status_code == 200 and body["tracing"] and len(body["top_sites"]) <= 5, body
+            request_record = body["recent_requests"][-1]
+            assert request_record["path"] == '/api/face/extract'
+            assert {'decode', 'prescreen', 'detect', 'encode'} <= set(request_record["stages"]), request_record
+            # 解码出的整帧RGB数组计入decode阶段
+            assert request_record["stages"]["decode"] >= 1230 * 1024 * 3
+
+            response = client.get('/admin/memory', query_string={'group_by': 'function'})
+            assert response.status_code == 400 and "不支持的分组方式" in response.get_json()["message"]
+        finally:
+            face_service.memory_tracker = saved
+
+    # 配置中未启用时管理接口返回404
+    if not saved.enabled:
+        with mock.patch.object(face_service, 'get_section', patched_section):
+            response = face_service.app.test_client().get('/admin/memory')
+        assert response.status_code == 404 and "memory.enabled" in response.get_json()["message"]
+    print(f"✅ 提取请求的阶段峰值：decode {request_record['stages']['decode'] / MB:.1f}MB")
+
+
+if __name__ == "__main__":
+    print("开始测试内存插桩...")
+    test_disabled_stage_is_noop()
+    test_stage_peaks_recorded_in_request()
+    test_overlapping_requests_flagged()
+    test_extract_request_stages()
+    print("🎉 全部通过")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+测试多人脸提取：合影中的所有人脸一次编码、按面积保留前max_faces个，max_faces参数无效时接口返回400
+"""
+import base64
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import cv2
+import numpy as np
+
+IMAGE = os.path.join('test-pictures', 'admin.jpg')
+
+
+def group_photo():
+    """三个人脸：两个大小相同，一个较小，JPEG字节"""
+    portrait = cv2.imread(IMAGE)
+    large = cv2.resize(portrait, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+    small = cv2.resize(portrait, None, fx=0.18, fy=0.18, interpolation=cv2.INTER_AREA)
+    canvas = np.full((330, 800, 3), 128, dtype=np.uint8)
+    canvas[10:10 + large.shape[0], 10:10 + large.shape[1]] = large
+    canvas[10:10 + large.shape[0], 290:290 + large.shape[1]] = large
+    canvas[40:40 + small.shape[0], 580:580 + small.shape[1]] = small
+    return cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+
+def decode(face):
+    return np.frombuffer(base64.b64decode(face["feature_code"]), dtype=np.float32)
+
+
+def test_max_faces_param():
+    from face_service import _max_faces_param
+
+    assert _max_faces_param({}) is None and _max_faces_param({'max_faces': ''}) is None
+    assert _max_faces_param({'max_faces': '3'}) == 3 and _max_faces_param({'max_faces': 2}) == 2
+    for value in ('abc', '0', -1, 0, 1.5, True, [2], '2.5'):
+        try:
+            _max_faces_param({'max_faces': value})
+        except ValueError as e:
+            assert "max_faces必须是正整数" in str(e)
+        else:
+            raise AssertionError(f"max_faces={value!r}应被拒绝")
+    print("✅ max_faces参数校验")
+
+
+def test_invalid_max_faces_returns_400():
+    import face_service
+
+    client = face_service.app.test_client()
+    image = group_photo()
+    with mock.patch.object(face_service.extraction_backend, 'extract_faces_from_bytes') as extract:
+        response = client.post('/api/face/extract/multi', data=image, query_string={'max_faces': 'abc'},
+                               content_type='application/octet-stream')
+        assert response.status_code == 400 and "max_faces" in response.get_json()["message"]
+        response = client.post('/api/face/extract/multi',
+                               json={'image': base64.b64encode(image).decode('ascii'), 'max_faces': 0})
+        assert response.status_code == 400
+        assert extract.call_count == 0
+    print("✅ 无效max_faces返回400")
+
+
+def test_group_photo_single_encode():
+    import face_service
+
+    extractor = face_service.face_extractor
+    image = group_photo()
+    with mock.patch.object(extractor, '_encode_faces', wraps=extractor._encode_faces) as encode_faces:
+        result = extractor.extract_faces_from_bytes(image)
+    assert result["success"] and result["detected_count"] == 3 and result["face_count"] == 3, result["message"]
+    assert encode_faces.call_count == 1 and len(encode_faces.call_args[0][1]) == 3
+
+    areas = [(f["face_location"]["bottom"] - f["face_location"]["top"]) *
+             (f["face_location"]["right"] - f["face_location"]["left"]) for f in result["faces"]]
+    assert areas == sorted(areas, reverse=True), areas
+    features = [decode(face) for face in result["faces"]]
+    assert max(np.linalg.norm(features[0] - feature) for feature in features[1:]) < 0.4
+
+    # 只保留面积最大的前max_faces个，detected_count仍为检测到的总数
+    client = face_service.app.test_client()
+    response = client.post('/api/face/extract/multi', data=image, query_string={'max_faces': '2'},
+                           content_type='application/octet-stream')
+    body = response.get_json()
+    assert response.status_code == 200 and body["face_count"] == 2 and body["detected_count"] == 3
+    assert all(face["face_location"]["left"] < 580 for face in body["faces"])
+    print(f"✅ 合影 {result['detected_count']} 个人脸一次编码")
+
+
+if __name__ == "__main__":
+    print("开始测试多人脸提取...")
+    test_max_faces_param()
+    test_invalid_max_faces_returns_400()
+    test_group_photo_single_encode()
+    print("🎉 全部通过")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+测试按需剖析：开始剖析立即返回，剖析期间的真实提取请求被剖析，结束后按剖析ID取回结果
+（结果在文件中，其他worker的ProfileManager也能读到）
+"""
+import contextlib
+import marshal
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+from profiler import ProfileManager
+
+IMAGE = os.path.join('test-pictures', 'admin.jpg')
+
+
+@contextlib.contextmanager
+def admin_client(directory):
+    """启用管理接口（未配置令牌，只允许本机访问），剖析结果写入directory"""
+    import face_service
+
+    get_section = face_service.get_section
+
+    def patched_section(section):
+        return {'enabled': True, 'token': ''} if section == 'admin' else get_section(section)
+
+    saved = face_service.profile_manager
+    face_service.profile_manager = ProfileManager(directory)
+    try:
+        with mock.patch.object(face_service, 'get_section', patched_section):
+            yield face_service.app.test_client()
+    finally:
+        face_service.profile_manager = saved
+
+
+def profile_service(directory, params, fetch_format):
+    """开始剖析 -> 发送一个真实提取请求 -> 轮询直到剖析结束，返回(开始响应内容, 结果响应)"""
+    import face_service
+
+    with open(IMAGE, 'rb') as f:
+        image = f.read()
+
+    with admin_client(directory) as client:
+        started = time.time()
+        response = client.post('/admin/profile', query_string=params)
+        # 立即返回，不等待剖析结束
+        assert response.status_code == 202 and time.time() - started < 5, response.get_json()
+        start = response.get_json()
+        profile_id = start["profile_id"]
+
+        progress = client.get(f'/admin/profile/{profile_id}')
+        assert progress.status_code == 202 and progress.get_json()["status"] == "running"
+        assert client.post('/admin/profile', query_string=params).status_code == 409
+
+        response = client.post('/api/face/extract', data=image, content_type='application/octet-stream')
+        assert response.status_code == 200 and response.get_json()["success"], response.get_json()
+
+        deadline = time.time() + 30
+        while True:
+            result = client.get(f'/admin/profile/{profile_id}', query_string={'format': fetch_format})
+            if result.status_code != 202:
+                break
+            assert time.time() < deadline, "剖析未按请求数提前结束"
+            time.sleep(0.05)
+        assert result.status_code == 200, result.get_data(as_text=True)
+        assert face_service.profile_manager.session is None
+        return start, result
+
+
+def test_sample_profile():
+    with tempfile.TemporaryDirectory() as directory:
+        start, result = profile_service(directory, {'seconds': 60, 'requests': 1, 'interval_ms': 2}, 'json')
+        summary = result.get_json()
+        assert summary["status"] == "finished" and summary["requests"] == 1 and summary["samples"] > 0, summary
+        assert any('face_extractor.py:' in item["stack"] for item in summary["top_stacks"]), summary["top_stacks"][:3]
+        assert summary["elapsed_seconds"] < 60
+
+        # 取回请求落在其他worker：从剖析目录读取
+        other_worker = ProfileManager(directory)
+        assert other_worker.load(start["profile_id"])["status"] == "finished"
+        assert 'face_service.py:extract_feature' in other_worker.collapsed(start["profile_id"])
+    print(f"✅ sample剖析: {summary['samples']} 次采样")
+
+
+def test_cprofile_profile():
+    with tempfile.TemporaryDirectory() as directory:
+        start, result = profile_service(directory, {'mode': 'cprofile', 'seconds': 60, 'requests': 1}, 'raw')
+        stats = marshal.loads(result.get_data())
+        assert any(name == 'extract_feature_from_bytes' for _, _, name in stats)
+
+        text = ProfileManager(directory).pstats_text(start["profile_id"], limit=20)
+        assert 'extract_feature_from_bytes' in text, text[:500]
+    print("✅ cprofile剖析")
+
+
+def test_result_errors():
+    import face_service
+
+    with tempfile.TemporaryDirectory() as directory:
+        with admin_client(directory) as client:
+            assert client.get('/admin/profile/' + '0' * 32).status_code == 404
+            assert client.get('/admin/profile/not-an-id').status_code == 400
+            assert client.post('/admin/profile', query_string={'seconds': 301}).status_code == 400
+            assert client.post('/admin/profile', query_string={'mode': 'trace'}).status_code == 400
+            assert face_service.profile_manager.session is None
+    # 管理接口默认关闭
+    assert face_service.app.test_client().get('/admin/profile/' + '0' * 32).status_code == 404
+    print("✅ 无效的剖析ID和参数")
+
+
+if __name__ == "__main__":
+    print("开始测试按需剖析...")
+    test_sample_profile()
+    test_cprofile_profile()
+    test_result_errors()
+    print("🎉 全部通过")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+测试就绪检查的处理能力：按进程计算（sync worker为1、gthread为线程数、进程池为进程数），
+进行中的提取请求超出处理能力的部分超过max_queue_depth时/ready返回503
+"""
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+from readiness import ReadinessMonitor, request_capacity
+from thread_budget import WORKER_THREADS_ENV
+
+
+def test_request_capacity():
+    env = {key: value for key, value in os.environ.items() if key != WORKER_THREADS_ENV}
+    with mock.patch.dict(os.environ, env, clear=True):
+        # 非gunicorn启动或sync worker：每个进程同时只处理一个请求
+        assert request_capacity({}) == 1
+        assert request_capacity({'capacity': 0}, SimpleNamespace(enabled=False, processes=3)) == 1
+        assert request_capacity({}, SimpleNamespace(enabled=True, processes=3)) == 3
+        assert request_capacity({'capacity': 5}, SimpleNamespace(enabled=True, processes=3)) == 5
+    with mock.patch.dict(os.environ, {WORKER_THREADS_ENV: '4'}):
+        assert request_capacity({}) == 4
+    print("✅ 处理能力按进程计算")
+
+
+def wait_inflight(monitor, count):
+    deadline = time.time() + 10
+    while monitor.inflight < count:
+        assert time.time() < deadline, f"进行中请求数 {monitor.inflight} 未达到 {count}"
+        time.sleep(0.01)
+
+
+def test_ready_503_when_saturated():
+    """sync worker（处理能力1）+ max_queue_depth=2：第4个并发提取请求使/ready返回503"""
+    import face_service
+
+    release = threading.Event()
+
+    class BlockingBackend:
+        def extract_feature_from_bytes(self, image_data, deadline=None):
+            release.wait(10)
+            return {"success": True, "quality": 1.0}
+
+    monitor = ReadinessMonitor({'max_queue_depth': 2, 'self_test_image': ''}, capacity=1)
+    monitor.self_test = {"status": "passed"}
+    saved = face_service.readiness, face_service.extraction_backend
+    face_service.readiness, face_service.extraction_backend = monitor, BlockingBackend()
+    threads = []
+    try:
+        client = face_service.app.test_client()
+        assert client.get('/ready').status_code == 200
+
+        def post():
+            face_service.app.test_client().post('/api/face/extract', data=b'image',
+                                                content_type='application/octet-stream')
+
+        for count in range(1, 5):
+            thread = threading.Thread(target=post)
+            thread.start()
+            threads.append(thread)
+            wait_inflight(monitor, count)
+            response = client.get('/ready')
+            details = response.get_json()
+            assert details["capacity"] == 1 and details["queue_depth"] == count - 1
+            if count <= 3:
+                assert response.status_code == 200, details
+            else:
+                assert response.status_code == 503, details
+                assert any("排队请求数3超过2" in reason for reason in details["reasons"]), details
+
+        release.set()
+        for thread in threads:
+            thread.join(10)
+        assert monitor.inflight == 0
+        assert client.get('/ready').status_code == 200
+    finally:
+        release.set()
+        face_service.readiness, face_service.extraction_backend = saved
+    print("✅ 并发提取请求占满处理能力后/ready返回503")
+
+
+if __name__ == "__main__":
+    print("开始测试就绪检查...")
+    test_request_capacity()
+    test_ready_503_when_saturated()
+    print("🎉 全部通过")
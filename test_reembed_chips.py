@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试人脸图重新编码的输出迁移特征库：按原特征对应回已录入的用户（编码器用固定映射模拟，不加载模型）
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+import numpy as np
+
+import reembed_chips
+from chip_archive import ChipArchive, l2_normalize
+from gallery import TenantGallery
+from reembed_chips import match_reembedded, reembed
+
+
+class FakeEncoder:
+    """新模型：特征为人脸图像素均值的固定函数"""
+
+    def compute_face_descriptor(self, chips):
+        return [new_feature(chip) for chip in chips]
+
+
+def new_feature(chip):
+    return (np.linspace(0.5, 1.5, 128) * (chip.mean() / 255.0 + 0.5)).astype(np.float32)
+
+
+def chip(value):
+    return np.full((150, 150, 3), value, dtype=np.uint8)
+
+
+def old_feature(seed):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32) * 0.1
+
+
+def write_archive(directory, entries):
+    """entries: (像素值, 原特征, 是否归一化)"""
+    archive = ChipArchive({'enabled': True, 'directory': directory, 'chunk_size': 2})
+    for value, feature, normalized in entries:
+        assert archive.submit(chip(value), feature, 'dlib-resnet-v1', normalized)
+    archive.flush()
+
+
+def run_reembed(directory, output):
+    reembed_chips._init_worker = lambda model_path, batch_size: setattr(reembed_chips, '_encoder', FakeEncoder())
+    arrays, stats = reembed(directory, 'unused.dat', workers=1, batch_size=2)
+    np.savez(output, engine=np.array('dlib-resnet-v2'), **arrays)
+    return arrays, stats
+
+
+def test_migrate_gallery():
+    with tempfile.TemporaryDirectory() as directory:
+        archive_dir = os.path.join(directory, 'chips')
+        features = [old_feature(i) for i in range(4)]
+        # 0、1为多人脸接口（原始特征），2为Base64接口（归一化特征），3的人脸图没有录入
+        write_archive(archive_dir, [(10, features[0], False), (20, features[1], False),
+                                    (30, l2_normalize(features[2]), True), (40, features[3], False)])
+        output = os.path.join(directory, 'v2.npz')
+        arrays, stats = run_reembed(archive_dir, output)
+        assert stats["chip_count"] == 4 and list(arrays["normalized"]) == [False, False, True, False]
+        assert np.allclose(np.linalg.norm(arrays["features"][2]), 1.0)
+
+        gallery = TenantGallery.load('t1', os.path.join(directory, 't1.npz'))
+        gallery.enroll('alice', features[0])
+        gallery.enroll('bob', features[1])
+        gallery.compact()
+        gallery.enroll('carol', l2_normalize(features[2]))
+        gallery.enroll('dave', old_feature(99))
+
+        ids, migrated, missing = match_reembedded(*gallery.export(), output)
+        assert ids == ['alice', 'bob', 'carol'] and missing == ['dave']
+        assert np.array_equal(migrated[0], new_feature(chip(10)))
+        assert np.array_equal(migrated[1], new_feature(chip(20)))
+        assert np.array_equal(migrated[2], l2_normalize(new_feature(chip(30))))
+    print("✅ 按原特征把新特征对应回已录入的用户")
+
+
+def test_legacy_unnormalized_archive():
+    """旧版本存档：Base64接口的记录保存的是归一化前的特征，按归一化后的特征匹配并归一化新特征"""
+    with tempfile.TemporaryDirectory() as directory:
+        archive_dir = os.path.join(directory, 'chips')
+        feature = old_feature(7)
+        write_archive(archive_dir, [(50, feature, False)])
+        output = os.path.join(directory, 'v2.npz')
+        run_reembed(archive_dir, output)
+
+        ids, migrated, missing = match_reembedded(['erin'], l2_normalize(feature)[None, :], output)
+        assert ids == ['erin'] and not missing
+        assert np.array_equal(migrated[0], l2_normalize(new_feature(chip(50))))
+    print("✅ 旧版本存档按归一化后的原特征匹配")
+
+
+if __name__ == "__main__":
+    print("开始测试人脸图重新编码的迁移...")
+    test_migrate_gallery()
+    test_legacy_unnormalized_archive()
+    print("🎉 全部通过")
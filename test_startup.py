@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+测试打包与冷启动测量：onedir/onefile的PyInstaller参数、运行时文件放在可执行文件旁、
+打包后相对路径按可执行文件目录解析，以及measure_startup的计时方式
+"""
+import os
+import socket
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import build_cross_platform
+import config_loader
+from measure_startup import measure, summarize, time_until_exit, time_until_ready
+
+
+def expect_runtime_error(func, text):
+    try:
+        func()
+    except RuntimeError as e:
+        assert text in str(e), str(e)
+        return
+    raise AssertionError(f"应当抛出RuntimeError: {text}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_pyinstaller_args():
+    args = build_cross_platform.pyinstaller_args("service", "onedir", "/venv/face_recognition_models")
+    assert args[0] == "--onedir" and args[-1] == "face_service.py"
+    assert args[args.index("--name") + 1] == "face_http_service"
+    assert args[args.index("--add-data") + 1] == f"/venv/face_recognition_models{os.pathsep}face_recognition_models"
+    hidden = [args[i + 1] for i, arg in enumerate(args) if arg == "--hidden-import"]
+    assert "inference_worker" in hidden and "face_recognition_models" in hidden
+
+    args = build_cross_platform.pyinstaller_args("extractor", "onefile", None)
+    assert args[0] == "--onefile" and "--add-data" not in args and args[-1] == "face_extractor.py"
+    print("✅ PyInstaller参数")
+
+
+def test_runtime_files_next_to_executable():
+    with tempfile.TemporaryDirectory() as release_dir:
+        build_cross_platform.copy_runtime_files(release_dir)
+        assert os.path.isfile(os.path.join(release_dir, "config.json"))
+        assert os.path.isfile(os.path.join(release_dir, "test-pictures", "admin.jpg"))
+
+        # 打包后配置和模型的相对路径按可执行文件目录解析，与工作目录无关
+        executable = os.path.join(release_dir, "face_http_service")
+        with mock.patch.object(sys, 'frozen', True, create=True), mock.patch.object(sys, 'executable', executable):
+            assert config_loader.resolve_path("models/yunet.onnx") == os.path.join(release_dir, "models/yunet.onnx")
+            assert config_loader._default_config_path() == os.path.join(release_dir, "config.json")
+    assert config_loader.resolve_path("/abs/model.onnx") == "/abs/model.onnx"
+    print("✅ 运行时文件放在可执行文件旁")
+
+
+def test_time_until_exit():
+    elapsed = time_until_exit([sys.executable, '-c', 'import time; time.sleep(0.2)'], timeout=30)
+    assert 0.2 <= elapsed < 10, elapsed
+    expect_runtime_error(lambda: time_until_exit([sys.executable, '-c', 'raise SystemExit(3)'], timeout=30),
+                         "命令退出码 3")
+
+    report = measure([sys.executable, '-c', 'pass'], runs=2, url=None, timeout=30)
+    assert report["runs"] == 2 and report["min_ms"] <= report["median_ms"] <= report["max_ms"]
+    assert summarize([0.3, 0.1, 0.2]) == {"runs": 3, "min_ms": 100.0, "median_ms": 200.0, "max_ms": 300.0,
+                                          "samples_ms": [300.0, 100.0, 200.0]}
+    print(f"✅ 计时到进程退出（{elapsed * 1000:.0f}ms）")
+
+
+def test_time_until_ready():
+    port = free_port()
+    # 延迟0.3秒才开始监听，轮询期间的连接失败不算错误
+    server = (f"import time, http.server; time.sleep(0.3); "
+              f"http.server.HTTPServer(('127.0.0.1', {port}), http.server.SimpleHTTPRequestHandler).serve_forever()")
+    elapsed = time_until_ready([sys.executable, '-c', server], f"http://127.0.0.1:{port}/", timeout=30)
+    assert 0.3 <= elapsed < 10, elapsed
+
+    expect_runtime_error(lambda: time_until_ready([sys.executable, '-c', 'raise SystemExit(2)'],
+                                                  f"http://127.0.0.1:{port}/", timeout=30), "服务进程提前退出")
+    expect_runtime_error(lambda: time_until_ready([sys.executable, '-c', 'import time; time.sleep(30)'],
+                                                  f"http://127.0.0.1:{port}/", timeout=0.5), "未返回200")
+    print(f"✅ 计时到服务返回200（{elapsed * 1000:.0f}ms）")
+
+
+if __name__ == "__main__":
+    print("开始测试打包与冷启动测量...")
+    test_pyinstaller_args()
+    test_runtime_files_next_to_executable()
+    test_time_until_exit()
+    test_time_until_ready()
+    print("🎉 全部通过")
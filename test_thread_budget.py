@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试线程预算：核心在各worker之间的划分、BLAS线程数环境变量在numpy导入之前设置、
+已显式设置的环境变量不被覆盖，以及numpy先于线程预算导入时给出警告
+"""
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, '.')
+
+from thread_budget import BLAS_ENV_VARS, WORKER_COUNT_ENV, WORKER_INDEX_ENV, plan_cores
+
+
+def run_python(code, **env):
+    """在新进程中执行代码（环境变量只在numpy首次导入时读取），返回最后一行输出的JSON"""
+    child_env = {name: value for name, value in os.environ.items() if name not in BLAS_ENV_VARS}
+    child_env.update(env)
+    result = subprocess.run([sys.executable, '-c', code], env=child_env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_plan_cores():
+    cores = list(range(8))
+    assert [plan_cores(cores, 3, i) for i in range(3)] == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert [plan_cores(cores, 2, i) for i in range(2)] == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert plan_cores(cores, 1, 0) == cores and plan_cores(cores, 0, 0) == cores
+    # worker多于核心时每个worker一个核心，轮流共用
+    assert [plan_cores([2, 5], 5, i) for i in range(5)] == [[2], [5], [2], [5], [2]]
+    print("✅ 核心划分")
+
+
+def test_env_set_before_numpy_import():
+    layout = run_python(
+        "import json, sys\n"
+        "from thread_budget import apply_thread_budget\n"
+        "assert 'numpy' not in sys.modules\n"
+        "layout = apply_thread_budget({'threads_per_worker': 3})\n"
+        "import numpy, os\n"
+        "layout['seen_by_numpy'] = {name: os.environ[name] for name in layout['env']}\n"
+        "print(json.dumps(layout))",
+        MKL_NUM_THREADS='2')
+    assert layout["threads"] == 3 and layout["warnings"] == [], layout
+    assert layout["opencv_threads"] == 3
+    # 部署时显式设置的值保持不变
+    expected = {name: '3' for name in BLAS_ENV_VARS}
+    expected['MKL_NUM_THREADS'] = '2'
+    assert layout["env"] == expected and layout["seen_by_numpy"] == expected
+    print("✅ BLAS线程数在numpy导入前设置")
+
+
+def test_service_import_order():
+    """face_service在导入numpy/cv2之前应用线程预算"""
+    # 等启动自检线程结束再退出，避免解释器退出时打断进行中的推理
+    layout = run_python(
+        "import json, threading, face_service\n"
+        "for thread in threading.enumerate():\n"
+        "    if thread.name == 'readiness-self-test':\n"
+        "        thread.join()\n"
+        "print(json.dumps(face_service.get_layout()))",
+        **{WORKER_INDEX_ENV: '0', WORKER_COUNT_ENV: '1'})
+    assert layout["enabled"] and layout["warnings"] == [], layout
+    assert layout["env"] == {name: str(layout["threads"]) for name in BLAS_ENV_VARS}
+    print(f"✅ 服务启动时线程预算先于numpy导入（{layout['threads']}线程）")
+
+
+def test_numpy_imported_first_warns():
+    layout = run_python(
+        "import json, numpy\n"
+        "from thread_budget import apply_thread_budget\n"
+        "print(json.dumps(apply_thread_budget({})))")
+    assert any("numpy已在线程预算之前导入" in warning for warning in layout["warnings"]), layout
+
+    layout = run_python(
+        "import json\n"
+        "from thread_budget import apply_thread_budget\n"
+        "print(json.dumps(apply_thread_budget({'enabled': False})))")
+    assert not layout["enabled"] and "env" not in layout
+    print("✅ numpy先导入时给出警告")
+
+
+if __name__ == "__main__":
+    print("开始测试线程预算...")
+    test_plan_cores()
+    test_env_set_before_numpy_import()
+    test_service_import_order()
+    test_numpy_imported_first_warns()
+    print("🎉 全部通过")
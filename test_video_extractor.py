@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+测试视频特征提取：在合成的短视频上检查轨迹关联（同一人脸跨关键帧保持一条轨迹、离开后再出现为新轨迹）、
+各轨迹最佳帧一起编码，以及截止时间到达时返回部分轨迹
+"""
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, '.')
+
+import cv2
+import numpy as np
+
+from face_extractor import SimpleFaceExtractor
+from video_extractor import VideoFaceExtractor
+
+IMAGE = os.path.join('test-pictures', 'admin.jpg')
+FPS = 10
+FRAME_SIZE = (400, 320)
+
+_extractor = None
+
+
+def get_extractor():
+    global _extractor
+    if _extractor is None:
+        _extractor = SimpleFaceExtractor()
+    return _extractor
+
+
+def write_clip(path):
+    """18帧：0-7帧人脸向右移动，8-11帧没有人脸，12-17帧人脸在另一位置再次出现"""
+    portrait = cv2.imread(IMAGE)
+    portrait = cv2.resize(portrait, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+    height, width = portrait.shape[:2]
+    rng = np.random.default_rng(0)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, FRAME_SIZE)
+    assert writer.isOpened()
+    for index in range(18):
+        frame = rng.integers(90, 110, (FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)
+        if index < 8 or index >= 12:
+            x = 20 + 4 * index if index < 8 else 100 + 2 * (index - 12)
+            frame[4:4 + height, x:x + width] = portrait
+        writer.write(frame)
+    writer.release()
+
+
+class CountdownDeadline:
+    """第checks次检查时过期（抽帧循环每帧检查一次）"""
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def expired(self):
+        self.checks -= 1
+        return self.checks < 0
+
+    def remaining_ms(self):
+        return 0.0 if self.checks < 0 else 60000.0
+
+
+def extract(path, deadline=None):
+    extractor = get_extractor()
+    video_extractor = VideoFaceExtractor(extractor, {'sample_fps': FPS, 'keyframe_interval': 4})
+    with mock.patch.object(extractor, '_encode_crops', wraps=extractor._encode_crops) as encode_crops, \
+            mock.patch.object(extractor, '_encode_faces', wraps=extractor._encode_faces) as encode_faces:
+        result = video_extractor.extract_from_file(path, deadline=deadline)
+    return result, encode_crops, encode_faces
+
+
+def decode_feature(track):
+    import base64
+    return np.frombuffer(base64.b64decode(track["feature_code"]), dtype=np.float32)
+
+
+def test_tracks_and_batched_encoding():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'clip.avi')
+        write_clip(path)
+        result, encode_crops, encode_faces = extract(path)
+
+    assert result["success"] and result["sampled_frames"] == 18, result
+    # 同一人脸在关键帧上的检测结果关联到原轨迹；离开画面后再出现是新轨迹
+    tracks = result["tracks"]
+    assert result["track_count"] == 2, [(t["first_frame"], t["last_frame"]) for t in tracks]
+    assert (tracks[0]["first_frame"], tracks[0]["last_frame"], tracks[0]["frame_count"]) == (0, 7, 8)
+    assert (tracks[1]["first_frame"], tracks[1]["last_frame"], tracks[1]["frame_count"]) == (12, 17, 6)
+    assert 5 <= result["detector_runs"] < result["sampled_frames"], result["detector_runs"]
+    assert "deadline_exceeded" not in result and "partial" not in result
+
+    # 两条轨迹的最佳帧在一次调用中编码
+    assert encode_crops.call_count == 1 and len(encode_crops.call_args[0][0]) == 2
+    assert encode_faces.call_count == 0
+    distance = np.linalg.norm(decode_feature(tracks[0]) - decode_feature(tracks[1]))
+    assert distance < 0.4, distance
+    print(f"✅ 2条轨迹，检测 {result['detector_runs']}/{result['sampled_frames']} 帧，同一人距离 {distance:.3f}")
+
+
+def test_batched_encoding_matches_single():
+    """批量编码与逐张_encode_faces结果相同"""
+    extractor = get_extractor()
+    image = cv2.cvtColor(cv2.resize(cv2.imread(IMAGE), None, fx=0.25, fy=0.25), cv2.COLOR_BGR2RGB)
+    location = extractor.detector.detect(image)[0]
+    shifted = np.ascontiguousarray(image[10:, 5:])
+    shifted_location = (location[0] - 10, location[1] - 5, location[2] - 10, location[3] - 5)
+
+    batched = extractor._encode_crops([image, shifted], [location, shifted_location])
+    single = [extractor._encode_faces(image, [location])[0], extractor._encode_faces(shifted, [shifted_location])[0]]
+    for a, b in zip(batched, single):
+        assert np.allclose(a, b, atol=1e-5), np.abs(a - b).max()
+    assert extractor._encode_crops([], []) == []
+    print("✅ 批量编码与逐张编码一致")
+
+
+def test_deadline_returns_partial_tracks():
+    import face_service
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'clip.avi')
+        write_clip(path)
+
+        result, encode_crops, _ = extract(path, CountdownDeadline(6))
+        assert result["deadline_exceeded"] and result["partial"] and result["success"], result
+        assert result["sampled_frames"] == 6 and result["track_count"] == 1
+        assert (result["tracks"][0]["first_frame"], result["tracks"][0]["frame_count"]) == (0, 6)
+        assert "截止时间" in result["message"] and encode_crops.call_count == 1
+        assert face_service._result_status(result) == 200
+
+        # 到达截止时间时还没有轨迹：超时失败，不编码
+        result, encode_crops, _ = extract(path, CountdownDeadline(0))
+        assert result["deadline_exceeded"] and not result["success"] and result["tracks"] == []
+        assert "partial" not in result and encode_crops.call_count == 0
+        assert face_service._result_status(result) == 504
+    print("✅ 截止时间到达时返回部分轨迹")
+
+
+if __name__ == "__main__":
+    print("开始测试视频特征提取...")
+    test_tracks_and_batched_encoding()
+    test_batched_encoding_matches_single()
+    test_deadline_returns_partial_tracks()
+    print("🎉 全部通过")
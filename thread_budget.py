@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+线程预算 - 按CPU核心数给每个worker进程分配线程
+多个gunicorn worker各自让OpenBLAS、OpenCV按全部核心数开线程会严重超额占用CPU，
+拖慢尾延迟；这里在启动时把可用核心平均分给各worker，设置各库的线程数，并可选绑定CPU亲和性
+
+BLAS线程数只能通过环境变量在numpy导入前设置，因此本模块不能导入numpy，
+face_service.py必须在导入numpy/cv2之前调用apply_thread_budget()
+"""
+
+import logging
+import os
+import sys
+from typing import Dict, List, Optional
+
+from config_loader import get_section
+
+logger = logging.getLogger(__name__)
+
+# numpy链接的BLAS实现和OpenMP读取的线程数环境变量
+BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# gunicorn.conf.py在fork后设置，进程内读取
+WORKER_INDEX_ENV = 'FACE_SERVICE_WORKER_INDEX'
+WORKER_COUNT_ENV = 'FACE_SERVICE_WORKERS'
+# 每个worker处理请求的线程数（sync worker为1，gthread为--threads）
+WORKER_THREADS_ENV = 'FACE_SERVICE_WORKER_THREADS'
+
+_layout: Optional[Dict] = None
+
+
+def available_cores() -> List[int]:
+    """当前进程允许使用的CPU核心（容器cpuset限制也会体现在这里）"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cores(cores: List[int], workers: int, worker_index: int) -> List[int]:
+    """把核心按连续区间平均分给各worker，余数分给前面的worker；worker多于核心时每个worker一个核心轮流共用"""
+    workers = max(1, workers)
+    if workers >= len(cores):
+        return [cores[worker_index % len(cores)]]
+
+    base, extra = divmod(len(cores), workers)
+    start = worker_index * base + min(worker_index, extra)
+    size = base + (1 if worker_index < extra else 0)
+    return cores[start:start + size]
+
+
+def apply_thread_budget(config: Optional[Dict] = None, worker_index: Optional[int] = None,
+                        workers: Optional[int] = None) -> Dict:
+    """计算并应用本进程的线程布局，返回布局（同时保存供/health读取）"""
+    global _layout
+
+    config = config if config is not None else get_section('threads')
+    if worker_index is None:
+        worker_index = int(os.environ.get(WORKER_INDEX_ENV, 0))
+    if workers is None:
+        workers = int(config.get('workers') or os.environ.get(WORKER_COUNT_ENV, 1))
+
+    cores = available_cores()
+    layout = {
+        "enabled": bool(config.get('enabled', True)),
+        "pid": os.getpid(),
+        "worker_index": worker_index,
+        "workers": workers,
+        "available_cores": len(cores),
+        "warnings": []
+    }
+    if not layout["enabled"]:
+        _layout = layout
+        return layout
+
+    assigned = plan_cores(cores, workers, worker_index)
+    threads = int(config.get('threads_per_worker') or 0) or len(assigned)
+    layout.update(cores=assigned, threads=threads, pinned=False)
+
+    # BLAS/OpenMP：环境变量只在库加载时读取一次，已显式设置的值保持不变
+    if 'numpy' in sys.modules:
+        layout["warnings"].append("numpy已在线程预算之前导入，BLAS线程数环境变量不再生效")
+    for name in BLAS_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    layout["env"] = {name: os.environ[name] for name in BLAS_ENV_VARS}
+
+    # OpenCV：运行时设置
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+        layout["opencv_threads"] = cv2.getNumThreads()
+    except ImportError:
+        pass
+
+    if config.get('pin_affinity', False):
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, assigned)
+                layout["pinned"] = True
+            except OSError as e:
+                layout["warnings"].append(f"绑定CPU亲和性失败: {e}")
+        else:
+            layout["warnings"].append("当前平台不支持绑定CPU亲和性")
+
+    for warning in layout["warnings"]:
+        logger.warning(warning)
+    logger.info("线程预算: worker %s/%s, 核心 %s, 线程数 %s%s", worker_index, workers, assigned, threads,
+                "（已绑定）" if layout["pinned"] else "")
+
+    _layout = layout
+    return layout
+
+
+def get_layout() -> Optional[Dict]:
+    """当前进程的线程布局，用于健康检查"""
+    return _layout
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+视频人脸特征提取
+按配置的采样率抽帧，只在关键帧或跟踪丢失时运行完整人脸检测，
+其余帧使用dlib相关滤波跟踪器，每条轨迹只输出质量最好的一帧特征（各轨迹的最佳帧一起编码）
+"""
+
+import base64
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import dlib
+import numpy as np
+
+from config_loader import get_section
+from deadline import expired_result
+
+
+def _iou(box_a: tuple, box_b: tuple) -> float:
+    """计算两个(top, right, bottom, left)框的交并比"""
+    top = max(box_a[0], box_b[0])
+    right = min(box_a[1], box_b[1])
+    bottom = min(box_a[2], box_b[2])
+    left = max(box_a[3], box_b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+
+    inter = (right - left) * (bottom - top)
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class _FaceTrack:
+    """单条人脸轨迹：跟踪器 + 当前最佳帧"""
+
+    def __init__(self, track_id: int, frame: np.ndarray, location: tuple, frame_index: int):
+        self.track_id = track_id
+        self.tracker = dlib.correlation_tracker()
+        self.location = location
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.frame_count = 0
+        self.lost = False
+
+        # 最佳帧信息（只保存带边距的人脸裁剪，不保留整帧）
+        self.best_quality = -1.0
+        self.best_frame = frame_index
+        self.best_location = location
+        self.best_crop = None
+        self.best_crop_location = None
+
+        self.restart(frame, location)
+
+    def restart(self, frame: np.ndarray, location: tuple):
+        """用检测结果重新初始化跟踪器"""
+        top, right, bottom, left = location
+        self.tracker.start_track(frame, dlib.rectangle(int(left), int(top), int(right), int(bottom)))
+        self.location = location
+        self.lost = False
+
+    def update(self, frame: np.ndarray, min_confidence: float) -> bool:
+        """更新跟踪器，置信度过低时标记为丢失"""
+        confidence = self.tracker.update(frame)
+        position = self.tracker.get_position()
+
+        height, width = frame.shape[:2]
+        top = max(0, int(position.top()))
+        right = min(width, int(position.right()))
+        bottom = min(height, int(position.bottom()))
+        left = max(0, int(position.left()))
+
+        if confidence < min_confidence or right - left < 20 or bottom - top < 20:
+            self.lost = True
+            return False
+
+        self.location = (top, right, bottom, left)
+        return True
+
+
+class VideoFaceExtractor:
+    """视频人脸提取器（复用SimpleFaceExtractor的编码和质量评估）"""
+
+    def __init__(self, face_extractor, config: Optional[Dict] = None):
+        self.face_extractor = face_extractor
+
+        video_config = config if config is not None else get_section('video')
+        self.sample_fps = float(video_config.get('sample_fps', 2.0))
+        self.keyframe_interval = max(1, int(video_config.get('keyframe_interval', 10)))
+        self.track_min_confidence = float(video_config.get('track_min_confidence', 7.0))
+        self.iou_threshold = float(video_config.get('iou_threshold', 0.3))
+        self.max_frames = int(video_config.get('max_frames', 0))
+        self.crop_margin = float(video_config.get('crop_margin', 0.5))
+
+    def extract_from_file(self, video_path: str, sample_fps: Optional[float] = None, deadline=None) -> Dict:
+        """从视频文件提取每条人脸轨迹的最佳特征
+        
+        deadline过期后停止抽帧，已有的轨迹照常编码后返回，结果带deadline_exceeded和partial标记；
+        过期时还没有任何轨迹则与其他接口一样返回超时失败
+        """
+        start_time = time.time()
+        sample_fps = self.sample_fps if sample_fps is None else float(sample_fps)
+
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            return {
+                "success": False,
+                "tracks": [],
+                "track_count": 0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": "无法打开视频文件"
+            }
+
+        try:
+            video_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+            frame_step = max(1, int(round(video_fps / sample_fps))) if sample_fps > 0 else 1
+
+            tracks: List[_FaceTrack] = []
+            finished: List[_FaceTrack] = []
+            next_track_id = 1
+            frame_index = -1
+            sampled_frames = 0
+            detector_runs = 0
+            deadline_exceeded = False
+
+            while True:
+                if deadline is not None and deadline.expired():
+                    deadline_exceeded = True
+                    break
+
+                # 跳过的帧只grab不retrieve，避免解码后的颜色转换和拷贝
+                frame_index += 1
+                if not capture.grab():
+                    break
+                if frame_index % frame_step != 0:
+                    continue
+
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+                # 先用跟踪器推算所有轨迹的位置（关键帧上用于和检测结果关联）
+                need_detection = sampled_frames % self.keyframe_interval == 0
+                for track in tracks:
+                    if not track.update(frame, self.track_min_confidence):
+                        need_detection = True
+
+                # 关键帧或有轨迹丢失：运行完整检测并重新关联
+                if need_detection:
+                    detector_runs += 1
+                    # 关键帧只用主检测后端，不走兜底
+                    detections = self.face_extractor.detector.detect(frame, allow_fallback=False)
+                    tracks, ended, next_track_id = self._associate(frame, frame_index, tracks, detections, next_track_id)
+                    finished.extend(ended)
+
+                for track in tracks:
+                    track.last_frame = frame_index
+                    track.frame_count += 1
+                    self._update_best(track, frame, frame_index)
+
+                sampled_frames += 1
+                if self.max_frames and sampled_frames >= self.max_frames:
+                    break
+
+            finished.extend(tracks)
+            finished = [track for track in finished if track.best_crop is not None]
+            if deadline_exceeded and not finished:
+                return expired_result(start_time, "剩余视频帧", tracks=[], track_count=0,
+                                      sampled_frames=sampled_frames, detector_runs=detector_runs)
+
+            # 各轨迹的最佳帧人脸图一起编码（编码器只调用一次）
+            encodings = self.face_extractor._encode_crops([track.best_crop for track in finished],
+                                                          [track.best_crop_location for track in finished])
+
+            results = []
+            for track, encoding in zip(finished, encodings):
+                feature_bytes = encoding.astype(np.float32).tobytes()
+                top, right, bottom, left = (int(v) for v in track.best_location)
+                results.append({
+                    "track_id": track.track_id,
+                    "first_frame": track.first_frame,
+                    "last_frame": track.last_frame,
+                    "frame_count": track.frame_count,
+                    "best_frame": track.best_frame,
+                    "best_time": track.best_frame / video_fps,
+                    "face_location": {
+                        "top": top,
+                        "right": right,
+                        "bottom": bottom,
+                        "left": left
+                    },
+                    "feature_code": base64.b64encode(feature_bytes).decode('utf-8'),
+                    "quality": track.best_quality
+                })
+
+            if deadline_exceeded:
+                message = f"请求已超过截止时间，返回前{sampled_frames}个采样帧中的轨迹"
+            else:
+                message = "特征提取成功" if results else "未检测到人脸"
+            result = {
+                "success": len(results) > 0,
+                "tracks": results,
+                "track_count": len(results),
+                "sampled_frames": sampled_frames,
+                "detector_runs": detector_runs,
+                "video_fps": video_fps,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": message,
+                "engine": self.face_extractor.feature_engine
+            }
+            if deadline_exceeded:
+                result.update(deadline_exceeded=True, partial=True)
+            return result
+
+        except Exception as e:
+            return {
+                "success": False,
+                "tracks": [],
+                "track_count": 0,
+                "process_time": (time.time() - start_time) * 1000,
+                "message": f"视频处理失败: {str(e)}"
+            }
+        finally:
+            capture.release()
+
+    def _associate(self, frame: np.ndarray, frame_index: int, tracks: List[_FaceTrack],
+                   detections: List[tuple], next_track_id: int):
+        """按IoU将检测结果关联到已有轨迹，返回(活动轨迹, 结束轨迹, 下一个轨迹ID)"""
+        active = []
+        unmatched = list(tracks)
+
+        for detection in detections:
+            best_track = None
+            best_iou = self.iou_threshold
+            for track in unmatched:
+                overlap = _iou(track.location, detection)
+                if overlap >= best_iou:
+                    best_track, best_iou = track, overlap
+
+            if best_track is not None:
+                unmatched.remove(best_track)
+                best_track.restart(frame, detection)
+                active.append(best_track)
+            else:
+                active.append(_FaceTrack(next_track_id, frame, detection, frame_index))
+                next_track_id += 1
+
+        # 关键帧上没有对应检测结果的轨迹视为结束
+        return active, unmatched, next_track_id
+
+    def _update_best(self, track: _FaceTrack, frame: np.ndarray, frame_index: int):
+        """计算当前帧质量，优于历史最佳时保存带边距的人脸裁剪"""
+        top, right, bottom, left = track.location
+        face_area = self.face_extractor._calculate_face_area(track.location, frame.shape)
+        quality = self.face_extractor._calculate_quality(frame, track.location, face_area)
+        if quality <= track.best_quality:
+            return
+
+        height, width = frame.shape[:2]
+        margin_y = int((bottom - top) * self.crop_margin)
+        margin_x = int((right - left) * self.crop_margin)
+        crop_top = max(0, top - margin_y)
+        crop_left = max(0, left - margin_x)
+        crop_bottom = min(height, bottom + margin_y)
+        crop_right = min(width, right + margin_x)
+
+        track.best_quality = quality
+        track.best_frame = frame_index
+        track.best_location = track.location
+        track.best_crop = np.ascontiguousarray(frame[crop_top:crop_bottom, crop_left:crop_right])
+        track.best_crop_location = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)